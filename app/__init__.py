@@ -1,11 +1,12 @@
 import os
-from flask import Flask, jsonify, redirect, request, render_template
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, redirect, request, render_template
 from flask_migrate import Migrate
 from os import environ
+from .database.replicas import RoutingSQLAlchemy
 
 # Instantiating global objects and variables
-db = SQLAlchemy()
+# the database session sends read-only requests to the replicas, when there are any
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 
 
@@ -21,9 +22,27 @@ def create_app(config=environ.get('FLASK_CONFIG') or 'development'):
     else:
         raise EnvironmentError(
             'Please specify a valid configuration profile in your FLASK_CONFIG environment variable for the application. Possible choices are `development`, `testing`, or `production`')
+    # selecting the json encoder for all responses
+    from .serialization import make_provider
+    app.json_provider = make_provider(app)
+    # sizing the connection pool of each worker
+    from .database.pool import engine_options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     # initializing application extentions
     db.init_app(app)
     migrate.init_app(app, db)
+    # logging the statements slower than SLOW_QUERY_MS, when it is set
+    from .database.slow_queries import init_slow_queries
+    init_slow_queries(app)
+    # timing the queries, auth, and serialization of each request, when INSTRUMENTATION is enabled
+    from .instrumentation import init_instrumentation
+    init_instrumentation(app)
+    # counting the requests of each endpoint for GET /metrics, when METRICS is enabled
+    from .metrics import init_metrics
+    init_metrics(app)
+    # sampling the stacks of some requests into PROFILE_DIR, when it is set
+    from .profiler import init_profiler
+    init_profiler(app)
     # bind all extentions to the app instance
     with app.app_context():
         # importing routes blueprint
@@ -51,6 +70,7 @@ def create_app(config=environ.get('FLASK_CONFIG') or 'development'):
                 return render_template('token.html')
         # force json errors for all endpoints
         from werkzeug.exceptions import HTTPException
+        from .serialization import jsonify
 
         @app.errorhandler(Exception)
         def other_errors_handler(error):
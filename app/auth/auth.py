@@ -1,15 +1,28 @@
-import json
 from os import environ
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+from .jwks import JWKSKeyStore, JWKSError
+from .token_cache import VerifiedTokenCache
+from ..instrumentation import timed
 
 
 AUTH0_DOMAIN = environ.get('AUTH0_DOMAIN')
 ALGORITHMS = ['RS256']
 API_AUDIENCE = environ.get('AUTH0_AUDIENCE')
 
+# the Auth0 signing keys, fetched once and shared by all requests of this process
+jwks_store = JWKSKeyStore(
+    f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+    default_ttl=int(environ.get('JWKS_CACHE_TTL') or 600),
+    min_refresh_interval=int(environ.get('JWKS_MIN_REFRESH_INTERVAL') or 30),
+    stale_ttl=int(environ.get('JWKS_STALE_TTL') or 3600)
+)
+# tokens that were already verified, so repeated requests skip the RS256 check
+token_cache = VerifiedTokenCache(
+    maxsize=int(environ.get('TOKEN_CACHE_SIZE') or 1024)
+)
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -68,25 +81,43 @@ def get_token_auth_header():
 
 
 '''
-check_permissions(permission, payload) method
+permission_set(payload) method
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
         payload: decoded jwt payload
 
     raises an AuthError if permissions are not included in the payload
-    raises an AuthError if the requested permission string is not in the payload permissions array
-    returns true otherwise
+    returns the payload permissions as a frozenset, so each lookup is O(1)
 '''
 
 
-def check_permissions(permission, payload):
+def permission_set(payload):
     if 'permissions' not in payload:
         raise AuthError({
             'code': 'invalid_claims',
             'description': 'Permissions not included in JWT.'
         }, 400)
+    return frozenset(payload['permissions'])
+
 
-    if permission not in payload['permissions']:
+'''
+check_permissions(permission, payload) method
+    @INPUTS
+        permission: string permission (i.e. 'post:drink')
+        payload: decoded jwt payload, or a precompiled permission set from permission_set()
+        all_of: permissions which must all be granted (optional)
+        any_of: permissions of which at least one must be granted (optional)
+
+    raises an AuthError if permissions are not included in the payload
+    raises an AuthError if the requested permission string is not in the payload permissions array
+    raises an AuthError if any of all_of, or none of any_of, is in the payload permissions array
+    returns true otherwise
+'''
+
+
+def check_permissions(permission, payload, all_of=frozenset(), any_of=frozenset()):
+    granted = payload if isinstance(payload, frozenset) else permission_set(payload)
+    if (permission and permission not in granted) or not granted.issuperset(all_of) \
+            or (any_of and granted.isdisjoint(any_of)):
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -101,6 +132,7 @@ def check_permissions(permission, payload):
 
     it should be an Auth0 token with key id (kid)
     it should verify the token using Auth0 /.well-known/jwks.json
+        the key set is cached by jwks_store, so Auth0 is only contacted when the keys expire or rotate
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -110,10 +142,6 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    # GET THE PUBLIC KEY FROM AUTH0
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-
     # GET THE DATA IN THE HEADER
     unverified_header = jwt.get_unverified_header(token)
 
@@ -125,15 +153,22 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    # GET THE PUBLIC KEY FROM THE CACHED AUTH0 KEY SET
+    try:
+        key = jwks_store.get_key(unverified_header['kid'])
+    except JWKSError:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
+    if key:
+        rsa_key = {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        }
 
     # Finally, verify!!!
     if rsa_key:
@@ -172,32 +207,59 @@ def verify_decode_jwt(token):
 
 
 '''
-@TODO implement @requires_auth(permission) decorator method
+@requires_auth(permission) decorator method
     @INPUTS
         permission: string permission (i.e. 'post:drink')
+        all_of: a list of permissions which must all be granted (optional)
+        any_of: a list of permissions of which at least one must be granted (optional)
 
     it should use the get_token_auth_header method to get the token
-    it should use the verify_decode_jwt method to decode the jwt
+    it should use the decode_token method to decode the jwt
+        unless the token was already verified and is still in token_cache
     it should use the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
 '''
 
 
-def requires_auth(permission=''):
+def requires_auth(permission='', all_of=(), any_of=()):
+    all_of = frozenset(all_of)
+    any_of = frozenset(any_of)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            try:
-                payload = verify_decode_jwt(token)
-            except:
-                raise AuthError({
-                    'code': 'invalid_header',
-                    'description': 'Unable to find the appropriate key.'
-                }, 400)
-
-            check_permissions(permission, payload)
+            with timed('auth'):
+                token = get_token_auth_header()
+                verified = token_cache.get(token)
+                if verified is None:
+                    verified = decode_token(token)
+                payload, granted = verified
+                check_permissions(permission, granted, all_of, any_of)
             return f(payload, *args, **kwargs)
 
         return wrapper
     return requires_auth_decorator
+
+
+'''
+decode_token(token) method
+    verifies the token with verify_decode_jwt and caches the payload until the token expires
+    raises an AuthError if the token can't be verified, or carries no permissions
+    returns a (payload, permissions) tuple, where permissions is a frozenset
+'''
+
+
+def decode_token(token):
+    try:
+        payload = verify_decode_jwt(token)
+    except AuthError:
+        # expired tokens, bad claims, or an unreachable key set
+        raise
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to find the appropriate key.'
+        }, 400)
+    verified = (payload, permission_set(payload))
+    token_cache.set(token, verified, payload.get('exp'))
+    return verified
@@ -0,0 +1,164 @@
+# jwks.py
+# an in-process store for the Auth0 JSON Web Key Set
+import json
+import re
+import threading
+import time
+from urllib.request import urlopen
+
+'''
+JWKSError Exception
+raised when the key set can't be fetched and no usable copy is cached
+'''
+
+
+class JWKSError(Exception):
+    pass
+
+
+'''
+parse_max_age(cache_control) method
+    @INPUTS
+        cache_control: the value of a Cache-Control response header (or None)
+
+    returns 0 if the response must not be cached (no-store / no-cache)
+    returns the s-maxage or max-age directive in seconds if present
+    returns None otherwise
+'''
+
+MAX_AGE_PATTERN = re.compile(r'(?:^|,)\s*(s-maxage|max-age)\s*=\s*"?(\d+)"?')
+
+
+def parse_max_age(cache_control):
+    if not cache_control:
+        return None
+    directives = cache_control.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    ages = dict(MAX_AGE_PATTERN.findall(directives))
+    # s-maxage takes precedence over max-age for shared caches
+    age = ages.get('s-maxage', ages.get('max-age'))
+    return int(age) if age is not None else None
+
+
+'''
+JWKSKeyStore
+caches the signing keys published at the given JWKS url
+    keys are kept for the Cache-Control max-age of the response (clamped to min_ttl and max_ttl)
+        or for default_ttl seconds when the response has no max-age
+    a kid missing from the cache triggers a refresh, at most once every min_refresh_interval seconds
+    expired keys are still served for up to stale_ttl seconds while a background refresh runs
+        so an Auth0 outage doesn't fail every request
+    after a failed fetch, no refresh is attempted for min_refresh_interval seconds
+        requests needing a refresh meanwhile fail fast with a JWKSError instead of queuing on Auth0
+EXAMPLE
+    store = JWKSKeyStore('https://example.auth0.com/.well-known/jwks.json')
+    key = store.get_key(unverified_header['kid'])
+'''
+
+
+class JWKSKeyStore:
+    def __init__(self, url, default_ttl=600, min_ttl=60, max_ttl=86400,
+                 min_refresh_interval=30, stale_ttl=3600, timeout=5):
+        self.url = url
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self._keys = {}
+        self._expires_at = 0
+        self._last_fetch = float('-inf')
+        self._last_failure = float('-inf')
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        # counters, exposed through stats()
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.stale_hits = 0
+
+    def fetch(self):
+        '''fetches the key set, returns (jwks, max_age)'''
+        with urlopen(self.url, timeout=self.timeout) as response:
+            max_age = parse_max_age(response.headers.get('Cache-Control'))
+            return json.loads(response.read()), max_age
+
+    def load(self, jwks, max_age=None):
+        '''replaces the cached keys with the given key set'''
+        ttl = self.default_ttl if max_age is None else max_age
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        keys = {key['kid']: key for key in jwks.get('keys', []) if 'kid' in key}
+        with self._lock:
+            self._keys = keys
+            self._expires_at = time.monotonic() + ttl
+
+    def refresh(self):
+        '''fetches and loads the key set, returns True on success'''
+        self._last_fetch = time.monotonic()
+        try:
+            jwks, max_age = self.fetch()
+            self.load(jwks, max_age)
+            self.refreshes += 1
+            return True
+        except Exception:
+            self._last_failure = time.monotonic()
+            self.refresh_failures += 1
+            return False
+
+    def _backing_off(self):
+        '''returns True within min_refresh_interval seconds of a failed fetch'''
+        return time.monotonic() - self._last_failure < self.min_refresh_interval
+
+    def _background_refresh(self):
+        try:
+            with self._fetch_lock:
+                self.refresh()
+        finally:
+            self._refreshing = False
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or self._backing_off():
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _is_unusable(self):
+        return not self._keys or time.monotonic() >= self._expires_at + self.stale_ttl
+
+    def get_key(self, kid):
+        '''
+        returns the cached jwk for kid, refreshing the key set when needed
+        returns None if the kid is unknown
+        raises JWKSError if no key set is available at all
+        '''
+        if self._is_unusable():
+            # nothing usable is cached, the request has to wait for Auth0, unless a fetch just failed
+            if self._backing_off():
+                raise JWKSError('Unable to fetch the JSON Web Key Set.')
+            with self._fetch_lock:
+                # another request may have refreshed the keys, or failed to, while we waited
+                if self._is_unusable() and (self._backing_off() or not self.refresh()):
+                    raise JWKSError('Unable to fetch the JSON Web Key Set.')
+        elif time.monotonic() >= self._expires_at:
+            # serve the expired keys while a fresh copy is fetched
+            self.stale_hits += 1
+            self.refresh_in_background()
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._last_fetch >= self.min_refresh_interval:
+            # the signing key may have been rotated since the last fetch
+            with self._fetch_lock:
+                if time.monotonic() - self._last_fetch >= self.min_refresh_interval:
+                    self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    def stats(self):
+        return {
+            'keys': len(self._keys),
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+            'stale_hits': self.stale_hits
+        }
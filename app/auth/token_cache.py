@@ -0,0 +1,76 @@
+# token_cache.py
+# a bounded LRU of already verified JWT payloads
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+'''
+VerifiedTokenCache
+remembers the decoded payloads of tokens that passed signature verification
+    entries are keyed by the sha256 digest of the token, so raw tokens are never kept in memory
+    an entry expires at the token's exp claim, tokens without exp are not cached
+    once maxsize entries are stored, the least recently used entry is evicted
+    a maxsize of 0 disables the cache
+EXAMPLE
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = verify_decode_jwt(token)
+        token_cache.set(token, payload, payload.get('exp'))
+'''
+
+
+class VerifiedTokenCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # counters, exposed through stats()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        '''returns the cached payload for token, or None'''
+        if not self.maxsize:
+            return None
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def set(self, token, value, expires_at):
+        '''caches value for token until the unix timestamp expires_at'''
+        if not self.maxsize or not isinstance(expires_at, (int, float)) or time.time() >= expires_at:
+            return
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
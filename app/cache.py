@@ -0,0 +1,370 @@
+# cache.py
+# a response cache for the read endpoints, invalidated by the write endpoints
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from flask import current_app, g, request
+from app.database.models import table_versions
+from app.database.replicas import get_replicas
+from app.compression import compress_response, encoded_etags
+
+'''
+CacheBackend
+the interface of response cache storage
+    entries are opaque values stored under string keys, with a time to live in seconds
+    tag versions are integers that only grow, and must not be evicted before the entries depending on them
+        generation() returns the current global version
+        bump(tags) sets every tag to a new global version, and returns it
+        versions(tags) returns the version of each tag (0 for tags that were never bumped)
+'''
+
+
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def generation(self):
+        raise NotImplementedError
+
+    def bump(self, tags):
+        raise NotImplementedError
+
+    def versions(self, tags):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+'''
+LRUCacheBackend
+keeps entries in this process, evicting the least recently used entry once maxsize entries are stored
+    tag versions are kept in a separate map of up to max_tags tags
+    when a tag version is evicted, its version becomes the floor of every unknown tag,
+        so an evicted tag can never make a stale entry look fresh
+'''
+
+
+class LRUCacheBackend(CacheBackend):
+    def __init__(self, maxsize=1024, max_tags=100000):
+        self.maxsize = maxsize
+        self.max_tags = max_tags
+        self._entries = OrderedDict()
+        self._tags = OrderedDict()
+        self._generation = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def generation(self):
+        return self._generation
+
+    def bump(self, tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                self._tags[tag] = self._generation
+                self._tags.move_to_end(tag)
+            while len(self._tags) > self.max_tags:
+                tag, version = self._tags.popitem(last=False)
+                self._floor = max(self._floor, version)
+            return self._generation
+
+    def versions(self, tags):
+        tag_versions = self._tags
+        return [tag_versions.get(tag, self._floor) for tag in tags]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+'''
+RedisCacheBackend
+keeps entries in redis, or any client with the redis-py get/set/mget/incr/mset/delete/scan_iter methods
+    entries are shared by all workers, so an invalidation by one worker is seen by the others
+    entries expire through redis TTLs, tag versions have no TTL
+        use a volatile-* maxmemory policy, so redis only evicts entries
+EXAMPLE
+    backend = RedisCacheBackend(redis.Redis.from_url('redis://localhost:6379/0'))
+'''
+
+
+class RedisCacheBackend(CacheBackend):
+    def __init__(self, client, prefix='capstone:cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + 'entry:' + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + 'entry:' + key, pickle.dumps(value), ex=int(ttl))
+
+    def generation(self):
+        return int(self.client.get(self.prefix + 'generation') or 0)
+
+    def bump(self, tags):
+        generation = self.client.incr(self.prefix + 'generation')
+        if tags:
+            self.client.mset({self.prefix + 'tag:' + tag: generation for tag in tags})
+        return generation
+
+    def versions(self, tags):
+        if not tags:
+            return []
+        values = self.client.mget([self.prefix + 'tag:' + tag for tag in tags])
+        return [int(value or 0) for value in values]
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + 'entry:*'):
+            self.client.delete(key)
+
+
+'''
+ResponseCache
+caches serialized responses, and invalidates them by tag
+    each entry is stored with the tags of the rows it contains (i.e. 'actor:1', 'movie:2')
+        and with the generation read before the response was computed
+    an entry is fresh while none of its tags was bumped after that generation,
+        so a write that commits while the response is computed also invalidates it
+'''
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        # counters, exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def generation(self):
+        return self.backend.generation()
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        if entry is not None:
+            generation, tags, response = entry
+            if max(self.backend.versions(tags), default=0) <= generation:
+                self.hits += 1
+                return response
+        self.misses += 1
+        return None
+
+    def set(self, key, generation, tags, response):
+        self.backend.set(key, (generation, list(tags), response), self.ttl)
+
+    def replace(self, key, response):
+        '''replaces the response of an entry, keeping its generation and tags'''
+        entry = self.backend.get(key)
+        if entry is not None:
+            generation, tags, _ = entry
+            self.backend.set(key, (generation, tags, response), self.ttl)
+
+    def invalidate(self, *tags):
+        if tags:
+            self.backend.bump(tags)
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations
+        }
+
+
+'''
+make_cache(app) method
+    returns the response cache configured by RESPONSE_CACHE, or None if the cache is disabled
+        'lru' keeps up to RESPONSE_CACHE_SIZE responses per process
+        'redis' stores responses in the redis server at RESPONSE_CACHE_URL, which requires the redis package
+    entries expire after RESPONSE_CACHE_TTL seconds
+'''
+
+
+def make_cache(app):
+    name = app.config.get('RESPONSE_CACHE')
+    if not name or name == 'none':
+        return None
+    if name == 'lru':
+        backend = LRUCacheBackend(app.config['RESPONSE_CACHE_SIZE'])
+    elif name == 'redis':
+        import redis
+        backend = RedisCacheBackend(redis.Redis.from_url(app.config['RESPONSE_CACHE_URL']))
+    else:
+        raise EnvironmentError(
+            f'RESPONSE_CACHE `{name}` is not supported. Possible choices are `lru`, `redis`, or `none`')
+    return ResponseCache(backend, app.config['RESPONSE_CACHE_TTL'])
+
+
+def get_cache():
+    '''returns the response cache of the current app, creating it on first use'''
+    extensions = current_app.extensions
+    if 'response_cache' not in extensions:
+        extensions['response_cache'] = make_cache(current_app)
+    return extensions['response_cache']
+
+
+'''
+cache_tags(*tags) method
+    records the tags of the rows in the response of the current request
+    EXAMPLE
+        cache_tags('actors', *row_tags(actors, 'actor', 'movies', 'movie'))
+'''
+
+
+def cache_tags(*tags):
+    g.setdefault('cache_tags', set()).update(tags)
+
+
+'''
+row_tags(items, kind, nested, nested_kind) method
+    returns the tags of a list of response dicts, and of the rows nested in them
+    EXAMPLE
+        row_tags([{'id': 1, 'movies': [{'id': 2}]}], 'actor', 'movies', 'movie') == {'actor:1', 'movie:2'}
+'''
+
+
+def row_tags(items, kind, nested, nested_kind):
+    tags = set()
+    for item in items:
+        tags.add(f'{kind}:{item["id"]}')
+        tags.update(f'{nested_kind}:{row["id"]}' for row in item[nested])
+    return tags
+
+
+'''
+invalidate(*tags) method
+    drops every cached response containing one of the tags
+    should be called by write endpoints after their changes are committed
+    EXAMPLE
+        invalidate('actor:1', 'movie:2')
+'''
+
+
+def invalidate(*tags):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(*tags)
+
+
+def table_state():
+    '''returns the versions of all VERSIONED_TABLES as a string, i.e. 'actor_movies=1,actors=3,movies=2' '''
+    versions = table_versions()
+    return ','.join(f'{name}={versions[name]}' for name in sorted(versions))
+
+
+def request_key():
+    '''returns a key identifying the endpoint, url parameters, and query string of the current request'''
+    return '|'.join([
+        request.endpoint,
+        urlencode(sorted(request.view_args.items())),
+        urlencode(sorted(request.args.items(multi=True)))
+    ])
+
+
+'''
+@cached decorator method
+    serves GET responses from the response cache, keyed by endpoint, url parameters, and query string
+    only 200 responses whose view called cache_tags are stored
+        along with their compressed bodies, so each encoding is compressed once per entry
+    sets the X-Cache header to HIT or MISS
+    with read replicas, keys also hold the table versions of the replica serving the request,
+        so responses computed on a lagging replica are only served by replicas at the same point
+    must be applied below @requires_auth, so cached responses are still only served to authorized users
+'''
+
+
+def cached(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        cache = get_cache()
+        if cache is None:
+            return f(*args, **kwargs)
+        key = request_key()
+        if get_replicas() is not None:
+            key += '|' + table_state()
+        hit = cache.get(key)
+        if hit is not None:
+            body, mimetype, variants = hit
+            response = current_app.response_class(body, mimetype=mimetype)
+            known = len(variants)
+            compress_response(response, variants)
+            if len(variants) > known:
+                cache.replace(key, hit)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        generation = cache.generation()
+        g.cache_tags = set()
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code == 200 and g.cache_tags and not response.is_streamed:
+            body, variants = response.get_data(), {}
+            compress_response(response, variants)
+            cache.set(key, generation, g.cache_tags, (body, response.mimetype, variants))
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    return wrapper
+
+
+'''
+@conditional decorator method
+    answers GET requests whose If-None-Match header holds the current ETag with a 304 response,
+        without calling the view
+    the ETag hashes the request key with the versions of all VERSIONED_TABLES,
+        since actors and movies are nested in each other's representations
+        so it changes with every committed write, and costs one small query to compute
+    200 responses get the ETag header, which compressed responses suffix with their encoding
+    must be applied below @requires_auth, and above @cached
+'''
+
+
+def conditional(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        etag = hashlib.sha1(f'{request_key()}|{table_state()}'.encode()).hexdigest()
+        for candidate in encoded_etags(etag):
+            if request.if_none_match.contains_weak(candidate):
+                response = current_app.response_class(status=304)
+                response.set_etag(candidate)
+                return response
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code == 200:
+            response.set_etag(etag)
+        return response
+
+    return wrapper
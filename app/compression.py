@@ -0,0 +1,88 @@
+# compression.py
+# content negotiated compression of API responses
+import gzip
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# the mimetypes worth compressing
+COMPRESSIBLE = {'application/json', 'application/x-ndjson'}
+
+'''
+compress(body, encoding, level) method
+    returns body compressed with 'br' (brotli) or 'gzip'
+    level is the brotli quality (0 to 11) or the gzip level (1 to 9)
+'''
+
+
+def compress(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    if encoding == 'gzip':
+        # mtime=0 keeps the output of identical bodies identical
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    raise ValueError(f'unsupported encoding `{encoding}`')
+
+
+def encodings():
+    '''returns the supported encodings, preferred first'''
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compression_level(encoding):
+    return current_app.config['BROTLI_QUALITY' if encoding == 'br' else 'GZIP_LEVEL']
+
+
+'''
+encoded_etags(etag) method
+    returns the ETags of every representation of a response, since compressed bodies get their own ETag
+    EXAMPLE
+        encoded_etags('abc') == ['abc', 'abc-br', 'abc-gzip']
+'''
+
+
+def encoded_etags(etag):
+    return [etag] + [f'{etag}-{encoding}' for encoding in encodings()]
+
+
+'''
+compress_response(response, variants) method
+    compresses the body of response with the best encoding accepted by the client
+        streamed responses, bodies below COMPRESSION_MIN_SIZE bytes, and other mimetypes are left as they are
+    variants is an optional dict of the compressed bodies of response by encoding,
+        it is used instead of compressing again, and new compressed bodies are added to it
+    returns the response
+'''
+
+
+def compress_response(response, variants=None):
+    if (response.status_code != 200 or response.is_streamed or response.mimetype not in COMPRESSIBLE
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < current_app.config['COMPRESSION_MIN_SIZE']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(encodings())
+    if encoding is None:
+        return response
+    compressed = variants.get(encoding) if variants is not None else None
+    if compressed is None:
+        compressed = compress(body, encoding, compression_level(encoding))
+        if variants is not None:
+            variants[encoding] = compressed
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def encode_etag(response):
+    '''gives compressed responses their own strong ETag, since they are a different representation'''
+    encoding = response.headers.get('Content-Encoding')
+    etag, weak = response.get_etag()
+    if encoding and etag and not weak and not etag.endswith(f'-{encoding}'):
+        response.set_etag(f'{etag}-{encoding}')
+    return response
@@ -0,0 +1,59 @@
+# green.py
+# cooperative psycopg2 calls for the gevent and eventlet gunicorn workers
+try:
+    import psycopg2
+    from psycopg2 import extensions
+except ImportError:  # pragma: no cover - sqlite deployments don't need psycopg2
+    psycopg2 = None
+
+'''
+make_wait_callback(wait_read, wait_write) method
+    returns a psycopg2 wait callback, which polls a connection and yields to the other greenlets
+        until the connection is readable or writable, instead of blocking the whole worker
+    wait_read and wait_write are the hub functions waiting for a file descriptor
+'''
+
+
+def make_wait_callback(wait_read, wait_write):
+    def wait_callback(connection, timeout=None):
+        while True:
+            state = connection.poll()
+            if state == extensions.POLL_OK:
+                break
+            elif state == extensions.POLL_READ:
+                wait_read(connection.fileno(), timeout=timeout)
+            elif state == extensions.POLL_WRITE:
+                wait_write(connection.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f'bad state from poll: {state}')
+
+    return wait_callback
+
+
+'''
+patch_psycopg(worker_class) method
+    makes psycopg2 yield to the other greenlets while it waits for the database
+        gunicorn's gevent and eventlet workers already patch the socket module, so urlopen (the JWKS fetches) yields,
+        but psycopg2 talks to postgres through libpq, which must be told how to wait
+    does nothing for the other worker classes, or without psycopg2
+    EXAMPLE
+        patch_psycopg('gevent')
+'''
+
+
+def patch_psycopg(worker_class):
+    if psycopg2 is None:
+        return
+    if worker_class == 'gevent':
+        from gevent.socket import wait_read, wait_write
+    elif worker_class == 'eventlet':
+        from eventlet.hubs import trampoline
+
+        def wait_read(fileno, timeout=None):
+            trampoline(fileno, read=True, timeout=timeout)
+
+        def wait_write(fileno, timeout=None):
+            trampoline(fileno, write=True, timeout=timeout)
+    else:
+        return
+    extensions.set_wait_callback(make_wait_callback(wait_read, wait_write))
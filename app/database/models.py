@@ -1,6 +1,42 @@
 # models.py
 # This file contains all models of the database, and their helper functions
+from datetime import date, datetime
 from app import db
+from sqlalchemy import DDL, event, select
+from sqlalchemy.types import TypeDecorator
+
+# the format of release dates in the API
+RELEASE_DATE_FORMAT = '%m/%d/%Y'
+
+
+def parse_release_date(value):
+    '''returns the date of a 'MM/DD/YYYY' string, raises a ValueError if it's not a valid date'''
+    return datetime.strptime(value, RELEASE_DATE_FORMAT).date()
+
+
+'''
+ReleaseDate
+a DATE column which is read and written as 'MM/DD/YYYY' strings, the release date format of the API
+    dates are stored as real dates, so they are compared and sorted chronologically, with a plain index
+    datetime.date values are accepted too
+    EXAMPLE
+        Movie.query.filter(Movie.release_date > '12/31/2020')
+'''
+
+
+class ReleaseDate(TypeDecorator):
+    impl = db.Date
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return parse_release_date(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, date):
+            return value.strftime(RELEASE_DATE_FORMAT)
+        return value
+
 
 '''
 Actors
@@ -11,6 +47,12 @@ should have age and gender
 
 class Actor(db.Model):
     __tablename__ = 'actors'
+    __table_args__ = (
+        # gender filters, alone or with an age range
+        db.Index('ix_actors_gender_age', 'gender', 'age'),
+        # age ranges, and pages sorted by age
+        db.Index('ix_actors_age_id', 'age', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     name = db.Column(db.String(50), unique=True, nullable=False)
     age = db.Column(db.Integer(), nullable=False)
@@ -30,6 +72,7 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
+        bump_versions(self.__tablename__)
         db.session.commit()
 
     '''
@@ -43,6 +86,7 @@ class Actor(db.Model):
 
     def delete(self):
         db.session.delete(self)
+        bump_versions(self.__tablename__)
         db.session.commit()
 
     '''
@@ -56,6 +100,7 @@ class Actor(db.Model):
     '''
 
     def update(self):
+        bump_versions(self.__tablename__)
         db.session.commit()
 
     '''
@@ -77,7 +122,13 @@ class Movie(db.Model):
     __tablename__ = 'movies'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), unique=True, nullable=False)
-    release_date = db.Column(db.String(50), nullable=False)
+    release_date = db.Column(ReleaseDate, nullable=False)
+    __table_args__ = (
+        # title prefixes, LIKE only uses an index with pattern operators on postgres
+        db.Index('ix_movies_title_pattern', 'title', postgresql_ops={'title': 'text_pattern_ops'}),
+        # release date ranges, and pages sorted by release date
+        db.Index('ix_movies_release_date', 'release_date', 'id'),
+    )
 
     '''
     insert()
@@ -91,6 +142,7 @@ class Movie(db.Model):
 
     def insert(self):
         db.session.add(self)
+        bump_versions(self.__tablename__)
         db.session.commit()
 
     '''
@@ -104,6 +156,7 @@ class Movie(db.Model):
 
     def delete(self):
         db.session.delete(self)
+        bump_versions(self.__tablename__)
         db.session.commit()
 
     '''
@@ -117,6 +170,7 @@ class Movie(db.Model):
     '''
 
     def update(self):
+        bump_versions(self.__tablename__)
         db.session.commit()
 
     '''
@@ -133,9 +187,68 @@ class Movie(db.Model):
         }
 
 
+def trigram_index(table, column):
+    '''creates a trigram index of the search endpoint with table, these indexes only exist on postgres'''
+    event.listen(table, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+    event.listen(table, 'after_create', DDL(
+        f'CREATE INDEX ix_{table.name}_{column}_trgm ON {table.name} USING gin ({column} gin_trgm_ops)'
+    ).execute_if(dialect='postgresql'))
+
+
+trigram_index(Actor.__table__, 'name')
+trigram_index(Movie.__table__, 'title')
+
+
 class ActorMovies(db.Model):
     __tablename__ = 'actor_movies'
     actor_id = db.Column(db.Integer, db.ForeignKey(
         'actors.id', ondelete='CASCADE'), primary_key=True)
     movie_id = db.Column(db.Integer, db.ForeignKey(
         'movies.id', ondelete='CASCADE'), primary_key=True)
+    __table_args__ = (
+        # the primary key only serves lookups by actor_id, this one serves the actors of a movie
+        db.Index('ix_actor_movies_movie_id', 'movie_id', 'actor_id'),
+    )
+
+
+'''
+TableVersion
+a counter per table, bumped in the same transaction as every write to that table
+    lets the read endpoints build their ETags without querying the tables they read
+    the rows of VERSIONED_TABLES are created with the table
+'''
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+VERSIONED_TABLES = ('actors', 'movies', 'actor_movies')
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def create_table_versions(target, connection, **kwargs):
+    connection.execute(target.insert(), [{'name': name, 'version': 0} for name in VERSIONED_TABLES])
+
+
+'''
+bump_versions(*names) method
+    increments the versions of the named tables in the current transaction
+        the new versions become visible when the transaction commits, and are discarded on rollback
+    EXAMPLE
+        bump_versions('actors')
+        db.session.commit()
+'''
+
+
+def bump_versions(*names):
+    table = TableVersion.__table__
+    db.session.execute(table.update().where(table.c.name.in_(names)).values(version=table.c.version + 1))
+
+
+def table_versions():
+    '''returns a dict of the current version of each table, read with one query'''
+    table = TableVersion.__table__
+    return dict(db.session.execute(select([table.c.name, table.c.version])).fetchall())
@@ -0,0 +1,131 @@
+# pool.py
+# database connection pool configuration and instrumentation
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+# the gunicorn worker classes running requests in greenlets, see app/database/green.py
+GREEN_WORKERS = {'gevent', 'eventlet'}
+
+'''
+PoolStats
+counters of the connection checkouts of a pool
+    checkout times include waiting for a free connection, and opening new ones
+'''
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+'''
+InstrumentedQueuePool
+a QueuePool which times every checkout, and counts checkouts that timed out
+    the stats survive pool recreation, i.e. after the engine is disposed
+EXAMPLE
+    engine = create_engine(uri, poolclass=InstrumentedQueuePool)
+    engine.pool.stats.wait_seconds_max
+'''
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+'''
+pool_stats(engine) method
+    returns the state and the checkout stats of the pool of engine, or None if it's not instrumented
+        saturation is the share of the pool's connections (including overflow) which are checked out
+'''
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return None
+    stats = pool.stats
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    return {
+        'size': pool.size(),
+        'max_overflow': pool._max_overflow,
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'saturation': pool.checkedout() / capacity if capacity else 0.0,
+        'checkouts': stats.checkouts,
+        'timeouts': stats.timeouts,
+        'wait_seconds_total': stats.wait_seconds_total,
+        'wait_seconds_max': stats.wait_seconds_max
+    }
+
+
+'''
+engine_options(config) method
+    returns the SQLALCHEMY_ENGINE_OPTIONS of an app config, with its pool settings
+    sqlite databases keep sqlalchemy's defaults, since they don't use a QueuePool
+    each worker process has its own pool
+        DB_POOL_SIZE defaults to GUNICORN_THREADS, the most requests a worker handles at once
+        DB_MAX_OVERFLOW defaults to the connections DB_MAX_CONNECTIONS leaves to each of WEB_CONCURRENCY workers,
+            capped at DB_POOL_SIZE
+        gevent and eventlet workers handle up to GUNICORN_WORKER_CONNECTIONS requests at once,
+            so DB_POOL_SIZE defaults to the share of DB_MAX_CONNECTIONS of each worker, with no overflow,
+            and the other requests wait for a connection without blocking the worker
+    DB_POOL_TIMEOUT is how long a request waits for a connection before failing,
+        DB_POOL_RECYCLE replaces connections older than this many seconds, before the server or a proxy drops them
+        DB_POOL_PRE_PING tests connections on checkout, so connections dropped while idle are replaced
+    DB_STATEMENT_TIMEOUT cancels postgres statements running for longer than this many milliseconds, 0 disables it
+'''
+
+
+def engine_options(config):
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri.startswith('sqlite'):
+        return options
+    share = config['DB_MAX_CONNECTIONS'] // max(config['WEB_CONCURRENCY'], 1)
+    if config['GUNICORN_WORKER_CLASS'] in GREEN_WORKERS:
+        pool_size = config['DB_POOL_SIZE'] or max(min(share, config['GUNICORN_WORKER_CONNECTIONS']), 1)
+    else:
+        pool_size = config['DB_POOL_SIZE'] or config['GUNICORN_THREADS']
+    max_overflow = config['DB_MAX_OVERFLOW']
+    if max_overflow is None:
+        max_overflow = max(min(share - pool_size, pool_size), 0)
+    options.setdefault('poolclass', InstrumentedQueuePool)
+    options.setdefault('pool_size', pool_size)
+    options.setdefault('max_overflow', max_overflow)
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+    options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+    if config['DB_STATEMENT_TIMEOUT'] and uri.startswith('postgres'):
+        connect_args = options.setdefault('connect_args', {})
+        connect_args.setdefault('options', f'-c statement_timeout={config["DB_STATEMENT_TIMEOUT"]}')
+    return options
@@ -0,0 +1,338 @@
+# queries.py
+# column projected read queries, which build API responses straight from result rows
+from collections import namedtuple
+from itertools import chain
+from operator import itemgetter
+from app import db
+from app.database.models import Actor, Movie, ActorMovies, parse_release_date
+from sqlalchemy import and_, asc, desc, func, literal_column, or_, select, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+actors = Actor.__table__
+movies = Movie.__table__
+actor_movies = ActorMovies.__table__
+
+# the columns of each representation, in the order they are selected
+ACTOR_FIELDS = ('id', 'name', 'age', 'gender')
+MOVIE_FIELDS = ('id', 'title', 'release_date')
+# the fields of actor['movies'] and movie['actors'] items
+ACTOR_MOVIE_FIELDS = ('id', 'title')
+MOVIE_ACTOR_FIELDS = ('id', 'name')
+
+'''
+SortKey
+a sort order of the list endpoints
+    expression: a function of a table (or of a subquery of it) returning the sql expression to order by
+    value: a function of a response dict returning its value of the expression, stored in cursors
+    parse: an optional function checking a value read from a cursor, raising a ValueError if it's malformed
+'''
+
+SortKey = namedtuple('SortKey', ['expression', 'value', 'parse'])
+
+
+def column_sort(name, parse=None):
+    return SortKey(lambda table: table.c[name], itemgetter(name), parse)
+
+
+# the sort orders accepted by the `sort` query parameter, backed by the indexes in models.py
+ACTOR_SORTS = {name: column_sort(name) for name in ('id', 'name', 'age')}
+MOVIE_SORTS = {
+    'id': column_sort('id'),
+    'title': column_sort('title'),
+    'release_date': column_sort('release_date', parse_release_date)
+}
+
+'''
+group_rows(rows, fields, nested, nested_fields) method
+    @INPUTS
+        rows: result rows ordered by their first column, each row holds the fields of the parent
+            followed by the nested_fields of one associated row (or NULLs if there is none)
+        fields: the names of the parent columns
+        nested: the key of the list of associated rows (i.e. 'movies')
+        nested_fields: the names of the associated columns
+
+    yields one dict per parent, shaped like the model's format() output
+'''
+
+
+def group_rows(rows, fields, nested, nested_fields):
+    width = len(fields)
+    item = None
+    for row in rows:
+        if item is None or item['id'] != row[0]:
+            if item is not None:
+                yield item
+            item = dict(zip(fields, row[:width]))
+            item[nested] = []
+        if row[width] is not None:
+            item[nested].append(dict(zip(nested_fields, row[width:])))
+    if item is not None:
+        yield item
+
+
+'''
+sort_columns(table, sort, descending) method
+    returns the ORDER BY clauses of a sort key of table, with the id as tie breaker
+'''
+
+
+def sort_columns(table, sort, descending=False):
+    direction = desc if descending else asc
+    columns = [sort.expression(table)]
+    if columns[0] is not table.c.id:
+        columns.append(table.c.id)
+    return [direction(column) for column in columns]
+
+
+'''
+select_actors(condition, limit, sort, descending) method
+    returns a single select of the actors matching condition, joined with their movies
+        the limit applies to actors, not to joined rows
+    rows are ordered by the ACTOR_SORTS key named sort (the id by default), then by movie id
+'''
+
+
+def select_actors(condition=None, limit=None, sort='id', descending=False):
+    page = select([actors.c[field] for field in ACTOR_FIELDS])
+    if condition is not None:
+        page = page.where(condition)
+    page = page.order_by(*sort_columns(actors, ACTOR_SORTS[sort], descending)).limit(limit).alias('page')
+    return select(
+        [page.c[field] for field in ACTOR_FIELDS] + [movies.c.id, movies.c.title]
+    ).select_from(
+        page.outerjoin(actor_movies, actor_movies.c.actor_id == page.c.id)
+            .outerjoin(movies, movies.c.id == actor_movies.c.movie_id)
+    ).order_by(*sort_columns(page, ACTOR_SORTS[sort], descending), movies.c.id)
+
+
+'''
+select_movies(condition, limit, sort, descending) method
+    returns a single select of the movies matching condition, joined with their actors
+        the limit applies to movies, not to joined rows
+    rows are ordered by the MOVIE_SORTS key named sort (the id by default), then by actor id
+'''
+
+
+def select_movies(condition=None, limit=None, sort='id', descending=False):
+    page = select([movies.c[field] for field in MOVIE_FIELDS])
+    if condition is not None:
+        page = page.where(condition)
+    page = page.order_by(*sort_columns(movies, MOVIE_SORTS[sort], descending)).limit(limit).alias('page')
+    return select(
+        [page.c[field] for field in MOVIE_FIELDS] + [actors.c.id, actors.c.name]
+    ).select_from(
+        page.outerjoin(actor_movies, actor_movies.c.movie_id == page.c.id)
+            .outerjoin(actors, actors.c.id == actor_movies.c.actor_id)
+    ).order_by(*sort_columns(page, MOVIE_SORTS[sort], descending), actors.c.id)
+
+
+'''
+fetch_actors(condition, limit, sort, descending) method
+    returns a list of actor dicts, identical to Actor.format(), loaded with one query
+    EXAMPLE
+        actor = fetch_actors(Actor.id == 1)
+        oldest = fetch_actors(limit=10, sort='age', descending=True)
+'''
+
+
+def fetch_actors(condition=None, limit=None, sort='id', descending=False):
+    rows = db.session.execute(select_actors(condition, limit, sort, descending))
+    return list(group_rows(rows, ACTOR_FIELDS, 'movies', ACTOR_MOVIE_FIELDS))
+
+
+'''
+fetch_movies(condition, limit, sort, descending) method
+    returns a list of movie dicts, identical to Movie.format(), loaded with one query
+'''
+
+
+def fetch_movies(condition=None, limit=None, sort='id', descending=False):
+    rows = db.session.execute(select_movies(condition, limit, sort, descending))
+    return list(group_rows(rows, MOVIE_FIELDS, 'actors', MOVIE_ACTOR_FIELDS))
+
+
+'''
+json_array(table, fields, link, parent, parent_link) method
+    returns a scalar subquery aggregating the rows of table linked to the current parent row into a json array
+        of {field: value} objects ordered by id, or '[]' if there are none (postgres only)
+        link is the actor_movies column referencing table, parent_link the one referencing parent
+'''
+
+
+def json_array(table, fields, link, parent, parent_link):
+    item = func.json_build_object(*chain.from_iterable(
+        (literal_column(f"'{field}'"), table.c[field]) for field in fields))
+    array = func.coalesce(func.json_agg(aggregate_order_by(item, table.c.id)), literal_column("'[]'::json"),
+                          type_=postgresql.JSON)
+    return select([array]).select_from(
+        actor_movies.join(table, table.c.id == link)
+    ).where(parent_link == parent.c.id).as_scalar()
+
+
+'''
+select_actor(id) and select_movie(id) methods
+    return a select of one actor or movie row, with its movies or actors aggregated into a json array
+        by the database, so a detail is a single row whatever the size of its cast (postgres only)
+'''
+
+
+def select_actor(id):
+    cast = json_array(movies, ACTOR_MOVIE_FIELDS, actor_movies.c.movie_id, actors, actor_movies.c.actor_id)
+    return select([actors.c[field] for field in ACTOR_FIELDS] + [cast.label('movies')]).where(actors.c.id == id)
+
+
+def select_movie(id):
+    cast = json_array(actors, MOVIE_ACTOR_FIELDS, actor_movies.c.actor_id, movies, actor_movies.c.movie_id)
+    return select([movies.c[field] for field in MOVIE_FIELDS] + [cast.label('actors')]).where(movies.c.id == id)
+
+
+'''
+fetch_actor(id) and fetch_movie(id) methods
+    return the dict of an actor or a movie, identical to format(), or None if it doesn't exist
+        loaded with one statement, returning one row with the aggregated cast on postgres,
+        and one row per cast member on other databases, which join it like fetch_actors
+    EXAMPLE
+        movie = fetch_movie(1)
+'''
+
+
+def fetch_actor(id):
+    if db.engine.dialect.name != 'postgresql':
+        found = fetch_actors(actors.c.id == id)
+        return found[0] if found else None
+    row = db.session.execute(select_actor(id)).first()
+    return dict(row) if row is not None else None
+
+
+def fetch_movie(id):
+    if db.engine.dialect.name != 'postgresql':
+        found = fetch_movies(movies.c.id == id)
+        return found[0] if found else None
+    row = db.session.execute(select_movie(id)).first()
+    return dict(row) if row is not None else None
+
+
+'''
+iter_actors(batch_size) and iter_movies(batch_size) methods
+    yield the dicts of all actors or movies, ordered by id
+    rows are streamed from a server-side cursor where the driver supports it,
+        buffering at most batch_size rows, so memory stays flat
+'''
+
+
+def iter_actors(batch_size):
+    rows = db.session.execute(select_actors().execution_options(
+        stream_results=True, max_row_buffer=batch_size))
+    return group_rows(rows, ACTOR_FIELDS, 'movies', ACTOR_MOVIE_FIELDS)
+
+
+def iter_movies(batch_size):
+    rows = db.session.execute(select_movies().execution_options(
+        stream_results=True, max_row_buffer=batch_size))
+    return group_rows(rows, MOVIE_FIELDS, 'actors', MOVIE_ACTOR_FIELDS)
+
+
+'''
+insert_ignore(table) method
+    returns an INSERT statement for table which silently skips rows that violate a unique constraint
+        INSERT ... ON CONFLICT DO NOTHING on postgres, INSERT OR IGNORE on sqlite, INSERT IGNORE on mysql
+    returns None on other databases, where callers have to skip the existing rows themselves
+'''
+
+
+def insert_ignore(table):
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    return None
+
+
+def supports_row_values():
+    '''returns True if the database compares row values, i.e. (actor_id, movie_id) IN ((1, 2), (3, 4))'''
+    dialect = db.engine.dialect
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 15)
+    return dialect.name in ('postgresql', 'mysql')
+
+
+'''
+cast_condition(pairs) method
+    returns the condition matching the actor_movies rows of the given (actor_id, movie_id) pairs
+        a single row value IN list where the database supports it, an OR of each pair otherwise
+'''
+
+
+def cast_condition(pairs):
+    if supports_row_values():
+        return tuple_(actor_movies.c.actor_id, actor_movies.c.movie_id).in_(list(pairs))
+    return or_(*[and_(actor_movies.c.actor_id == actor_id, actor_movies.c.movie_id == movie_id)
+                 for actor_id, movie_id in pairs])
+
+
+'''
+link_cast(pairs) method
+    inserts the given (actor_id, movie_id) pairs into actor_movies with a single statement
+    pairs which are already linked are skipped,
+        by the statement itself, or with one more query where insert_ignore isn't supported
+    returns the number of new links
+'''
+
+
+def link_cast(pairs):
+    if not pairs:
+        return 0
+    statement = insert_ignore(actor_movies)
+    if statement is None:
+        linked = {tuple(row) for row in db.session.execute(
+            select([actor_movies.c.actor_id, actor_movies.c.movie_id]).where(cast_condition(pairs)))}
+        pairs = [pair for pair in pairs if pair not in linked]
+        if not pairs:
+            return 0
+        statement = actor_movies.insert()
+    rows = [{'actor_id': actor_id, 'movie_id': movie_id} for actor_id, movie_id in pairs]
+    return db.session.execute(statement.values(rows)).rowcount
+
+
+'''
+unlink_cast(pairs) method
+    deletes the given (actor_id, movie_id) pairs from actor_movies with a single statement
+    returns the number of removed links
+'''
+
+
+def unlink_cast(pairs):
+    if not pairs:
+        return 0
+    return db.session.execute(actor_movies.delete().where(cast_condition(pairs))).rowcount
+
+
+'''
+cast_exists(actor_id, movie_id) method
+    returns whether the actor and the movie exist, as a pair of booleans, read with one query
+'''
+
+
+def cast_exists(actor_id, movie_id):
+    row = db.session.execute(select([
+        select([actors.c.id]).where(actors.c.id == actor_id).as_scalar(),
+        select([movies.c.id]).where(movies.c.id == movie_id).as_scalar()
+    ])).first()
+    return row[0] is not None, row[1] is not None
+
+
+'''
+existing_ids(table, ids) method
+    returns the subset of ids which exist in table, with one indexed query
+'''
+
+
+def existing_ids(table, ids):
+    if not ids:
+        return set()
+    query = select([table.c.id]).where(table.c.id.in_(list(ids)))
+    return {id for (id,) in db.session.execute(query)}
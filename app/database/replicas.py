@@ -0,0 +1,156 @@
+# replicas.py
+# routing the reads of read-only requests to database replicas
+import itertools
+import logging
+import threading
+import time
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, exc, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+from .pool import engine_options, pool_stats
+
+logger = logging.getLogger(__name__)
+
+# the http methods of read-only requests, whose queries may be served by a replica
+READ_ONLY_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+'''
+ReplicaSet
+the engines of the read replicas, handed out round-robin
+    a replica is health-checked with a `SELECT 1` at most once every health_interval seconds,
+        and a replica failing its check is skipped until its next check
+    choose() returns None when every replica is down, so reads fall back to the primary
+EXAMPLE
+    replicas = ReplicaSet([create_engine(url) for url in urls])
+    engine = replicas.choose()
+'''
+
+
+class ReplicaSet:
+    def __init__(self, engines, health_interval=5.0):
+        self.engines = list(engines)
+        self.health_interval = health_interval
+        self._counter = itertools.count()
+        # the monotonic time of the last check of each replica, and its result
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def choose(self):
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._counter) % len(self.engines)]
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+    def is_healthy(self, engine):
+        now = time.monotonic()
+        checked = self._checked.get(engine)
+        if checked is not None and now - checked[0] < self.health_interval:
+            return checked[1]
+        with self._lock:
+            # another thread may have checked the replica while this one waited
+            checked = self._checked.get(engine)
+            if checked is not None and now - checked[0] < self.health_interval:
+                return checked[1]
+            healthy = check(engine)
+            self._checked[engine] = (time.monotonic(), healthy)
+            return healthy
+
+    def status(self):
+        '''returns the url (without password), the last health check result, and the pool stats of each replica'''
+        return [{
+            'url': repr(engine.url),
+            'healthy': self._checked.get(engine, (None, None))[1],
+            'pool': pool_stats(engine)
+        } for engine in self.engines]
+
+
+def check(engine):
+    '''returns True if engine answers a `SELECT 1`'''
+    try:
+        with engine.connect() as connection:
+            connection.execute(select([1]))
+        return True
+    except exc.DBAPIError as error:
+        logger.warning('replica %r failed its health check: %s', engine.url, error)
+        return False
+
+
+'''
+make_replicas(app) method
+    returns a ReplicaSet of the DATABASE_REPLICA_URLS of app, or None if there are none
+    each replica gets its own pool, sized like the primary's
+    replicas are checked every DB_REPLICA_HEALTH_INTERVAL seconds
+'''
+
+
+def make_replicas(app):
+    urls = app.config.get('DATABASE_REPLICA_URLS')
+    if not urls:
+        return None
+    engines = []
+    for url in urls:
+        config = dict(app.config, SQLALCHEMY_DATABASE_URI=url, SQLALCHEMY_ENGINE_OPTIONS={})
+        engines.append(create_engine(url, **engine_options(config)))
+    return ReplicaSet(engines, app.config['DB_REPLICA_HEALTH_INTERVAL'])
+
+
+def get_replicas():
+    '''returns the replicas of the current app, creating them on first use'''
+    extensions = current_app.extensions
+    if 'replicas' not in extensions:
+        extensions['replicas'] = make_replicas(current_app)
+    return extensions['replicas']
+
+
+def is_read_only_request():
+    '''returns True inside a request whose method doesn't change anything'''
+    return has_request_context() and request.method in READ_ONLY_METHODS
+
+
+'''
+RoutingSession
+a session sending the queries of read-only requests to a replica, and all other queries to the primary
+    a request reads from a single replica, chosen on its first query, so it sees one consistent snapshot
+    once a request flushes or executes an INSERT, UPDATE, or DELETE, it stays on the primary,
+        so it reads its own writes
+    sessions outside of requests (i.e. migrations and shell scripts) always use the primary
+'''
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        # the routing of the last read-only request using this session
+        self.request = None
+        self.replica = None
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if not is_read_only_request():
+            return super().get_bind(mapper, clause)
+        current = request._get_current_object()
+        if self.request is not current:
+            # a session may outlive a request, i.e. when the app context is pushed by a script or a test
+            self.request, self.replica, self.wrote = current, None, False
+            replicas = get_replicas()
+            self.replica = replicas.choose() if replicas is not None else None
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.wrote = True
+        if self.replica is None or self.wrote:
+            return super().get_bind(mapper, clause)
+        return self.replica
+
+
+'''
+RoutingSQLAlchemy
+the SQLAlchemy extension, with RoutingSession sessions
+    routing only changes anything when DATABASE_REPLICA_URLS is set
+'''
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
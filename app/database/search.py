@@ -0,0 +1,143 @@
+# search.py
+# ranked search over actor names and movie titles
+import re
+import threading
+from collections import defaultdict
+from app import db
+from app.database.models import table_versions
+from app.database.queries import actors, movies
+from flask import current_app
+from sqlalchemy import func, literal, or_, select, union_all
+
+# the minimum score of a match, the default pg_trgm.word_similarity_threshold
+WORD_SIMILARITY_THRESHOLD = 0.6
+# the searched column of each kind of result
+SEARCHED = {
+    'actor': (actors, 'name'),
+    'movie': (movies, 'title')
+}
+
+'''
+trigrams(text) method
+    returns the set of trigrams of text, like pg_trgm
+        text is lowercased and split into alphanumeric words
+        each word is padded with two spaces before and one after, i.e. 'cat' gives '  c', ' ca', 'cat', 'at '
+'''
+
+
+def trigrams(text):
+    grams = set()
+    for word in re.findall(r'\w+', text.lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+'''
+SearchIndex
+an in-memory inverted index from trigrams to the actors and movies containing them
+    used where pg_trgm isn't available, i.e. sqlite test runs
+    scores approximate pg_trgm's word_similarity(q, text) as the share of the query trigrams found in text
+EXAMPLE
+    index = SearchIndex([('actor', 1, 'Tom Cruise'), ('movie', 2, 'Top Gun')])
+    index.search('cruise') == [('actor', 1, 'Tom Cruise', 1.0)]
+'''
+
+
+class SearchIndex:
+    def __init__(self, rows):
+        self.texts = {}
+        self.postings = defaultdict(set)
+        for kind, id, text in rows:
+            self.texts[(kind, id)] = text
+            for gram in trigrams(text):
+                self.postings[gram].add((kind, id))
+
+    def search(self, q, kinds=('actor', 'movie')):
+        '''
+        returns (kind, id, text, score) tuples matching q, best first
+            a row matches if its score reaches WORD_SIMILARITY_THRESHOLD, or if it contains q
+        '''
+        needle = q.lower()
+        grams = trigrams(q)
+        counts = defaultdict(int)
+        for gram in grams:
+            for key in self.postings.get(gram, ()):
+                counts[key] += 1
+        # queries without a whole trigram only match as substrings
+        candidates = self.texts if len(needle) < 3 else counts
+        results = []
+        for key in candidates:
+            kind, id = key
+            if kind not in kinds:
+                continue
+            text = self.texts[key]
+            score = counts.get(key, 0) / len(grams) if grams else 0.0
+            if score >= WORD_SIMILARITY_THRESHOLD or needle in text.lower():
+                results.append((kind, id, text, score))
+        results.sort(key=lambda result: (-result[3], result[0], result[1]))
+        return results
+
+
+'''
+search_index() method
+    returns the SearchIndex of the current app, rebuilt when the actors or movies table versions change
+'''
+
+_index_lock = threading.Lock()
+
+
+def search_index():
+    versions = table_versions()
+    key = (versions.get('actors'), versions.get('movies'))
+    cached = current_app.extensions.get('search_index')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with _index_lock:
+        rows = [('actor', id, name) for id, name in db.session.execute(select([actors.c.id, actors.c.name]))]
+        rows += [('movie', id, title) for id, title in db.session.execute(select([movies.c.id, movies.c.title]))]
+        index = SearchIndex(rows)
+        current_app.extensions['search_index'] = (key, index)
+    return index
+
+
+'''
+select_matches(q, kinds) method
+    returns a select of the (type, id, text, score) of the actors and movies matching q, best first
+    matches use the `<%` word similarity operator and ILIKE, which are both served by the trigram indexes
+'''
+
+
+def select_matches(q, kinds):
+    pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    # custom operators are not escaped for drivers using % as parameter marker, i.e. psycopg2
+    operator = '<%%' if db.engine.dialect.paramstyle in ('format', 'pyformat') else '<%'
+    parts = []
+    for kind in kinds:
+        table, name = SEARCHED[kind]
+        searched = table.c[name]
+        parts.append(select([
+            literal(kind).label('type'),
+            table.c.id.label('id'),
+            searched.label('text'),
+            func.word_similarity(q, searched).label('score')
+        ]).where(or_(literal(q).op(operator)(searched), searched.ilike(pattern))))
+    matches = union_all(*parts).alias('matches')
+    return select([matches]).order_by(matches.c.score.desc(), matches.c.type, matches.c.id)
+
+
+'''
+search(q, kinds, limit, offset) method
+    returns up to limit (type, id, text, score) tuples of the actors and movies matching q, best first,
+        skipping the first offset matches
+    uses pg_trgm on postgres, and a SearchIndex elsewhere
+    EXAMPLE
+        search('cruise', ('actor',), 10, 0)
+'''
+
+
+def search(q, kinds, limit, offset):
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(select_matches(q, kinds).limit(limit).offset(offset))
+        return [tuple(row) for row in rows]
+    return search_index().search(q, kinds)[offset:offset + limit]
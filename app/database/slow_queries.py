@@ -0,0 +1,189 @@
+# slow_queries.py
+# statement timings by fingerprint, and a log of the statements slower than SLOW_QUERY_MS
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# string and number literals, and lists of bound parameters, i.e. the values of an IN clause
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PARAMETER = r'(?:\?|%s|%\(\w+\)s|:\w+)'
+PARAMETER_LISTS = re.compile(rf'\(\s*{PARAMETER}(?:\s*,\s*{PARAMETER})+\s*\)')
+
+'''
+fingerprint(statement) method
+    returns statement without its literals and with its parameter lists collapsed,
+        so the executions of a query with different values share a fingerprint
+    EXAMPLE
+        fingerprint('SELECT * FROM actors WHERE id IN (?, ?) LIMIT 10') == 'SELECT * FROM actors WHERE id IN (...) LIMIT ?'
+'''
+
+
+def fingerprint(statement):
+    text = PARAMETER_LISTS.sub('(...)', LITERALS.sub('?', statement))
+    return ' '.join(text.split())
+
+
+'''
+explain(connection, cursor, statement, parameters) method
+    returns the plan of a SELECT statement as text, or None if it can't be explained
+        `EXPLAIN` on postgres, which plans the statement without running it, and `EXPLAIN QUERY PLAN` on sqlite
+    runs on the connection of the statement, inside a savepoint on postgres,
+        so a failing EXPLAIN doesn't abort the transaction of the request
+'''
+
+
+def explain(connection, cursor, statement, parameters):
+    dialect = connection.dialect.name
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    if dialect == 'postgresql':
+        prefix = 'EXPLAIN '
+    elif dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        return None
+    postgres = dialect == 'postgresql'
+    raw = cursor.connection.cursor()
+    try:
+        if postgres:
+            raw.execute('SAVEPOINT explain_slow_query')
+        try:
+            raw.execute(prefix + statement, parameters)
+            plan = '\n'.join(str(row[-1]) for row in raw.fetchall())
+        except Exception as error:
+            if postgres:
+                raw.execute('ROLLBACK TO SAVEPOINT explain_slow_query')
+            logger.debug('unable to explain %s: %s', statement, error)
+            return None
+        if postgres:
+            raw.execute('RELEASE SAVEPOINT explain_slow_query')
+        return plan
+    finally:
+        raw.close()
+
+
+'''
+QueryStats
+the durations of the statements of a worker, by fingerprint
+    percentiles are computed from the last `samples` durations of each fingerprint
+    each fingerprint also counts its slow executions, the endpoints running it, and keeps its last plan
+'''
+
+
+class QueryStats:
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.fingerprints = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, statement, seconds, endpoint=None, slow=False):
+        with self._lock:
+            stats = self.fingerprints.get(key)
+            if stats is None:
+                stats = self.fingerprints[key] = {
+                    'statement': statement, 'count': 0, 'slow': 0, 'total': 0.0, 'max': 0.0,
+                    'durations': deque(maxlen=self.samples), 'endpoints': Counter(), 'plan': None
+                }
+            stats['count'] += 1
+            stats['slow'] += slow
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['durations'].append(seconds)
+            stats['endpoints'][endpoint or 'none'] += 1
+
+    def set_plan(self, key, plan):
+        with self._lock:
+            self.fingerprints[key]['plan'] = plan
+
+    def has_plan(self, key):
+        stats = self.fingerprints.get(key)
+        return stats is not None and stats['plan'] is not None
+
+    def top(self, limit=20):
+        '''returns the stats of the limit fingerprints with the most total time, in milliseconds'''
+        with self._lock:
+            items = sorted(self.fingerprints.items(), key=lambda item: -item[1]['total'])[:limit]
+            items = [(key, dict(stats, durations=sorted(stats['durations']),
+                                endpoints=stats['endpoints'].most_common(5))) for key, stats in items]
+        return [{
+            'fingerprint': key,
+            'statement': stats['statement'],
+            'count': stats['count'],
+            'slow': stats['slow'],
+            'total_ms': stats['total'] * 1000,
+            'p50_ms': percentile(stats['durations'], 0.5) * 1000,
+            'p99_ms': percentile(stats['durations'], 0.99) * 1000,
+            'max_ms': stats['max'] * 1000,
+            'endpoints': dict(stats['endpoints']),
+            'plan': stats['plan']
+        } for key, stats in items]
+
+
+def percentile(durations, share):
+    return durations[min(int(len(durations) * share), len(durations) - 1)] if durations else 0.0
+
+
+def get_query_stats():
+    '''returns the QueryStats of the current app, or None if SLOW_QUERY_MS is not set'''
+    return current_app.extensions.get('query_stats') if has_app_context() else None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.slow_query_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'slow_query_start', None)
+    stats = get_query_stats()
+    if start is None or stats is None:
+        return
+    seconds = time.perf_counter() - start
+    config = current_app.config
+    slow = seconds * 1000 >= config['SLOW_QUERY_MS']
+    text = fingerprint(statement)
+    key = hashlib.sha1(text.encode()).hexdigest()[:12]
+    endpoint = request.endpoint if has_request_context() else None
+    stats.record(key, text, seconds, endpoint, slow)
+    if not slow:
+        return
+    record = {'fingerprint': key, 'duration_ms': round(seconds * 1000, 2), 'endpoint': endpoint,
+              'statement': statement}
+    if config['SLOW_QUERY_LOG_PARAMETERS']:
+        record['parameters'] = repr(parameters)[:1000]
+    # each fingerprint is explained once, the plan rarely changes between executions
+    if config['SLOW_QUERY_EXPLAIN'] and not executemany and not stats.has_plan(key):
+        plan = explain(conn, cursor, statement, parameters)
+        if plan is not None:
+            stats.set_plan(key, plan)
+            record['plan'] = plan
+    logger.warning('slow query %s', json.dumps(record))
+
+
+'''
+init_slow_queries(app) method
+    times every statement of app when SLOW_QUERY_MS is set, and aggregates the timings by fingerprint
+        statements taking at least SLOW_QUERY_MS milliseconds are logged as json lines by the
+            `app.database.slow_queries` logger at WARNING level, with their endpoint,
+            their parameters when SLOW_QUERY_LOG_PARAMETERS is set,
+            and the plan of their first slow execution when SLOW_QUERY_EXPLAIN is set
+        GET /queries reports the fingerprints taking the most time
+'''
+
+
+def init_slow_queries(app):
+    if not app.config.get('SLOW_QUERY_MS'):
+        return
+    app.extensions['query_stats'] = QueryStats()
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
@@ -0,0 +1,134 @@
+# instrumentation.py
+# opt-in timings of the database queries, auth, serialization, and compression of each request
+import json
+import logging
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+'''
+RequestTimings
+the query count and the time spent in each part of a request, in seconds
+    the parts are 'db', 'auth', 'serialize', and 'compress'
+'''
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.durations = {}
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+
+def current_timings():
+    '''returns the RequestTimings of the current request, or None if it isn't instrumented'''
+    return g.get('timings') if has_request_context() else None
+
+
+'''
+timed(name) context manager
+    adds the duration of the with block to the `name` part of the current request
+    does nothing when the request isn't instrumented
+    EXAMPLE
+        with timed('serialize'):
+            body = dumps(data)
+'''
+
+
+@contextmanager
+def timed(name):
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.instrumentation_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings()
+    start = getattr(context, 'instrumentation_start', None)
+    if timings is not None and start is not None:
+        timings.queries += 1
+        timings.add('db', time.perf_counter() - start)
+
+
+def listen_to_engines():
+    '''times the statements of every engine, i.e. the primary database and its replicas'''
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def server_timing(timings, total):
+    '''returns the Server-Timing header value of timings, with durations in milliseconds'''
+    metrics = [f'db;dur={timings.durations.get("db", 0.0) * 1000:.2f};desc="{timings.queries} queries"']
+    metrics += [f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.durations.items() if name != 'db']
+    metrics.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(metrics)
+
+
+def start_timings():
+    g.timings = RequestTimings()
+
+
+def finish_timings(response):
+    '''adds the Server-Timing header to response, and logs the timings of the request'''
+    timings = g.pop('timings', None)
+    if timings is None:
+        return response
+    total = timings.total()
+    response.headers['Server-Timing'] = server_timing(timings, total)
+    budget = current_app.config['QUERY_BUDGET']
+    record = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'queries': timings.queries,
+        'total_ms': round(total * 1000, 2)
+    }
+    record.update({f'{name}_ms': round(seconds * 1000, 2) for name, seconds in timings.durations.items()})
+    if budget and timings.queries > budget:
+        record['query_budget'] = budget
+        logger.warning('request over its query budget %s', json.dumps(record))
+    else:
+        logger.info('request %s', json.dumps(record))
+    return response
+
+
+'''
+init_instrumentation(app) method
+    instruments every request of app, when INSTRUMENTATION is enabled
+        responses get a Server-Timing header with the query count, and the db, auth, serialize, compress,
+            and total durations in milliseconds, which browser devtools display
+        each request is logged as a json line by the `app.instrumentation` logger, at INFO level
+        requests running more than QUERY_BUDGET queries are logged at WARNING level, i.e. an N+1 query pattern
+    streamed responses only count the queries run before their body is sent
+'''
+
+
+def init_instrumentation(app):
+    if not app.config.get('INSTRUMENTATION'):
+        return
+    listen_to_engines()
+    app.before_request(start_timings)
+    app.after_request(finish_timings)
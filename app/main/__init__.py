@@ -2,6 +2,8 @@
 from flask import Blueprint, jsonify, request, redirect, render_template
 from flask_cors import CORS
 from os import environ
+from ..compression import compress_response, encode_etag
+from ..instrumentation import timed
 # initializing the blueprint
 main = Blueprint('main', __name__)
 CORS(main, resources={r'*': {'origins': '*'}})
@@ -14,9 +16,13 @@ def after_request(response):
                          'Content-Type,Authorization,true')
     response.headers.add('Access-Control-Allow-Methods',
                          'GET,PATCH,POST,DELETE,OPTIONS')
-    response.headers.add('Content-Type', 'application/json')
-    return response
+    # keep the mimetype of non json responses, i.e. ndjson exports
+    response.headers.setdefault('Content-Type', 'application/json')
+    # compress large bodies, unless they were compressed by the response cache
+    with timed('compress'):
+        compress_response(response)
+    return encode_etag(response)
 
 
 # importing routes
-from . import actors, movies, errors
+from . import actors, movies, cast, search, stats, errors
@@ -1,40 +1,104 @@
 # actors.py
 from . import main
 from app import db
-from app.database.models import Actor, Movie
-from flask import abort, request, redirect, jsonify
-from sqlalchemy import exc
+from app.database.models import Actor
+from app.database.queries import ACTOR_SORTS, existing_ids, fetch_actor, fetch_actors, iter_actors
+from flask import abort, request, redirect
+from sqlalchemy import and_, exc
 from ..auth.auth import requires_auth
+from ..serialization import jsonify
+from ..cache import cached, cache_tags, conditional, invalidate, row_tags
+from .pagination import int_arg, paginate, to_id
+from .streaming import stream_export
+from .cast import update_cast
+from .bulk import bulk_payload, bulk_create, is_text
 
 # handling routes for actors endpoints
+'''
+actor_filters() method
+    returns the condition of the `gender`, `age_min` and `age_max` query parameters, or None without filters
+    aborts with a 400 error if an age is not an integer
+'''
+
+
+def actor_filters():
+    conditions = []
+    if 'gender' in request.args:
+        conditions.append(Actor.gender == request.args['gender'])
+    age_min, age_max = int_arg('age_min'), int_arg('age_max')
+    if age_min is not None:
+        conditions.append(Actor.age >= age_min)
+    if age_max is not None:
+        conditions.append(Actor.age <= age_max)
+    return and_(*conditions) if conditions else None
+
+
 '''
 endpoint
     GET /actors
         requires the 'get:actor-details' permission
         contains the actor's data representation
+        optional query parameters:
+            limit: the page size, capped at MAX_ITEMS_PER_PAGE
+            after: the next_cursor of the previous page
+            sort: `id` (default), `name`, or `age`, prefixed with `-` for descending order
+            gender: only actors of this gender
+            age_min, age_max: only actors of at least or at most this age
     returns status code 200 and json {
         "success": True,
-        "actors": [actors]
-    } where "actors" is a list with all actors
+        "actors": [actors],
+        "next_cursor": cursor
+    } where "actors" is a list with one page of the matching actors, in sort order
+        and "next_cursor" is the cursor of the next page, or null on the last page
         or appropriate status code indicating reason for failure
 '''
 
 
 @main.route('/actors')
 @requires_auth('get:actor-details')
+@conditional
+@cached
 def get_actors(payload):
     try:
-        actors = Actor.query.all()
+        # load the page and its movies with one query, straight into dicts
+        actors, next_cursor = paginate(fetch_actors, Actor.__table__, ACTOR_SORTS, actor_filters())
         if not actors:
             abort(404)
+        # new and updated actors may land on any page
+        cache_tags('actors', *row_tags(actors, 'actor', 'movies', 'movie'))
         return jsonify({
             'success': True,
-            'actors': [actor.format() for actor in actors]
+            'actors': actors,
+            'next_cursor': next_cursor
         })
     except Exception as error:
         raise error
 
 
+'''
+endpoint
+    GET /actors/export
+        requires the 'get:actor-details' permission
+        streams all actors, ordered by id, without loading the whole table in memory
+        optional query parameters:
+            format: `json` (default) for the same document as GET /actors, or `ndjson` for one actor per line
+    returns status code 200 and json {
+        "success": True,
+        "actors": [actors]
+    } where "actors" is a list with all actors
+        or appropriate status code indicating reason for failure
+'''
+
+
+@main.route('/actors/export')
+@requires_auth('get:actor-details')
+def export_actors(payload):
+    try:
+        return stream_export(iter_actors, 'actors')
+    except Exception as error:
+        raise error
+
+
 '''
 endpoint
     GET /actors/<id>
@@ -49,14 +113,17 @@ endpoint
 
 @main.route('/actors/<id>')
 @requires_auth('get:actor-details')
+@conditional
+@cached
 def get_actor_details(payload, id):
     try:
-        actor = Actor.query.get(id)
-        if not actor:
+        actor = fetch_actor(to_id(id))
+        if actor is None:
             abort(404)
+        cache_tags(*row_tags([actor], 'actor', 'movies', 'movie'))
         return jsonify({
             'success': True,
-            'actors': [actor.format()]
+            'actors': [actor]
         })
     except Exception as error:
         raise error
@@ -92,6 +159,7 @@ def post_actor(payload):
         )
         # insert the new actor to the database
         actor.insert()
+        invalidate('actors')
         return jsonify({
             'success': True,
             'actors': [actor.format()]
@@ -102,6 +170,61 @@ def post_actor(payload):
         raise error
 
 
+'''
+actor_values(item) method
+    returns the column values of an actor object in a request body
+    returns None if the name, age, or gender are missing or invalid
+'''
+
+
+def actor_values(item):
+    columns = Actor.__table__.c
+    if not is_text(columns.name, item.get('name')) or not is_text(columns.gender, item.get('gender')):
+        return None
+    if not isinstance(item.get('age'), str) or not item['age'].isdigit():
+        return None
+    return {'name': item['name'], 'age': int(item['age']), 'gender': item['gender']}
+
+
+'''
+endpoint
+    POST /actors/bulk
+        creates many rows in the actors table, in a single transaction
+        requires the 'post:actors' permission
+        it should contain a list of actor data representations, either as the body or under "actors"
+            at most BULK_MAX_ITEMS actors are accepted per request
+    returns status code 200 and json {
+        "success": True,
+        "created": count,
+        "results": [results]
+    } where "results" has one object per actor in the request, in the same order
+        {"index": i, "success": True, "actors": [actor]} for created actors
+        {"index": i, "success": False, "code": 400 or 409, "message": message} for invalid actors or duplicate names
+        or appropriate status code indicating reason for failure
+'''
+
+
+@main.route('/actors/bulk', methods=['POST'])
+@requires_auth('post:actors')
+def post_actors_bulk(payload):
+    try:
+        items = bulk_payload('actors')
+        results = bulk_create(Actor.__table__, 'name', items, actor_values)
+        invalidate('actors')
+        for result in results:
+            if result['success']:
+                result['actors'] = [dict(result.pop('values'), movies=[])]
+        return jsonify({
+            'success': True,
+            'created': sum(result['success'] for result in results),
+            'results': results
+        })
+    except exc.SQLAlchemyError:
+        abort(422)
+    except Exception as error:
+        raise error
+
+
 '''
 endpoint
     PATCH /actors/<id>
@@ -150,11 +273,14 @@ def update_actor(payload, id):
                 abort(400)
             # update the actor's gender
             actor.gender = body['gender']
+        actor_id = actor.id
         # update the actor in the database
         actor.update()
+        # the actor may now match other filters
+        invalidate(f'actor:{actor_id}', 'actors')
         return jsonify({
             'success': True,
-            'actors': [actor.format()]
+            'actors': [fetch_actor(actor_id)]
         })
     except exc.SQLAlchemyError:
         abort(422)
@@ -184,6 +310,7 @@ def delete_actor(payload, id):
             abort(404)
         # delete the actor
         actor.delete()
+        invalidate(f'actor:{actor.id}', 'actors')
         return jsonify({
             'success': True,
             'delete': id
@@ -211,27 +338,21 @@ endpoint
 @requires_auth('patch:actors')
 def add_movie_to_actor(payload, id):
     try:
-        actor = Actor.query.get(id)
-        if actor is None:
-            abort(404)
+        actor_id = to_id(id)
         # get json from body
         body = request.get_json()
         # Raise a 400 error if the movie_id is empty
         if 'movie_id' not in body or not isinstance(body['movie_id'], str):
+            # a missing actor is reported before a bad body, so only bad bodies pay for this query
+            if not existing_ids(Actor.__table__, {actor_id}):
+                abort(404)
             # either the movie_id is not in the body or it's not a string
             abort(400)
-        # add the movie to the actor if the movie is available in the database
-        movie = Movie.query.get(body['movie_id'])
-        if movie is None:
-            # trying to append a movie with an envalid movie_id should return a 404 error
-            abort(404)
-        # append the movie to the actor
-        actor.movies.append(movie)
-        # update the actor in the database
-        actor.update()
+        # link the movie to the actor, returns a 404 error if either is not found
+        update_cast(actor_id, to_id(body['movie_id']))
         return jsonify({
             'success': True,
-            'actors': [actor.format()]
+            'actors': [fetch_actor(actor_id)]
         })
     except exc.SQLAlchemyError:
         abort(422)
@@ -256,27 +377,21 @@ endpoint
 @requires_auth('patch:actors')
 def delete_movie_from_actor(payload, id):
     try:
-        actor = Actor.query.get(id)
-        if actor is None:
-            abort(404)
+        actor_id = to_id(id)
         # get json from body
         body = request.get_json()
         # Raise a 400 error if the movie_id is empty
         if 'movie_id' not in body or not isinstance(body['movie_id'], str):
+            # a missing actor is reported before a bad body, so only bad bodies pay for this query
+            if not existing_ids(Actor.__table__, {actor_id}):
+                abort(404)
             # either the movie_id is not in the body or it's not a string
             abort(400)
-        # add the movie to the actor if the movie is available in the database
-        movie = Movie.query.get(body['movie_id'])
-        if movie is None:
-            # trying to delete a movie with an envalid movie_id should return a 404 error
-            abort(404)
-        # delete the movie from the actor
-        actor.movies.remove(movie)
-        # update the actor in the database
-        actor.update()
+        # unlink the movie from the actor, returns a 404 error if either is not found
+        update_cast(actor_id, to_id(body['movie_id']), linked=False)
         return jsonify({
             'success': True,
-            'actors': [actor.format()]
+            'actors': [fetch_actor(actor_id)]
         })
     except exc.SQLAlchemyError:
         abort(422)
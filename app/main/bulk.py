@@ -0,0 +1,106 @@
+# bulk.py
+# helpers for the bulk create endpoints
+from app import db
+from app.database.models import bump_versions, parse_release_date
+from flask import abort, current_app, request
+from sqlalchemy import select
+
+'''
+bulk_payload(key) method
+    returns the list of items in the request body
+        the body may be a json array, or an object with the array under key (i.e. {"actors": [...]})
+    aborts with a 400 error if there are no items
+    aborts with a 413 error if there are more than BULK_MAX_ITEMS items
+'''
+
+
+def bulk_payload(key):
+    body = request.get_json()
+    items = body.get(key) if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        abort(400)
+    if len(items) > current_app.config['BULK_MAX_ITEMS']:
+        abort(413)
+    return items
+
+
+'''
+is_text(column, value) method
+    returns True if value is a string which fits in the given String column
+'''
+
+
+def is_text(column, value):
+    return isinstance(value, str) and (column.type.length is None or len(value) <= column.type.length)
+
+
+def is_release_date(value):
+    '''returns True if value is a 'MM/DD/YYYY' string of a valid date'''
+    try:
+        parse_release_date(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def failure(index, code, message):
+    return {'index': index, 'success': False, 'code': code, 'message': message}
+
+
+'''
+bulk_create(table, unique, items, validate) method
+    @INPUTS
+        table: the table to insert into (i.e. Actor.__table__)
+        unique: the name of the unique column (i.e. 'name')
+        items: the items of the request body
+        validate: a function returning the column values of an item, or None if the item is invalid
+
+    inserts all valid items in one transaction, with multi-row INSERTs of BULK_INSERT_CHUNK rows
+    items whose unique value already exists, or repeats an earlier item, are reported as 409 conflicts
+    returns a list with one result per item, in request order
+        {"index": i, "success": True, "values": {...}} for created rows, including the new id
+        {"index": i, "success": False, "code": code, "message": message} otherwise
+    raises sqlalchemy errors after rolling back, i.e. if a concurrent request inserted the same value
+'''
+
+
+def bulk_create(table, unique, items, validate):
+    chunk_size = current_app.config['BULK_INSERT_CHUNK']
+    results = [None] * len(items)
+    pending = {}
+    for index, item in enumerate(items):
+        values = validate(item) if isinstance(item, dict) else None
+        if values is None:
+            results[index] = failure(index, 400, 'bad request')
+        elif values[unique] in pending:
+            results[index] = failure(index, 409, f'duplicate {unique}')
+        else:
+            pending[values[unique]] = (index, values)
+    # look the unique values up with one indexed query per chunk
+    column = table.c[unique]
+    for keys in chunks(list(pending), chunk_size):
+        for (existing,) in db.session.execute(select([column]).where(column.in_(keys))):
+            index, values = pending.pop(existing)
+            results[index] = failure(index, 409, f'{unique} already exists')
+    try:
+        rows = [values for index, values in pending.values()]
+        for chunk in chunks(rows, chunk_size):
+            db.session.execute(table.insert().values(chunk))
+        # read the generated ids back
+        for keys in chunks(list(pending), chunk_size):
+            query = select([table.c.id, column]).where(column.in_(keys))
+            for id, key in db.session.execute(query):
+                index, values = pending[key]
+                results[index] = {'index': index, 'success': True, 'values': dict(values, id=id)}
+        if pending:
+            bump_versions(table.name)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return results
@@ -0,0 +1,165 @@
+# cast.py
+# handling routes for linking many actors and movies at once
+from . import main
+from app import db
+from app.database.models import bump_versions
+from app.database.queries import actors, movies, cast_exists, existing_ids, link_cast, unlink_cast
+from flask import abort, current_app
+from sqlalchemy import exc
+from ..auth.auth import requires_auth
+from ..cache import invalidate
+from ..serialization import jsonify
+from .bulk import bulk_payload, chunks, failure
+
+'''
+cast_pairs(items) method
+    parses the items of a cast request body into (actor_id, movie_id) pairs
+    ids may be integers or strings of digits, like the other cast routes accept
+    returns (pairs, results) where pairs maps each valid, unique pair to its index in the request
+        and results holds a failure for every invalid or repeated item
+'''
+
+
+def cast_pairs(items):
+    pairs = {}
+    results = [None] * len(items)
+    for index, item in enumerate(items):
+        pair = None
+        if isinstance(item, dict):
+            ids = [item.get('actor_id'), item.get('movie_id')]
+            if all((isinstance(id, int) and not isinstance(id, bool))
+                   or (isinstance(id, str) and id.isdigit()) for id in ids):
+                pair = tuple(int(id) for id in ids)
+        if pair is None:
+            results[index] = failure(index, 400, 'bad request')
+        elif pair in pairs:
+            results[index] = failure(index, 409, 'duplicate pair')
+        else:
+            pairs[pair] = index
+    return pairs, results
+
+
+def cast_tags(pairs):
+    '''returns the cache tags of the actors and movies in pairs'''
+    tags = set()
+    for actor_id, movie_id in pairs:
+        tags.update((f'actor:{actor_id}', f'movie:{movie_id}'))
+    return tags
+
+
+'''
+update_cast(actor_id, movie_id, linked) method
+    links an actor and a movie, or unlinks them when linked is False, and commits
+        with one query checking that both exist, and one statement changing the link
+    aborts with a 404 error if the actor or the movie is not found
+    linking a linked pair, or unlinking an unlinked one, changes nothing
+'''
+
+
+def update_cast(actor_id, movie_id, linked=True):
+    actor_found, movie_found = cast_exists(actor_id, movie_id)
+    if not (actor_found and movie_found):
+        abort(404)
+    changed = (link_cast if linked else unlink_cast)([(actor_id, movie_id)])
+    if changed:
+        bump_versions('actor_movies')
+    db.session.commit()
+    invalidate(*cast_tags([(actor_id, movie_id)]))
+
+
+'''
+endpoint
+    POST /cast
+        links many actors to many movies in one round trip
+        requires the 'patch:actors' or the 'patch:movies' permission
+        it should contain a list of {"actor_id": id, "movie_id": id} objects, either as the body or under "cast"
+            at most BULK_MAX_ITEMS pairs are accepted per request
+        pairs which are already linked are left untouched
+    returns status code 200 and json {
+        "success": True,
+        "linked": count,
+        "results": [results]
+    } where "linked" is the number of new links, and "results" has one object per pair in the request
+        {"index": i, "success": True} for linked pairs
+        {"index": i, "success": False, "code": 400, 404 or 409, "message": message} for invalid pairs,
+            unknown actors or movies, and repeated pairs
+        or appropriate status code indicating reason for failure
+'''
+
+
+@main.route('/cast', methods=['POST'])
+@requires_auth(any_of=['patch:actors', 'patch:movies'])
+def post_cast(payload):
+    try:
+        pairs, results = cast_pairs(bulk_payload('cast'))
+        # unknown ids would violate the foreign keys, so report them per pair instead
+        actor_ids = existing_ids(actors, {actor_id for actor_id, movie_id in pairs})
+        movie_ids = existing_ids(movies, {movie_id for actor_id, movie_id in pairs})
+        valid = []
+        for pair, index in pairs.items():
+            if pair[0] in actor_ids and pair[1] in movie_ids:
+                valid.append(pair)
+                results[index] = {'index': index, 'success': True}
+            else:
+                results[index] = failure(index, 404, 'resource not found')
+        linked = 0
+        for chunk in chunks(valid, current_app.config['BULK_INSERT_CHUNK']):
+            linked += link_cast(chunk)
+        if linked:
+            bump_versions('actor_movies')
+        db.session.commit()
+        invalidate(*cast_tags(valid))
+        return jsonify({
+            'success': True,
+            'linked': linked,
+            'results': results
+        })
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        abort(422)
+    except Exception as error:
+        raise error
+
+
+'''
+endpoint
+    DELETE /cast
+        unlinks many actors from many movies in one round trip
+        requires the 'patch:actors' or the 'patch:movies' permission
+        it should contain a list of {"actor_id": id, "movie_id": id} objects, either as the body or under "cast"
+            at most BULK_MAX_ITEMS pairs are accepted per request
+    returns status code 200 and json {
+        "success": True,
+        "unlinked": count,
+        "results": [results]
+    } where "unlinked" is the number of removed links, and "results" has one object per pair in the request
+        {"index": i, "success": True} for pairs which are no longer linked
+        {"index": i, "success": False, "code": 400 or 409, "message": message} for invalid and repeated pairs
+        or appropriate status code indicating reason for failure
+'''
+
+
+@main.route('/cast', methods=['DELETE'])
+@requires_auth(any_of=['patch:actors', 'patch:movies'])
+def delete_cast(payload):
+    try:
+        pairs, results = cast_pairs(bulk_payload('cast'))
+        for index in pairs.values():
+            results[index] = {'index': index, 'success': True}
+        unlinked = 0
+        for chunk in chunks(list(pairs), current_app.config['BULK_INSERT_CHUNK']):
+            unlinked += unlink_cast(chunk)
+        if unlinked:
+            bump_versions('actor_movies')
+        db.session.commit()
+        invalidate(*cast_tags(pairs))
+        return jsonify({
+            'success': True,
+            'unlinked': unlinked,
+            'results': results
+        })
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        abort(422)
+    except Exception as error:
+        raise error
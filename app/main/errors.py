@@ -1,7 +1,9 @@
 # errors.py
 from . import main
 from ..auth.auth import AuthError
-from flask import abort, jsonify
+from ..metrics import count_auth_error
+from flask import abort
+from ..serialization import jsonify
 from werkzeug.exceptions import HTTPException
 # error handlers
 
@@ -12,6 +14,7 @@ error handler for authorization errors
 
 @main.errorhandler(AuthError)
 def authorization_error(error):
+    count_auth_error(error)
     return jsonify({
         'success': False,
         'code': error.status_code,
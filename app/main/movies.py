@@ -2,10 +2,54 @@
 # handling routes for movies endpoints
 from . import main
 from app import db
-from app.database.models import Actor, Movie
-from flask import abort, request, redirect, jsonify
-from sqlalchemy import exc
+from app.database.models import Movie, parse_release_date
+from app.database.queries import MOVIE_SORTS, existing_ids, fetch_movie, fetch_movies, iter_movies
+from flask import abort, request, redirect
+from sqlalchemy import and_, exc
 from ..auth.auth import requires_auth
+from ..serialization import jsonify
+from ..cache import cached, cache_tags, conditional, invalidate, row_tags
+from .pagination import paginate, to_id
+from .streaming import stream_export
+from .cast import update_cast
+from .bulk import bulk_payload, bulk_create, is_release_date, is_text
+
+
+'''
+release_date_arg(name) method
+    returns the date of a MM/DD/YYYY query parameter, or None if it's not given
+    aborts with a 400 error if the value is not a valid date
+'''
+
+
+def release_date_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return parse_release_date(value)
+    except ValueError:
+        abort(400)
+
+
+'''
+movie_filters() method
+    returns the condition of the `title_prefix`, `release_after` and `release_before` query parameters,
+        or None without filters
+    aborts with a 400 error if a release date is not a MM/DD/YYYY date
+'''
+
+
+def movie_filters():
+    conditions = []
+    if 'title_prefix' in request.args:
+        conditions.append(Movie.title.startswith(request.args['title_prefix'], autoescape=True))
+    release_after, release_before = release_date_arg('release_after'), release_date_arg('release_before')
+    if release_after is not None:
+        conditions.append(Movie.release_date > release_after)
+    if release_before is not None:
+        conditions.append(Movie.release_date < release_before)
+    return and_(*conditions) if conditions else None
 
 
 '''
@@ -13,29 +57,67 @@ endpoint
     GET /movies
         requires the 'get:movie-details' permission
         contains the movie's data representation
+        optional query parameters:
+            limit: the page size, capped at MAX_ITEMS_PER_PAGE
+            after: the next_cursor of the previous page
+            sort: `id` (default), `title`, or `release_date`, prefixed with `-` for descending order
+            title_prefix: only movies whose title starts with this text
+            release_after, release_before: only movies released after or before these MM/DD/YYYY dates
     returns status code 200 and json {
         "success": True,
-        "movies": [movies]
-    } where "movies" is a list with all movies
+        "movies": [movies],
+        "next_cursor": cursor
+    } where "movies" is a list with one page of the matching movies, in sort order
+        and "next_cursor" is the cursor of the next page, or null on the last page
         or appropriate status code indicating reason for failure
 '''
 
 
 @main.route('/movies')
 @requires_auth('get:movie-details')
+@conditional
+@cached
 def get_movies(payload):
     try:
-        movies = Movie.query.all()
+        # load the page and its actors with one query, straight into dicts
+        movies, next_cursor = paginate(fetch_movies, Movie.__table__, MOVIE_SORTS, movie_filters())
         if not movies:
             abort(404)
+        # new and updated movies may land on any page
+        cache_tags('movies', *row_tags(movies, 'movie', 'actors', 'actor'))
         return jsonify({
             'success': True,
-            'movies': [movie.format() for movie in movies]
+            'movies': movies,
+            'next_cursor': next_cursor
         })
     except Exception as error:
         raise error
 
 
+'''
+endpoint
+    GET /movies/export
+        requires the 'get:movie-details' permission
+        streams all movies, ordered by id, without loading the whole table in memory
+        optional query parameters:
+            format: `json` (default) for the same document as GET /movies, or `ndjson` for one movie per line
+    returns status code 200 and json {
+        "success": True,
+        "movies": [movies]
+    } where "movies" is a list with all movies
+        or appropriate status code indicating reason for failure
+'''
+
+
+@main.route('/movies/export')
+@requires_auth('get:movie-details')
+def export_movies(payload):
+    try:
+        return stream_export(iter_movies, 'movies')
+    except Exception as error:
+        raise error
+
+
 '''
 endpoint
     GET /movies/<id>
@@ -50,14 +132,17 @@ endpoint
 
 @main.route('/movies/<id>')
 @requires_auth('get:movie-details')
+@conditional
+@cached
 def get_movie_details(payload, id):
     try:
-        movie = Movie.query.get(id)
-        if not movie:
+        movie = fetch_movie(to_id(id))
+        if movie is None:
             abort(404)
+        cache_tags(*row_tags([movie], 'movie', 'actors', 'actor'))
         return jsonify({
             'success': True,
-            'movies': [movie.format()]
+            'movies': [movie]
         })
     except Exception as error:
         raise error
@@ -83,8 +168,8 @@ def post_movie(payload):
         # Raise a 400 error if the name, age, or gender are not in body
         if 'title' not in body or 'release_date' not in body:
             abort(400)
-        # insure that the title and release_date are strings
-        if not isinstance(body['title'], str) or not isinstance(body['release_date'], str):
+        # insure that the title is a string, and the release_date a MM/DD/YYYY date
+        if not isinstance(body['title'], str) or not is_release_date(body['release_date']):
             abort(400)
         movie = Movie(
             title=body['title'],
@@ -92,6 +177,7 @@ def post_movie(payload):
         )
         # insert the new movie to the database
         movie.insert()
+        invalidate('movies')
         return jsonify({
             'success': True,
             'movies': [movie.format()]
@@ -102,6 +188,59 @@ def post_movie(payload):
         raise error
 
 
+'''
+movie_values(item) method
+    returns the column values of a movie object in a request body
+    returns None if the title or release_date are missing or invalid
+'''
+
+
+def movie_values(item):
+    columns = Movie.__table__.c
+    if not is_text(columns.title, item.get('title')) or not is_release_date(item.get('release_date')):
+        return None
+    return {'title': item['title'], 'release_date': item['release_date']}
+
+
+'''
+endpoint
+    POST /movies/bulk
+        creates many rows in the movies table, in a single transaction
+        requires the 'post:movies' permission
+        it should contain a list of movie data representations, either as the body or under "movies"
+            at most BULK_MAX_ITEMS movies are accepted per request
+    returns status code 200 and json {
+        "success": True,
+        "created": count,
+        "results": [results]
+    } where "results" has one object per movie in the request, in the same order
+        {"index": i, "success": True, "movies": [movie]} for created movies
+        {"index": i, "success": False, "code": 400 or 409, "message": message} for invalid movies or duplicate titles
+        or appropriate status code indicating reason for failure
+'''
+
+
+@main.route('/movies/bulk', methods=['POST'])
+@requires_auth('post:movies')
+def post_movies_bulk(payload):
+    try:
+        items = bulk_payload('movies')
+        results = bulk_create(Movie.__table__, 'title', items, movie_values)
+        invalidate('movies')
+        for result in results:
+            if result['success']:
+                result['movies'] = [dict(result.pop('values'), actors=[])]
+        return jsonify({
+            'success': True,
+            'created': sum(result['success'] for result in results),
+            'results': results
+        })
+    except exc.SQLAlchemyError:
+        abort(422)
+    except Exception as error:
+        raise error
+
+
 '''
 endpoint
     PATCH /movies/<id>
@@ -136,17 +275,20 @@ def update_movie(payload, id):
             movie.title = body['title']
         # update the release_date if it's available in the request body
         if 'release_date' in body:
-            # check that the title is a string
-            if not isinstance(body['release_date'], str):
-                # release_date is not a string
+            # check that the release_date is a MM/DD/YYYY date
+            if not is_release_date(body['release_date']):
+                # release_date is not a date
                 abort(400)
             # update the movie's release_date
             movie.release_date = body['release_date']
+        movie_id = movie.id
         # update the movie in the database
         movie.update()
+        # the movie may now match other filters
+        invalidate(f'movie:{movie_id}', 'movies')
         return jsonify({
             'success': True,
-            'movies': [movie.format()]
+            'movies': [fetch_movie(movie_id)]
         })
     except exc.SQLAlchemyError:
         abort(422)
@@ -176,6 +318,7 @@ def delete_movie(payload, id):
             abort(404)
         # delete the movie
         movie.delete()
+        invalidate(f'movie:{movie.id}', 'movies')
         return jsonify({
             'success': True,
             'delete': id
@@ -203,27 +346,21 @@ endpoint
 @requires_auth('patch:actors')
 def add_actor_to_movie(payload, id):
     try:
-        movie = Movie.query.get(id)
-        if movie is None:
-            abort(404)
+        movie_id = to_id(id)
         # get json from body
         body = request.get_json()
         # Raise a 400 error if the actor_id is empty
         if 'actor_id' not in body or not isinstance(body['actor_id'], str):
+            # a missing movie is reported before a bad body, so only bad bodies pay for this query
+            if not existing_ids(Movie.__table__, {movie_id}):
+                abort(404)
             # either the actor_id is not in the body or it's not a string
             abort(400)
-        # add the actor to the movie if the actor is available in the database
-        actor = Actor.query.get(body['actor_id'])
-        if actor is None:
-            # trying to append an actor with an envalid actor_id should return a 404 error
-            abort(404)
-        # append the actor to the movie
-        movie.actors.append(actor)
-        # update the movie in the database
-        movie.update()
+        # link the actor to the movie, returns a 404 error if either is not found
+        update_cast(to_id(body['actor_id']), movie_id)
         return jsonify({
             'success': True,
-            'movies': [movie.format()]
+            'movies': [fetch_movie(movie_id)]
         })
     except exc.SQLAlchemyError:
         abort(422)
@@ -248,27 +385,21 @@ endpoint
 @requires_auth('patch:movies')
 def delete_actor_from_movie(payload, id):
     try:
-        movie = Movie.query.get(id)
-        if movie is None:
-            abort(404)
+        movie_id = to_id(id)
         # get json from body
         body = request.get_json()
         # Raise a 400 error if the actor_id is empty
         if 'actor_id' not in body or not isinstance(body['actor_id'], str):
+            # a missing movie is reported before a bad body, so only bad bodies pay for this query
+            if not existing_ids(Movie.__table__, {movie_id}):
+                abort(404)
             # either the actor_id is not in the body or it's not a string
             abort(400)
-        # add the actor to the movie if the actor is available in the database
-        actor = Actor.query.get(body['actor_id'])
-        if actor is None:
-            # trying to delete an actor with an envalid actor_id should return a 404 error
-            abort(404)
-        # delete the actor from the movie
-        movie.actors.remove(actor)
-        # update the movie in the database
-        movie.update()
+        # unlink the actor from the movie, returns a 404 error if either is not found
+        update_cast(to_id(body['actor_id']), movie_id, linked=False)
         return jsonify({
             'success': True,
-            'movies': [movie.format()]
+            'movies': [fetch_movie(movie_id)]
         })
     except exc.SQLAlchemyError:
         abort(422)
@@ -0,0 +1,167 @@
+# pagination.py
+# keyset (cursor) pagination helpers for the list endpoints
+import base64
+import binascii
+import json
+import operator
+from flask import abort, current_app, request
+from sqlalchemy import and_, or_
+
+'''
+encode_cursor(values) method
+    returns an opaque, url safe cursor for the key values of the last row of a page
+'''
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+'''
+decode_cursor(cursor) method
+    returns the key values stored in a cursor made by encode_cursor
+    aborts with a 400 error if the cursor is malformed
+'''
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        abort(400)
+    if not isinstance(values, list) or not values \
+            or not all(isinstance(value, (int, float, str)) for value in values):
+        abort(400)
+    return values
+
+
+'''
+to_id(value) method
+    returns the integer id in a url parameter
+    aborts with a 404 error if value is not an integer, so no string reaches an integer column
+'''
+
+
+def to_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        abort(404)
+
+
+'''
+int_arg(name) method
+    returns the integer value of a query parameter, or None if it's not given
+    aborts with a 400 error if the value is not an integer
+'''
+
+
+def int_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+
+'''
+page_size() method
+    returns the requested `limit` query parameter, capped at MAX_ITEMS_PER_PAGE
+    falls back to ITEMS_PER_PAGE when no limit is given
+    aborts with a 400 error if the limit is not a positive integer
+'''
+
+
+def page_size():
+    limit = request.args.get('limit', current_app.config['ITEMS_PER_PAGE'])
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    return min(limit, current_app.config['MAX_ITEMS_PER_PAGE'])
+
+
+'''
+sort_order(sorts) method
+    returns (name, descending) for the `sort` query parameter, i.e. 'age' or '-age' for descending order
+    falls back to ascending ids when no sort is given
+    aborts with a 400 error if the sort is not a key of sorts
+'''
+
+
+def sort_order(sorts):
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    name = sort[1:] if descending else sort
+    if name not in sorts:
+        abort(400)
+    return name, descending
+
+
+'''
+keyset(values, table, sort, descending) method
+    returns the condition selecting the rows after a cursor, in the order of sort
+        ids are compared alone, other keys as (key, id) pairs, i.e. for ascending ages
+        age > :age OR (age = :age AND id > :id)
+    aborts with a 400 error if the cursor doesn't hold a value of this sort
+'''
+
+
+def keyset(values, table, sort, descending):
+    expression = sort.expression(table)
+    after = operator.lt if descending else operator.gt
+    if expression is table.c.id:
+        if len(values) != 1:
+            abort(400)
+        return after(table.c.id, values[0])
+    if len(values) != 2:
+        abort(400)
+    value, id = values
+    if sort.parse is not None:
+        try:
+            value = sort.parse(value)
+        except (TypeError, ValueError):
+            abort(400)
+    return or_(after(expression, value), and_(expression == value, after(table.c.id, id)))
+
+
+'''
+paginate(fetch, table, sorts, condition) method
+    @INPUTS
+        fetch: a function of (condition, limit, sort, descending) returning the matching rows, in sort order
+        table: the table of the rows
+        sorts: the SortKey of each allowed `sort` query parameter (i.e. ACTOR_SORTS)
+        condition: an optional filter of the rows
+
+    reads the `limit`, `sort` and `after` query parameters of the current request
+    returns (items, next_cursor), where next_cursor is None on the last page
+    rows are fetched with WHERE (key, id) > :after ORDER BY key, id LIMIT :limit + 1,
+        so with an index on (key, id), deep pages cost the same as the first one
+    EXAMPLE
+        actors, next_cursor = paginate(fetch_actors, Actor.__table__, ACTOR_SORTS, Actor.gender == 'female')
+'''
+
+
+def paginate(fetch, table, sorts, condition=None):
+    limit = page_size()
+    name, descending = sort_order(sorts)
+    sort = sorts[name]
+    after = request.args.get('after')
+    if after:
+        after = keyset(decode_cursor(after), table, sort, descending)
+        condition = after if condition is None else and_(condition, after)
+    # fetch one extra row to know if there is a next page
+    items = fetch(condition, limit + 1, name, descending)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        values = [last['id']] if sort.expression(table) is table.c.id else [sort.value(last), last['id']]
+        next_cursor = encode_cursor(values)
+    return items, next_cursor
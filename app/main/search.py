@@ -0,0 +1,74 @@
+# search.py
+# handling the search route
+from . import main
+from flask import abort, current_app, request
+from app.database.search import search
+from ..auth.auth import requires_auth
+from ..cache import cached, cache_tags, conditional
+from ..serialization import jsonify
+from .pagination import decode_cursor, encode_cursor, page_size
+
+# the result kinds of each `type` query parameter, and the name of their text field
+SEARCH_TYPES = {
+    'all': ('actor', 'movie'),
+    'actors': ('actor',),
+    'movies': ('movie',)
+}
+TEXT_FIELDS = {'actor': 'name', 'movie': 'title'}
+
+'''
+endpoint
+    GET /search
+        requires the 'get:actor-details' and 'get:movie-details' permissions
+        searches actor names and movie titles, by trigram similarity and substring
+        query parameters:
+            q: the searched text, required
+            type: `all` (default), `actors`, or `movies`
+            limit: the page size, capped at MAX_ITEMS_PER_PAGE
+            after: the next_cursor of the previous page
+        only the best SEARCH_MAX_RESULTS matches can be paged through
+    returns status code 200 and json {
+        "success": True,
+        "results": [results],
+        "next_cursor": cursor
+    } where "results" holds one page of {"type": "actor", "id": id, "name": name, "score": score}
+        and {"type": "movie", "id": id, "title": title, "score": score} objects, best first
+        and "next_cursor" is the cursor of the next page, or null on the last page
+        or appropriate status code indicating reason for failure
+'''
+
+
+@main.route('/search')
+@requires_auth(all_of=['get:actor-details', 'get:movie-details'])
+@conditional
+@cached
+def search_catalog(payload):
+    try:
+        q = request.args.get('q', '').strip()
+        kinds = SEARCH_TYPES.get(request.args.get('type', 'all'))
+        if not q or kinds is None:
+            abort(400)
+        limit = page_size()
+        after = request.args.get('after')
+        offset = decode_cursor(after)[0] if after else 0
+        if not isinstance(offset, int) or offset < 0:
+            abort(400)
+        # deep pages of a ranked search are noise, and cost as much as all the pages before them
+        max_results = current_app.config['SEARCH_MAX_RESULTS']
+        limit = max(min(limit, max_results - offset), 0)
+        # fetch one extra match to know if there is a next page
+        matches = search(q, kinds, limit + 1, offset) if limit else []
+        next_cursor = None
+        if len(matches) > limit and offset + limit < max_results:
+            next_cursor = encode_cursor([offset + limit])
+        results = [{'type': kind, 'id': id, TEXT_FIELDS[kind]: text, 'score': round(score, 4)}
+                   for kind, id, text, score in matches[:limit]]
+        # any new or updated row may match
+        cache_tags('actors', 'movies', *(f'{result["type"]}:{result["id"]}' for result in results))
+        return jsonify({
+            'success': True,
+            'results': results,
+            'next_cursor': next_cursor
+        })
+    except Exception as error:
+        raise error
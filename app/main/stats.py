@@ -0,0 +1,110 @@
+# stats.py
+# handling the routes reporting on the response cache, the connection pool, and the database statements
+from functools import wraps
+from . import main
+from app import db
+from app.database.pool import pool_stats
+from app.database.replicas import get_replicas
+from app.database.slow_queries import get_query_stats
+from .pagination import int_arg
+from ..auth.auth import AuthError
+from ..cache import get_cache
+from ..metrics import has_metrics_token
+from ..serialization import jsonify
+
+'''
+@requires_metrics_token decorator
+    restricts an operational endpoint to requests with an `Authorization: Bearer <METRICS_TOKEN>` header,
+        since it exposes the internals of the worker, i.e. its pools and statements
+    raises a 401 AuthError if the header is missing or wrong, and while METRICS_TOKEN is not set
+'''
+
+
+def requires_metrics_token(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not has_metrics_token():
+            raise AuthError({
+                'code': 'invalid_token',
+                'description': 'Requires the METRICS_TOKEN bearer token.'
+            }, 401)
+        return f(*args, **kwargs)
+    return wrapper
+
+
+'''
+endpoint
+    GET /cache
+        requires an `Authorization: Bearer <METRICS_TOKEN>` header
+    returns status code 200 and json {
+        "success": True,
+        "cache": {"hits": hits, "misses": misses, "hit_ratio": ratio, "invalidations": invalidations}
+    } with the counters of the worker serving the request, or "cache": None if the cache is disabled
+'''
+
+
+@main.route('/cache')
+@requires_metrics_token
+def get_cache_stats():
+    cache = get_cache()
+    return jsonify({
+        'success': True,
+        'cache': cache.stats() if cache is not None else None
+    })
+
+
+'''
+endpoint
+    GET /pool
+        requires an `Authorization: Bearer <METRICS_TOKEN>` header
+    returns status code 200 and json {
+        "success": True,
+        "pool": {
+            "size": size, "max_overflow": max_overflow, "checked_out": count, "overflow": count,
+            "saturation": ratio, "checkouts": count, "timeouts": count,
+            "wait_seconds_total": seconds, "wait_seconds_max": seconds
+        }
+        "replicas": [{"url": url, "healthy": healthy, "pool": pool}]
+    } with the database connection pools of the worker serving the request, "pool": None for sqlite databases
+        healthy is the result of the last health check of the replica, None before its first check
+'''
+
+
+@main.route('/pool')
+@requires_metrics_token
+def get_pool_stats():
+    replicas = get_replicas()
+    return jsonify({
+        'success': True,
+        'pool': pool_stats(db.engine),
+        'replicas': replicas.status() if replicas is not None else []
+    })
+
+
+'''
+endpoint
+    GET /queries
+        requires an `Authorization: Bearer <METRICS_TOKEN>` header
+        optional query parameters:
+            limit: the number of fingerprints, 20 by default
+    returns status code 200 and json {
+        "success": True,
+        "queries": [{
+            "fingerprint": key, "statement": statement, "count": count, "slow": count,
+            "total_ms": ms, "p50_ms": ms, "p99_ms": ms, "max_ms": ms,
+            "endpoints": {endpoint: count}, "plan": plan
+        }]
+    } with the statements of the worker serving the request taking the most total time,
+        or "queries": None if SLOW_QUERY_MS is not set
+'''
+
+
+@main.route('/queries')
+@requires_metrics_token
+def get_query_stats_report():
+    stats = get_query_stats()
+    limit = int_arg('limit') or 20
+    return jsonify({
+        'success': True,
+        'queries': stats.top(limit) if stats is not None else None
+    })
@@ -0,0 +1,79 @@
+# streaming.py
+# helpers for streaming full-table exports without building them in memory
+from flask import Response, abort, current_app, request, stream_with_context
+
+# the export formats, and their mimetypes
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
+
+'''
+export_format() method
+    returns the `format` query parameter of the current request, `json` by default
+    aborts with a 400 error if the format is not supported
+'''
+
+
+def export_format():
+    export = request.args.get('format', 'json')
+    if export not in EXPORT_FORMATS:
+        abort(400)
+    return export
+
+
+'''
+iter_json(items, key, export, batch_size) method
+    @INPUTS
+        items: an iterable of the exported rows
+        key: the name of the array in the json export (i.e. 'actors')
+        export: 'json' for a single {"success": true, key: [...]} document, or 'ndjson' for one row per line
+        batch_size: how many rows to send at once
+
+    rows are encoded with the app's json provider
+    yields the export as byte chunks of batch_size rows, so memory stays flat regardless of the table size
+'''
+
+
+def iter_json(items, key, export, batch_size):
+    if export == 'json':
+        yield b'{"success":true,"%s":[' % key.encode()
+    dumps = current_app.json_provider.dumps
+    chunk = []
+    count = 0
+    for row in items:
+        item = dumps(row, compact=True)
+        if export == 'ndjson':
+            chunk.append(item + b'\n')
+        else:
+            # json array items are comma separated
+            chunk.append(item if count == 0 else b',' + item)
+        count += 1
+        if len(chunk) >= batch_size:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
+    if export == 'json':
+        yield b']}'
+
+
+'''
+stream_export(iter_items, key) method
+    @INPUTS
+        iter_items: a function of (batch_size) returning an iterator of the exported rows
+        key: the name of the array in the json export (i.e. 'actors')
+
+    returns a streamed response of all rows, in the format requested by the `format` query parameter
+    the batch size is set by the EXPORT_BATCH_SIZE config
+    EXAMPLE
+        return stream_export(iter_actors, 'actors')
+'''
+
+
+def stream_export(iter_items, key):
+    export = export_format()
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    items = iter_items(batch_size)
+    return Response(stream_with_context(iter_json(items, key, export, batch_size)),
+                    mimetype=EXPORT_FORMATS[export])
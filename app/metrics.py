@@ -0,0 +1,321 @@
+# metrics.py
+# prometheus metrics of the requests, database pools, caches, and auth of each worker
+import bisect
+import glob
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from flask import current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+# the upper bounds of the request duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the type and help text of every exported metric
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method, and status code.'),
+    'http_request_duration_seconds': ('histogram', 'Request durations, by endpoint.'),
+    'auth_errors_total': ('counter', 'Requests rejected by @requires_auth, by error code and status code.'),
+    'db_pool_size': ('gauge', 'Connections kept by the database pools.'),
+    'db_pool_checked_out': ('gauge', 'Connections in use.'),
+    'db_pool_overflow': ('gauge', 'Overflow connections open.'),
+    'db_pool_checkouts_total': ('counter', 'Connection checkouts.'),
+    'db_pool_timeouts_total': ('counter', 'Connection checkouts which timed out.'),
+    'db_pool_wait_seconds_total': ('counter', 'Time spent checking out connections.'),
+    'response_cache_hits_total': ('counter', 'Response cache hits.'),
+    'response_cache_misses_total': ('counter', 'Response cache misses.'),
+    'response_cache_invalidations_total': ('counter', 'Response cache invalidations.'),
+    'token_cache_hits_total': ('counter', 'Verified token cache hits.'),
+    'token_cache_misses_total': ('counter', 'Verified token cache misses.'),
+    'jwks_keys': ('gauge', 'Signing keys in the JWKS cache.'),
+    'jwks_refreshes_total': ('counter', 'Successful JWKS fetches.'),
+    'jwks_refresh_failures_total': ('counter', 'Failed JWKS fetches.'),
+    'jwks_stale_hits_total': ('counter', 'Requests served with expired signing keys during a refresh.')
+}
+
+# the gauges of resources each worker owns, summed across workers
+# the other gauges describe state every worker holds a copy of, i.e. the JWKS keys, and take the maximum
+SUMMED_GAUGES = {'db_pool_size', 'db_pool_checked_out', 'db_pool_overflow'}
+
+'''
+MetricsRegistry
+the counters and histograms updated by the requests of a worker
+    each update holds a lock for a dict increment, so updates stay cheap with threads and greenlets alike
+    labels are tuples of (name, value) pairs
+EXAMPLE
+    registry = MetricsRegistry()
+    registry.inc('auth_errors_total', (('code', 'token_expired'), ('status', '401')))
+    registry.observe('http_request_duration_seconds', (('endpoint', 'main.get_actors'),), 0.012)
+'''
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = defaultdict(float)
+        # each histogram holds its bucket counts (the last one for +Inf), then the sum of the observed values
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            self.counters[(name, labels)] += amount
+
+    def observe(self, name, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        '''returns copies of the counters and histograms, as lists of (name, labels, value)'''
+        with self._lock:
+            return {
+                'counters': [(name, labels, value) for (name, labels), value in self.counters.items()],
+                'histograms': [(name, labels, list(value)) for (name, labels), value in self.histograms.items()]
+            }
+
+
+def collect(app):
+    '''returns the (name, labels, value) counters and gauges read from the pools, caches, and JWKS store of app'''
+    from .auth.auth import jwks_store, token_cache
+    from .database.pool import pool_stats
+    from . import db
+    counters, gauges = [], []
+    engines = [('primary', db.get_engine(app))]
+    replicas = app.extensions.get('replicas')
+    if replicas is not None:
+        engines += [(f'replica{i}', engine) for i, engine in enumerate(replicas.engines)]
+    for database, engine in engines:
+        stats = pool_stats(engine)
+        if stats is None:
+            continue
+        labels = (('database', database),)
+        gauges += [(f'db_pool_{name}', labels, stats[name]) for name in ('size', 'checked_out', 'overflow')]
+        counters += [(f'db_pool_{name}_total', labels, stats[name]) for name in ('checkouts', 'timeouts')]
+        counters.append(('db_pool_wait_seconds_total', labels, stats['wait_seconds_total']))
+    cache = app.extensions.get('response_cache')
+    if cache is not None:
+        counters += [(f'response_cache_{name}_total', (), getattr(cache, name))
+                     for name in ('hits', 'misses', 'invalidations')]
+    counters += [('token_cache_hits_total', (), token_cache.hits), ('token_cache_misses_total', (), token_cache.misses)]
+    jwks = jwks_store.stats()
+    gauges.append(('jwks_keys', (), jwks['keys']))
+    counters += [(f'jwks_{name}_total', (), jwks[name]) for name in ('refreshes', 'refresh_failures', 'stale_hits')]
+    return counters, gauges
+
+
+'''
+WorkerMetrics
+the metrics of a worker process, and the files sharing them with the other workers
+    without METRICS_DIR, /metrics reports the worker serving the scrape
+    with METRICS_DIR, each worker writes its metrics to METRICS_DIR/metrics-<pid>.json
+        every METRICS_FLUSH_INTERVAL seconds (and on each scrape) from a background thread,
+        and /metrics sums the files of all workers
+        the gunicorn child_exit hook drops the gauges of exited workers, and keeps their counters
+'''
+
+
+class WorkerMetrics:
+    def __init__(self, app):
+        self.app = app
+        self.directory = app.config.get('METRICS_DIR')
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        self.registry = MetricsRegistry()
+        self._pid = None
+
+    def snapshot(self):
+        snapshot = self.registry.snapshot()
+        counters, gauges = collect(self.app)
+        snapshot['counters'] += counters
+        snapshot['gauges'] = gauges
+        return snapshot
+
+    def path(self):
+        return os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+
+    def flush(self):
+        '''writes the snapshot of this worker to its file, atomically'''
+        path = self.path()
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(path + '.tmp', path)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                logger.exception('unable to write the metrics of worker %s', os.getpid())
+
+    def start(self):
+        '''starts the flushing thread in a new worker process, i.e. on its first request after the fork'''
+        if self.directory and self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._flush_forever, daemon=True).start()
+
+    def snapshots(self):
+        '''returns the snapshot of every worker'''
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                # the file of a worker may be replaced while it's read
+                continue
+        return snapshots
+
+
+def merge(snapshots):
+    '''
+    sums the counters and histograms of snapshots, and merges their gauges by SUMMED_GAUGES,
+        returns them by (name, labels)
+    '''
+    values, gauges, histograms = defaultdict(float), {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            values[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, value in snapshot.get('gauges', []):
+            key = (name, tuple(map(tuple, labels)))
+            if key not in gauges:
+                gauges[key] = value
+            elif name in SUMMED_GAUGES:
+                gauges[key] += value
+            else:
+                gauges[key] = max(gauges[key], value)
+        for name, labels, value in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], value)]
+            else:
+                histograms[key] = list(value)
+    values.update(gauges)
+    return values, histograms
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+'''
+render(values, histograms, buckets) method
+    returns the merged metrics in the prometheus text exposition format
+    histogram buckets are cumulative, and end with le="+Inf"
+'''
+
+
+def render(values, histograms, buckets=DURATION_BUCKETS):
+    lines = []
+    for metric, (kind, text) in METRICS.items():
+        if kind == 'histogram':
+            series = sorted((labels, value) for (name, labels), value in histograms.items() if name == metric)
+        else:
+            series = sorted((labels, value) for (name, labels), value in values.items() if name == metric)
+        if not series:
+            continue
+        lines += [f'# HELP {metric} {text}', f'# TYPE {metric} {kind}']
+        for labels, value in series:
+            if kind != 'histogram':
+                lines.append(f'{metric}{format_labels(labels)} {format_value(value)}')
+                continue
+            count = 0
+            for bound, bucket in zip(buckets + ('+Inf',), value[:-1]):
+                count += bucket
+                lines.append(f'{metric}_bucket{format_labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{metric}_sum{format_labels(labels)} {format_value(value[-1])}')
+            lines.append(f'{metric}_count{format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def get_metrics():
+    '''returns the WorkerMetrics of the current app, or None if METRICS is disabled'''
+    return current_app.extensions.get('metrics')
+
+
+def count_auth_error(error):
+    '''counts an AuthError returned to the client'''
+    metrics = get_metrics()
+    if metrics is not None:
+        code = error.error.get('code') if isinstance(error.error, dict) else None
+        metrics.registry.inc('auth_errors_total', (('code', str(code)), ('status', str(error.status_code))))
+
+
+def has_bearer_token(token):
+    '''returns True if the request has an `Authorization: Bearer <token>` header, compared in constant time'''
+    parts = request.headers.get('Authorization', '').split()
+    # compared as bytes, compare_digest rejects non-ascii strings
+    return (len(parts) == 2 and parts[0].lower() == 'bearer'
+            and hmac.compare_digest(parts[1].encode(), token.encode()))
+
+
+def has_metrics_token():
+    '''returns True if the request carries the METRICS_TOKEN, always False while it's not set'''
+    token = current_app.config.get('METRICS_TOKEN')
+    return bool(token) and has_bearer_token(token)
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+
+
+def finish_request(response):
+    metrics = current_app.extensions['metrics']
+    metrics.start()
+    start = g.pop('metrics_start', None)
+    endpoint = request.endpoint or 'none'
+    metrics.registry.inc('http_requests_total', (
+        ('endpoint', endpoint), ('method', request.method), ('status', str(response.status_code))))
+    if start is not None:
+        metrics.registry.observe('http_request_duration_seconds', (('endpoint', endpoint),),
+                                 time.perf_counter() - start)
+    return response
+
+
+'''
+init_metrics(app) method
+    counts the requests of app, and serves the metrics at GET /metrics, when METRICS is enabled
+        /metrics requires an `Authorization: Bearer <METRICS_TOKEN>` header, like the other operational endpoints,
+            and is unavailable while METRICS_TOKEN is not set
+    the pools, caches, and JWKS store are only read when metrics are scraped or flushed
+'''
+
+
+def init_metrics(app):
+    if not app.config.get('METRICS'):
+        return
+    app.extensions['metrics'] = WorkerMetrics(app)
+    if app.config.get('METRICS_DIR'):
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+
+    @app.route('/metrics')
+    def get_prometheus_metrics():
+        if not has_metrics_token():
+            return app.response_class('unauthorized\n', status=401, mimetype='text/plain')
+        values, histograms = merge(get_metrics().snapshots())
+        return app.response_class(render(values, histograms), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,212 @@
+# profiler.py
+# a sampling profiler for live requests, writing flamegraph-compatible collapsed stacks
+import hmac
+import itertools
+import logging
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from flask import current_app, g, request
+
+try:
+    from gevent import monkey
+except ImportError:  # pragma: no cover - gevent is optional
+    monkey = None
+
+logger = logging.getLogger(__name__)
+
+
+'''
+real_threads() method
+    returns the get_ident, start_new_thread, allocate_lock, and sleep functions of os threads,
+        even when gevent patched them, so the sampling thread never starts a gevent hub of its own
+'''
+
+
+def real_threads():
+    import _thread
+    if monkey is not None and monkey.is_module_patched('threading'):
+        return (monkey.get_original('_thread', 'get_ident'), monkey.get_original('_thread', 'start_new_thread'),
+                monkey.get_original('_thread', 'allocate_lock'), monkey.get_original('time', 'sleep'))
+    return _thread.get_ident, _thread.start_new_thread, _thread.allocate_lock, time.sleep
+
+
+'''
+Wakeup
+an event built on an os lock, set by the request threads and waited on by the sampling thread
+    the lock is held while the event is clear, waiting acquires it, which clears the event again
+    threading.Event can't be used, even the original class waits on a patched lock under gevent
+'''
+
+
+class Wakeup:
+    def __init__(self, allocate_lock):
+        self._lock = allocate_lock()
+        self._lock.acquire()
+
+    def set(self):
+        try:
+            self._lock.release()
+        except RuntimeError:
+            # already set
+            pass
+
+    def wait(self, timeout):
+        '''returns True if the event was set, and clears it'''
+        return self._lock.acquire(timeout=timeout)
+
+
+def short_path(filename):
+    '''returns filename relative to site-packages, or to the working directory'''
+    marker = 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return os.path.relpath(filename) if os.path.isabs(filename) else filename
+
+
+'''
+collapse(frame) method
+    returns the stack of frame in the collapsed format of flamegraph.pl and speedscope, root first
+    EXAMPLE
+        collapse(frame) == 'wsgi_app (flask/app.py:2446);get_actors (app/main/actors.py:58)'
+'''
+
+
+def collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({short_path(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+'''
+Sampler
+samples the stacks of the threads serving profiled requests every interval seconds, from an os thread
+    stacks are counted per endpoint, and written to directory every flush_interval seconds
+        as <endpoint>.<pid>.collapsed files, holding the counts since the worker started
+    the sampling thread sleeps while no profiled request runs
+    with gevent workers, a sample holds the stack of whichever greenlet is running on the worker's thread
+EXAMPLE
+    sampler = Sampler('/tmp/profiles')
+    sampler.begin('main.get_actors')
+    ...
+    sampler.end()
+'''
+
+
+class Sampler:
+    def __init__(self, directory, interval=0.005, flush_interval=10):
+        self.directory = directory
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.stacks = defaultdict(Counter)
+        # the endpoint of each os thread serving a profiled request
+        self.active = {}
+        self._get_ident, self._start_thread, allocate_lock, self._sleep = real_threads()
+        self._wakeup = Wakeup(allocate_lock)
+        self._lock = allocate_lock()
+        self._pid = None
+        self._dirty = False
+
+    def begin(self, endpoint):
+        if self._pid != os.getpid():
+            # a new worker process, the sampling thread didn't survive the fork
+            self._pid = os.getpid()
+            self._start_thread(self._run, ())
+        self.active[self._get_ident()] = endpoint
+        self._wakeup.set()
+
+    def end(self):
+        self.active.pop(self._get_ident(), None)
+
+    def sample(self):
+        '''counts the current stack of every profiled thread'''
+        frames = sys._current_frames()
+        for ident, endpoint in list(self.active.items()):
+            frame = frames.get(ident)
+            if frame is not None:
+                stack = collapse(frame)
+                with self._lock:
+                    self.stacks[endpoint][stack] += 1
+                    self._dirty = True
+
+    def flush(self):
+        '''writes the stacks of each endpoint to its collapsed file'''
+        with self._lock:
+            stacks = {endpoint: dict(counts) for endpoint, counts in self.stacks.items()}
+            self._dirty = False
+        os.makedirs(self.directory, exist_ok=True)
+        for endpoint, counts in stacks.items():
+            path = os.path.join(self.directory, f'{endpoint}.{os.getpid()}.collapsed')
+            with open(path + '.tmp', 'w') as file:
+                file.writelines(f'{stack} {count}\n' for stack, count in sorted(counts.items()))
+            os.replace(path + '.tmp', path)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            if not self.active:
+                # sleep until the next profiled request, waking up to flush
+                self._wakeup.wait(self.flush_interval)
+            else:
+                self._sleep(self.interval)
+                self.sample()
+            if self._dirty and time.monotonic() - last_flush >= self.flush_interval:
+                last_flush = time.monotonic()
+                try:
+                    self.flush()
+                except OSError:
+                    logger.exception('unable to write the profiles to %s', self.directory)
+
+
+def is_profiled(profiler):
+    '''returns True if the current request is the 1-in-PROFILE_SAMPLE_RATE one, or carries the PROFILE_TOKEN'''
+    token = current_app.config.get('PROFILE_TOKEN')
+    header = request.headers.get('X-Profile')
+    if token and header and hmac.compare_digest(header.encode(), token.encode()):
+        return True
+    rate = current_app.config['PROFILE_SAMPLE_RATE']
+    return bool(rate) and next(profiler['counter']) % rate == 0
+
+
+def begin_profile():
+    profiler = current_app.extensions['profiler']
+    if request.endpoint and is_profiled(profiler):
+        g.profiled = True
+        profiler['sampler'].begin(request.endpoint)
+
+
+def mark_profiled(response):
+    if g.get('profiled'):
+        response.headers['X-Profiled'] = 'true'
+    return response
+
+
+def end_profile(error=None):
+    # a teardown function, so profiles end even when the request fails
+    if g.pop('profiled', False):
+        current_app.extensions['profiler']['sampler'].end()
+
+
+'''
+init_profiler(app) method
+    profiles 1 in PROFILE_SAMPLE_RATE requests, and requests with an `X-Profile: <PROFILE_TOKEN>` header,
+        sampling their stacks every PROFILE_INTERVAL milliseconds into PROFILE_DIR
+    does nothing, and adds no request hooks, unless PROFILE_DIR and a sample rate or token are set
+    EXAMPLE
+        flamegraph.pl profiles/main.get_actors.1234.collapsed > get_actors.svg
+'''
+
+
+def init_profiler(app):
+    config = app.config
+    if not config.get('PROFILE_DIR') or not (config.get('PROFILE_SAMPLE_RATE') or config.get('PROFILE_TOKEN')):
+        return
+    sampler = Sampler(config['PROFILE_DIR'], config['PROFILE_INTERVAL'] / 1000, config['PROFILE_FLUSH_INTERVAL'])
+    app.extensions['profiler'] = {'sampler': sampler, 'counter': itertools.count()}
+    app.before_request(begin_profile)
+    app.after_request(mark_profiled)
+    app.teardown_request(end_profile)
@@ -0,0 +1,109 @@
+# serialization.py
+# pluggable json encoders for API responses
+import datetime
+import json
+from flask import current_app
+from .instrumentation import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+'''
+JSONProvider
+serializes response bodies with the standard library json module
+    keys are sorted, like flask's jsonify
+    indent pretty-prints the output, and should only be used while debugging
+    objects with a format() method (i.e. Actor and Movie) are serialized through it, and result rows as dicts,
+        so they can be passed to jsonify directly, at the cost of an intermediate dict per object
+    the read endpoints don't rely on it, app/database/queries.py builds their dicts straight from result rows
+'''
+
+
+class JSONProvider:
+    name = 'json'
+
+    def __init__(self, indent=None):
+        self.indent = indent
+
+    @staticmethod
+    def default(obj):
+        if hasattr(obj, 'format'):
+            return obj.format()
+        if isinstance(obj, (datetime.date, datetime.datetime)):
+            return obj.isoformat()
+        if hasattr(obj, 'keys'):
+            # sqlalchemy result rows
+            return dict(obj)
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+    def dumps(self, obj, compact=False):
+        '''returns obj encoded as utf-8 json bytes, never pretty-printed when compact is set'''
+        indent = None if compact else self.indent
+        separators = (', ', ': ') if indent else (',', ':')
+        return json.dumps(obj, default=self.default, sort_keys=True,
+                          indent=indent, separators=separators).encode()
+
+
+'''
+ORJSONProvider
+serializes response bodies with orjson, which encodes several times faster than the json module
+    the output decodes to the same document as JSONProvider's
+        non-ascii characters are sent as utf-8 instead of \\u escapes
+'''
+
+
+class ORJSONProvider(JSONProvider):
+    name = 'orjson'
+
+    def dumps(self, obj, compact=False):
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        if self.indent and not compact:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+
+PROVIDERS = {
+    'json': JSONProvider,
+    'orjson': ORJSONProvider
+}
+
+'''
+make_provider(app) method
+    returns the json provider selected by the JSON_PROVIDER config of app
+        `auto` (default) uses orjson when it's installed, and falls back to the json module
+    responses are pretty-printed only in debug mode, or when JSONIFY_PRETTYPRINT_REGULAR is set
+'''
+
+
+def make_provider(app):
+    name = app.config.get('JSON_PROVIDER', 'auto')
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name not in PROVIDERS or (name == 'orjson' and orjson is None):
+        raise EnvironmentError(
+            f'JSON_PROVIDER `{name}` is not available. Possible choices are `auto`, `json`, or `orjson`')
+    pretty = app.debug or app.config.get('JSONIFY_PRETTYPRINT_REGULAR')
+    return PROVIDERS[name](indent=2 if pretty else None)
+
+
+'''
+jsonify(*args, **kwargs) method
+    a drop-in replacement for flask's jsonify which encodes with the app's json provider
+    EXAMPLE
+        return jsonify({'success': True, 'actors': [actor.format()]})
+'''
+
+
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    with timed('serialize'):
+        body = current_app.json_provider.dumps(data)
+    return current_app.response_class(
+        body + b'\n', mimetype=current_app.config['JSONIFY_MIMETYPE'])
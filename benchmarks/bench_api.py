@@ -0,0 +1,253 @@
+# bench_api.py
+# throughput and latency percentiles of each endpoint, on a seeded database and with locally signed tokens
+# usage: python benchmarks/bench_api.py [--actors 10000] [--movies 5000] [--links 100000] [--requests 200]
+#            [--database sqlite:///bench.db] [--no-seed] [--cache lru] [--output results.json]
+#            [--baseline previous.json] [--threshold 0.2]
+# results are written as json, and compared with a baseline run when given,
+#     the script exits with status 1 if an endpoint regressed by more than the threshold
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the tokens are signed for this domain and audience, unless the environment sets them
+os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+os.environ.setdefault('AUTH0_AUDIENCE', 'capstone')
+
+# the key id of the locally generated signing key
+KID = 'bench'
+READER = ['get:actor-details', 'get:movie-details']
+WRITER = READER + ['post:actors', 'patch:actors']
+
+
+def b64_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def make_key():
+    '''returns a new RSA private key as PEM, and its public JWK'''
+    try:
+        from Crypto.PublicKey import RSA
+        key = RSA.generate(2048)
+        pem, n, e = key.exportKey('PEM').decode(), key.n, key.e
+    except ImportError:
+        # python-jose may use the cryptography backend instead of pycryptodome
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption()).decode()
+        numbers = key.public_key().public_numbers()
+        n, e = numbers.n, numbers.e
+    return pem, {'kty': 'RSA', 'kid': KID, 'use': 'sig', 'alg': 'RS256', 'n': b64_uint(n), 'e': b64_uint(e)}
+
+
+def make_token(pem, permissions):
+    from jose import jwt
+    from app.auth import auth
+    now = int(time.time())
+    claims = {'iss': f'https://{auth.AUTH0_DOMAIN}/', 'aud': auth.API_AUDIENCE, 'sub': 'bench',
+              'iat': now, 'exp': now + 24 * 3600, 'permissions': permissions}
+    return jwt.encode(claims, pem, algorithm='RS256', headers={'kid': KID})
+
+
+def seed(db, actors_count, movies_count, links_count, rng, chunk=5000):
+    '''recreates the tables, and fills them with random actors, movies, and links'''
+    from app.database.queries import actor_movies, actors, movies
+    db.drop_all()
+    db.create_all()
+    genders = ('female', 'male')
+    words = ('The', 'Last', 'Dark', 'Night', 'Return', 'Of', 'Lost', 'City', 'Star', 'Game', 'House', 'River')
+    rows = [{'name': f'Actor {i} {rng.choice(words)}', 'age': rng.randint(18, 90), 'gender': rng.choice(genders)}
+            for i in range(actors_count)]
+    for start in range(0, len(rows), chunk):
+        db.session.execute(actors.insert(), rows[start:start + chunk])
+    rows = [{'title': ' '.join(rng.sample(words, 3)) + f' {i}',
+             'release_date': f'{rng.randint(1, 12):02}/{rng.randint(1, 28):02}/{rng.randint(1950, 2030)}'}
+            for i in range(movies_count)]
+    for start in range(0, len(rows), chunk):
+        db.session.execute(movies.insert(), rows[start:start + chunk])
+    links_count = min(links_count, actors_count * movies_count)
+    pairs = set()
+    while len(pairs) < links_count:
+        pairs.add((rng.randint(1, actors_count), rng.randint(1, movies_count)))
+    rows = [{'actor_id': actor_id, 'movie_id': movie_id} for actor_id, movie_id in sorted(pairs)]
+    for start in range(0, len(rows), chunk):
+        db.session.execute(actor_movies.insert(), rows[start:start + chunk])
+    db.session.commit()
+
+
+def endpoints(actor_ids, movie_ids):
+    '''returns the benchmarked (name, method, path, body, writes) cases, path and body are functions of rng'''
+    return [
+        ('GET /actors', 'GET', lambda rng: '/actors', None, False),
+        ('GET /actors?limit=100', 'GET', lambda rng: '/actors?limit=100', None, False),
+        ('GET /actors?sort=name', 'GET', lambda rng: '/actors?sort=name', None, False),
+        ('GET /actors?gender&age', 'GET',
+         lambda rng: f'/actors?gender=female&age_min={rng.randint(18, 60)}&age_max=90', None, False),
+        ('GET /actors/<id>', 'GET', lambda rng: f'/actors/{rng.choice(actor_ids)}', None, False),
+        ('GET /movies', 'GET', lambda rng: '/movies', None, False),
+        ('GET /movies?title_prefix', 'GET', lambda rng: '/movies?title_prefix=The', None, False),
+        ('GET /movies?sort=-release_date', 'GET', lambda rng: '/movies?sort=-release_date', None, False),
+        ('GET /movies/<id>', 'GET', lambda rng: f'/movies/{rng.choice(movie_ids)}', None, False),
+        ('GET /search', 'GET', lambda rng: f'/search?q={rng.choice(["night", "star city", "actor 12"])}', None, False),
+        ('POST /actors', 'POST', lambda rng: '/actors',
+         lambda rng: {'name': f'New {rng.random()}', 'age': str(rng.randint(18, 90)), 'gender': 'female'}, True),
+        ('PATCH /actors/<id>', 'PATCH', lambda rng: f'/actors/{rng.choice(actor_ids)}',
+         lambda rng: {'age': str(rng.randint(18, 90))}, True)
+    ]
+
+
+def percentile(timings, share):
+    return timings[min(int(len(timings) * share), len(timings) - 1)]
+
+
+def measure(client, headers, case, count, warmup, rng):
+    '''sends warmup then count requests of a case, returns its stats'''
+    name, method, path, body, writes = case
+    timings, errors = [], 0
+    for i in range(warmup + count):
+        kwargs = {'headers': headers}
+        if body is not None:
+            kwargs['json'] = body(rng)
+        start = time.perf_counter()
+        response = client.open(path(rng), method=method, **kwargs)
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        if response.status_code >= 400:
+            errors += 1
+        timings.append(elapsed)
+    timings.sort()
+    total = sum(timings)
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': count / total if total else 0.0,
+        'mean_ms': total / count * 1000,
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p90_ms': percentile(timings, 0.9) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'max_ms': timings[-1] * 1000
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    '''prints the p50 changes since baseline, returns the names of the endpoints slower by more than threshold'''
+    regressions = []
+    print(f'\n{"endpoint":<32} {"p50 before":>11} {"p50 now":>9} {"change":>8}')
+    for name, stats in results['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            continue
+        change = stats['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print(f'{name:<32} {before["p50_ms"]:11.2f} {stats["p50_ms"]:9.2f} {change:+8.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the API endpoints')
+    parser.add_argument('--actors', type=int, default=10000)
+    parser.add_argument('--movies', type=int, default=5000)
+    parser.add_argument('--links', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--database', help='the url of the benchmark database, a temporary sqlite file by default')
+    parser.add_argument('--no-seed', action='store_true', help='reuse the data already in --database')
+    parser.add_argument('--cache', default='none', choices=('none', 'lru'), help='the response cache')
+    parser.add_argument('--only', nargs='+', help='only benchmark the endpoints with these names')
+    parser.add_argument('--seed', type=int, default=42, help='the random seed of the data and requests')
+    parser.add_argument('--output', help='the file to write the json results to')
+    parser.add_argument('--baseline', help='the json results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='the p50 increase counted as a regression')
+    args = parser.parse_args()
+
+    directory = None
+    if args.database is None:
+        directory = tempfile.TemporaryDirectory()
+        args.database = f'sqlite:///{directory.name}/bench.db'
+    # the database is dropped and seeded, so it is never taken from the environment
+    os.environ['TEST_DATABASE_URI'] = args.database
+
+    from app import create_app, db
+    from app.auth.auth import jwks_store
+    from app.database.models import Actor, Movie
+
+    app = create_app('testing')
+    app.debug = False
+    app.config['RESPONSE_CACHE'] = args.cache
+    pem, jwk = make_key()
+    # the key set is loaded directly, so Auth0 is never contacted
+    jwks_store.load({'keys': [jwk]}, max_age=24 * 3600)
+    rng = random.Random(args.seed)
+    with app.app_context():
+        if not args.no_seed:
+            start = time.perf_counter()
+            seed(db, args.actors, args.movies, args.links, rng)
+            print(f'seeded {args.actors} actors, {args.movies} movies, {args.links} links'
+                  f' in {time.perf_counter() - start:.1f}s')
+        actor_ids = [id for (id,) in db.session.query(Actor.id)]
+        movie_ids = [id for (id,) in db.session.query(Movie.id)]
+        db.session.remove()
+        results = {
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': db.engine.dialect.name,
+            'json_provider': app.json_provider.name,
+            'cache': args.cache,
+            'data': {'actors': len(actor_ids), 'movies': len(movie_ids), 'links': args.links},
+            'endpoints': {}
+        }
+        reader = {'Authorization': f'bearer {make_token(pem, READER)}'}
+        writer = {'Authorization': f'bearer {make_token(pem, WRITER)}'}
+    # requests push their own app context, so each one gets a new session, as in production
+    client = app.test_client()
+    print(f'{"endpoint":<32} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for case in endpoints(actor_ids, movie_ids):
+        name, writes = case[0], case[4]
+        if args.only and name not in args.only:
+            continue
+        stats = measure(client, writer if writes else reader, case, args.requests, args.warmup, rng)
+        results['endpoints'][name] = stats
+        print(f'{name:<32} {stats["rps"]:8.1f} {stats["p50_ms"]:8.2f} {stats["p95_ms"]:8.2f}'
+              f' {stats["p99_ms"]:8.2f} {stats["errors"]:>7}')
+    if directory is not None:
+        db.get_engine(app).dispose()
+        directory.cleanup()
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} endpoint(s) regressed by more than {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# bench_compression.py
+# CPU cost vs bytes saved of each encoding and level, on a GET /actors body
+# usage: python benchmarks/bench_compression.py [--actors 1000] [--movies 5] [--repeat 5]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the benchmark never touches the database
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite://')
+
+from app import create_app  # noqa: E402
+from app.compression import brotli, compress  # noqa: E402
+
+# the levels to compare, the default ones are marked in the output
+LEVELS = {
+    'gzip': (1, 3, 6, 9),
+    'br': (1, 3, 5, 7, 9, 11)
+}
+
+
+def make_body(provider, count, movies_per_actor):
+    movies = [{'id': i, 'title': f'Movie {i}'} for i in range(movies_per_actor)]
+    actors = [{'id': i, 'name': f'Actor {i}', 'age': 30 + i % 40, 'gender': 'female', 'movies': movies}
+              for i in range(count)]
+    return provider.dumps({'success': True, 'actors': actors, 'next_cursor': None}, compact=True)
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the response encodings')
+    parser.add_argument('--actors', type=int, default=1000)
+    parser.add_argument('--movies', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    app.debug = False
+    defaults = {'gzip': app.config['GZIP_LEVEL'], 'br': app.config['BROTLI_QUALITY']}
+    body = make_body(app.json_provider, args.actors, args.movies)
+    print(f'{args.actors} actors x {args.movies} movies, {len(body):,} bytes, best of {args.repeat}')
+    print(f'{"encoding":<12} {"bytes":>10} {"ratio":>7} {"ms":>9} {"MB/s":>9}')
+    for encoding, levels in LEVELS.items():
+        if encoding == 'br' and brotli is None:
+            print('br           skipped, brotli is not installed')
+            continue
+        for level in levels:
+            size = len(compress(body, encoding, level))
+            seconds = best_of(args.repeat, lambda: compress(body, encoding, level))
+            name = f'{encoding} {level}' + (' *' if level == defaults[encoding] else '')
+            print(f'{name:<12} {size:>10,} {size / len(body):7.1%} {seconds * 1000:9.2f}'
+                  f' {len(body) / seconds / 1e6:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
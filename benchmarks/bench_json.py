@@ -0,0 +1,74 @@
+# bench_json.py
+# micro-benchmark of the json providers on lists of Actor.format() rows
+# usage: python benchmarks/bench_json.py [--actors 5000] [--movies 5] [--repeat 5]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the benchmark never touches the database
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite://')
+
+from flask import jsonify as flask_jsonify  # noqa: E402
+from app import create_app  # noqa: E402
+from app.database.models import Actor, Movie  # noqa: E402
+from app.serialization import JSONProvider, ORJSONProvider, jsonify, orjson  # noqa: E402
+
+
+def make_actors(count, movies_per_actor):
+    movies = [Movie(id=i, title=f'Movie {i}', release_date='01/01/2021')
+              for i in range(movies_per_actor)]
+    return [Actor(id=i, name=f'Actor {i}', age=30 + i % 40, gender='female', movies=movies)
+            for i in range(count)]
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the json providers')
+    parser.add_argument('--actors', type=int, default=5000)
+    parser.add_argument('--movies', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    # production settings: no pretty-printing
+    app.debug = False
+    actors = make_actors(args.actors, args.movies)
+    rows = [actor.format() for actor in actors]
+
+    cases = [
+        ('flask jsonify (before)', lambda: flask_jsonify({'success': True, 'actors': rows})),
+    ]
+    for provider in (JSONProvider(), ORJSONProvider() if orjson else None):
+        if provider is None:
+            continue
+
+        def run(provider=provider):
+            app.json_provider = provider
+            return jsonify({'success': True, 'actors': rows})
+        cases.append((f'{provider.name} provider', run))
+
+    print(f'{args.actors} actors x {args.movies} movies, best of {args.repeat}')
+    with app.app_context():
+        baseline = None
+        for name, function in cases:
+            seconds = best_of(args.repeat, function)
+            baseline = baseline or seconds
+            print(f'{name:<26} {seconds * 1000:8.2f} ms  {args.actors / seconds:12,.0f} rows/s'
+                  f'  {baseline / seconds:5.2f}x')
+        # format() itself, which every provider still has to pay for
+        seconds = best_of(args.repeat, lambda: [actor.format() for actor in actors])
+        print(f'{"Actor.format() only":<26} {seconds * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# load_test.py
+# concurrent-request throughput and latency of the API under each gunicorn worker class
+# usage: python benchmarks/load_test.py [--worker-class sync gevent] [--concurrency 50] [--requests 2000]
+#            [--path /actors] [--config production]
+#        python benchmarks/load_test.py --url http://localhost:8000 (an already running server)
+# the spawned servers use gunicorn.conf.py and the environment, i.e. DATABASE_URL, WEB_CONCURRENCY, and the Auth0
+# settings, requests are authorized with ASSISTANT_TOKEN
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from os import environ
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(timings, share):
+    return timings[min(int(len(timings) * share), len(timings) - 1)]
+
+
+def run_load(url, headers, concurrency, count):
+    '''sends count GET requests to url from concurrency threads, returns (seconds, timings, errors)'''
+    timings, errors = [], []
+    remaining = iter(range(count))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            try:
+                with urlopen(Request(url, headers=headers), timeout=60) as response:
+                    response.read()
+            except (HTTPError, URLError, OSError) as error:
+                with lock:
+                    errors.append(error)
+                continue
+            with lock:
+                timings.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sorted(timings), errors
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not listen on port {port} within {timeout} seconds')
+
+
+def start_server(worker_class, port, config):
+    env = dict(environ, GUNICORN_WORKER_CLASS=worker_class)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         '--access-logfile', os.devnull, f"app:create_app('{config}')"],
+        cwd=ROOT, env=env)
+    wait_for_port(port, process)
+    return process
+
+
+def report(name, seconds, timings, errors):
+    if not timings:
+        print(f'{name:<10} every request failed, i.e. {errors[0]!r}')
+        return
+    print(f'{name:<10} {len(timings) / seconds:9.1f} {percentile(timings, 0.5) * 1000:9.1f}'
+          f' {percentile(timings, 0.95) * 1000:9.1f} {percentile(timings, 0.99) * 1000:9.1f} {len(errors):>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='load test the API with each gunicorn worker class')
+    parser.add_argument('--url', help='the base url of a running server, instead of spawning one per worker class')
+    parser.add_argument('--worker-class', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--config', default='production')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--path', default='/actors')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=20)
+    args = parser.parse_args()
+
+    headers = {'Authorization': f'bearer {environ.get("ASSISTANT_TOKEN", "")}'}
+    print(f'GET {args.path}, {args.requests} requests from {args.concurrency} clients, '
+          f'WEB_CONCURRENCY={environ.get("WEB_CONCURRENCY") or 1}')
+    print(f'{"workers":<10} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+    targets = [('server', args.url)] if args.url else [(name, None) for name in args.worker_class]
+    for name, base in targets:
+        process = None
+        if base is None:
+            process = start_server(name, args.port, args.config)
+            base = f'http://127.0.0.1:{args.port}'
+        try:
+            url = base.rstrip('/') + args.path
+            run_load(url, headers, min(args.concurrency, args.warmup), args.warmup)
+            report(name, *run_load(url, headers, args.concurrency, args.requests))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,80 @@
 from os import environ
 
 
+def optional_int(name):
+    '''returns the integer value of an environment variable, or None if it's not set'''
+    value = environ.get(name)
+    return int(value) if value else None
+
+
 class Config:
     """Base config"""
     SECRET_KEY = environ.get('SECRET_KEY') or 'HackMePleaseLol'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    QUESTIONS_PER_PAGE = 10
+    # the gunicorn workers and threads per worker, which size the connection pools, see gunicorn.conf.py
+    WEB_CONCURRENCY = int(environ.get('WEB_CONCURRENCY') or 1)
+    GUNICORN_THREADS = int(environ.get('GUNICORN_THREADS') or 1)
+    # the gunicorn worker class, and the most requests handled at once by each gevent or eventlet worker
+    GUNICORN_WORKER_CLASS = environ.get('GUNICORN_WORKER_CLASS') or 'sync'
+    GUNICORN_WORKER_CONNECTIONS = int(environ.get('GUNICORN_WORKER_CONNECTIONS') or 100)
+    # the connection pool of each worker, computed from the settings above when not set, see app/database/pool.py
+    DB_MAX_CONNECTIONS = int(environ.get('DB_MAX_CONNECTIONS') or 20)
+    DB_POOL_SIZE = optional_int('DB_POOL_SIZE')
+    DB_MAX_OVERFLOW = optional_int('DB_MAX_OVERFLOW')
+    DB_POOL_TIMEOUT = int(environ.get('DB_POOL_TIMEOUT') or 10)
+    DB_POOL_RECYCLE = int(environ.get('DB_POOL_RECYCLE') or 1800)
+    DB_POOL_PRE_PING = (environ.get('DB_POOL_PRE_PING') or 'true').lower() == 'true'
+    # comma separated urls of read replicas of the database, which serve the queries of read-only requests
+    DATABASE_REPLICA_URLS = [url.strip() for url in (environ.get('DATABASE_REPLICA_URLS') or '').split(',')
+                             if url.strip()]
+    # how often a replica is health-checked, in seconds
+    DB_REPLICA_HEALTH_INTERVAL = float(environ.get('DB_REPLICA_HEALTH_INTERVAL') or 5)
+    # the maximum duration of a postgres statement in milliseconds, 0 disables it
+    DB_STATEMENT_TIMEOUT = int(environ.get('DB_STATEMENT_TIMEOUT') or 0)
+    # statements taking at least SLOW_QUERY_MS milliseconds are logged, with their parameters and plan when enabled,
+    # and all statements are timed by fingerprint for GET /queries, 0 disables both
+    SLOW_QUERY_MS = float(environ.get('SLOW_QUERY_MS') or 0)
+    SLOW_QUERY_LOG_PARAMETERS = (environ.get('SLOW_QUERY_LOG_PARAMETERS') or 'true').lower() == 'true'
+    SLOW_QUERY_EXPLAIN = (environ.get('SLOW_QUERY_EXPLAIN') or 'false').lower() == 'true'
+    # Server-Timing headers and json log lines with the timings of each request, and the most queries a request
+    # should run before it's logged as a warning, 0 disables the warning
+    INSTRUMENTATION = (environ.get('INSTRUMENTATION') or 'false').lower() == 'true'
+    QUERY_BUDGET = int(environ.get('QUERY_BUDGET') or 10)
+    # prometheus metrics at GET /metrics, which requires `Authorization: Bearer <METRICS_TOKEN>`, and is unavailable
+    # without it, like GET /cache, GET /pool, and GET /queries
+    # with several workers, set METRICS_DIR to a directory shared by the workers, see app/metrics.py
+    METRICS = (environ.get('METRICS') or 'false').lower() == 'true'
+    METRICS_TOKEN = environ.get('METRICS_TOKEN')
+    METRICS_DIR = environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(environ.get('METRICS_FLUSH_INTERVAL') or 5)
+    # the sampling profiler, which profiles 1 in PROFILE_SAMPLE_RATE requests (0 for none) and the requests with an
+    # `X-Profile: <PROFILE_TOKEN>` header, sampling their stacks every PROFILE_INTERVAL milliseconds into PROFILE_DIR
+    PROFILE_DIR = environ.get('PROFILE_DIR')
+    PROFILE_SAMPLE_RATE = int(environ.get('PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_TOKEN = environ.get('PROFILE_TOKEN')
+    PROFILE_INTERVAL = float(environ.get('PROFILE_INTERVAL') or 5)
+    PROFILE_FLUSH_INTERVAL = float(environ.get('PROFILE_FLUSH_INTERVAL') or 10)
+    # the json encoder of the API, one of 'auto' (orjson when installed), 'orjson', or 'json'
+    JSON_PROVIDER = environ.get('JSON_PROVIDER') or 'auto'
+    # default and maximum page sizes of the list endpoints
+    ITEMS_PER_PAGE = int(environ.get('ITEMS_PER_PAGE') or 10)
+    MAX_ITEMS_PER_PAGE = int(environ.get('MAX_ITEMS_PER_PAGE') or 100)
+    # how many rows the export endpoints fetch and send at once
+    EXPORT_BATCH_SIZE = int(environ.get('EXPORT_BATCH_SIZE') or 500)
+    # the maximum number of items per bulk request, and of rows per INSERT statement
+    BULK_MAX_ITEMS = int(environ.get('BULK_MAX_ITEMS') or 5000)
+    BULK_INSERT_CHUNK = int(environ.get('BULK_INSERT_CHUNK') or 250)
+    # the response cache of the read endpoints, one of 'lru' (per process), 'redis', or 'none'
+    RESPONSE_CACHE = environ.get('RESPONSE_CACHE') or 'lru'
+    RESPONSE_CACHE_SIZE = int(environ.get('RESPONSE_CACHE_SIZE') or 1024)
+    RESPONSE_CACHE_TTL = int(environ.get('RESPONSE_CACHE_TTL') or 30)
+    RESPONSE_CACHE_URL = environ.get('RESPONSE_CACHE_URL') or 'redis://localhost:6379/0'
+    # the number of matches of a search which can be paged through
+    SEARCH_MAX_RESULTS = int(environ.get('SEARCH_MAX_RESULTS') or 100)
+    # responses of at least COMPRESSION_MIN_SIZE bytes are compressed with brotli (when installed) or gzip
+    COMPRESSION_MIN_SIZE = int(environ.get('COMPRESSION_MIN_SIZE') or 1024)
+    GZIP_LEVEL = int(environ.get('GZIP_LEVEL') or 6)
+    BROTLI_QUALITY = int(environ.get('BROTLI_QUALITY') or 5)
 
 
 class ProdConfig(Config):
@@ -15,6 +84,7 @@ class ProdConfig(Config):
     DEBUG = False
     TESTING = False
     SQLALCHEMY_DATABASE_URI = environ.get('DATABASE_URL')
+    DB_STATEMENT_TIMEOUT = int(environ.get('DB_STATEMENT_TIMEOUT') or 30000)
 
 
 class DevConfig(Config):
@@ -28,3 +98,5 @@ class TestConfig(DevConfig):
     """testing config"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = environ.get('TEST_DATABASE_URI')
+    # tests enable the cache where they need it
+    RESPONSE_CACHE = 'none'
@@ -0,0 +1,63 @@
+# gunicorn.conf.py
+# the gunicorn settings of the API, read from the same environment variables as config.py
+# usage: gunicorn -c gunicorn.conf.py "app:create_app('production')"
+import os
+from os import environ
+
+bind = f'0.0.0.0:{environ.get("PORT") or 8000}'
+# the number of worker processes
+workers = int(environ.get('WEB_CONCURRENCY') or 1)
+# 'sync' workers handle one request per thread, with GUNICORN_THREADS threads per worker (gthread when above 1)
+# 'gevent' and 'eventlet' workers handle up to GUNICORN_WORKER_CONNECTIONS requests at once in greenlets,
+#     so requests waiting on postgres or on the Auth0 key set don't block the others
+#     they require the gevent or eventlet package
+worker_class = environ.get('GUNICORN_WORKER_CLASS') or 'sync'
+threads = int(environ.get('GUNICORN_THREADS') or 1)
+worker_connections = int(environ.get('GUNICORN_WORKER_CONNECTIONS') or 100)
+# workers silent for this many seconds are restarted
+timeout = int(environ.get('GUNICORN_TIMEOUT') or 30)
+# how long idle keep-alive connections are kept open, for clients behind a load balancer
+keepalive = int(environ.get('GUNICORN_KEEPALIVE') or 5)
+accesslog = '-'
+
+'''
+post_worker_init(worker) hook
+    runs in each worker after the app is loaded
+    makes psycopg2 cooperative in gevent and eventlet workers,
+        their worker class has already patched the socket module, which covers the JWKS fetches
+'''
+
+
+def post_worker_init(worker):
+    if worker.cfg.worker_class_str in ('gevent', 'eventlet'):
+        from app.database.green import patch_psycopg
+        patch_psycopg(worker.cfg.worker_class_str)
+
+'''
+on_starting(server) and child_exit(server, worker) hooks
+    run in the master, and keep METRICS_DIR (see app/metrics.py) consistent across restarts
+        the metrics files of a previous run are removed on start
+        the gauges of exited workers are removed, while their counters keep counting in the totals
+'''
+
+
+def on_starting(server):
+    import glob
+    directory = environ.get('METRICS_DIR')
+    if directory:
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    import json
+    directory = environ.get('METRICS_DIR')
+    path = os.path.join(directory or '', f'metrics-{worker.pid}.json')
+    if not directory or not os.path.exists(path):
+        return
+    with open(path) as file:
+        snapshot = json.load(file)
+    snapshot['gauges'] = []
+    with open(path + '.tmp', 'w') as file:
+        json.dump(snapshot, file)
+    os.replace(path + '.tmp', path)
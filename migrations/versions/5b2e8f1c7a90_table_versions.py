@@ -0,0 +1,34 @@
+"""table versions
+
+Revision ID: 5b2e8f1c7a90
+Revises: 36c949e5a97c
+Create Date: 2026-10-18 10:12:40.318274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8f1c7a90'
+down_revision = '36c949e5a97c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # one counter per table read by the API
+    op.bulk_insert(table_versions, [
+        {'name': 'actors', 'version': 0},
+        {'name': 'movies', 'version': 0},
+        {'name': 'actor_movies', 'version': 0}
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
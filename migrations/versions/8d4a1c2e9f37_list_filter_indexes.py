@@ -0,0 +1,40 @@
+"""list filter indexes
+
+Revision ID: 8d4a1c2e9f37
+Revises: 5b2e8f1c7a90
+Create Date: 2026-10-18 11:03:51.902116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4a1c2e9f37'
+down_revision = '5b2e8f1c7a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # gender and age filters, and pages sorted by age
+    op.create_index('ix_actors_gender_age', 'actors', ['gender', 'age'])
+    op.create_index('ix_actors_age_id', 'actors', ['age', 'id'])
+    # title_prefix, LIKE only uses an index with pattern operators on postgres
+    op.create_index('ix_movies_title_pattern', 'movies', ['title'],
+                    postgresql_ops={'title': 'text_pattern_ops'})
+    # release_after, and pages sorted by release date, on the 'YYYYMMDD' key of the 'MM/DD/YYYY' strings
+    op.create_index('ix_movies_release_key', 'movies', [
+        sa.text('(substr(release_date, 7, 4) || substr(release_date, 1, 2) || substr(release_date, 4, 2))'),
+        'id'
+    ])
+    # the primary key of actor_movies starts with actor_id, so the actors of a movie need their own index
+    op.create_index('ix_actor_movies_movie_id', 'actor_movies', ['movie_id', 'actor_id'])
+
+
+def downgrade():
+    op.drop_index('ix_actor_movies_movie_id', table_name='actor_movies')
+    op.drop_index('ix_movies_release_key', table_name='movies')
+    op.drop_index('ix_movies_title_pattern', table_name='movies')
+    op.drop_index('ix_actors_age_id', table_name='actors')
+    op.drop_index('ix_actors_gender_age', table_name='actors')
@@ -0,0 +1,75 @@
+"""release date column
+
+Revision ID: c71f0e5d2b48
+Revises: 8d4a1c2e9f37
+Create Date: 2026-10-18 11:47:06.550813
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71f0e5d2b48'
+down_revision = '8d4a1c2e9f37'
+branch_labels = None
+depends_on = None
+
+# the number of movies converted per statement
+BATCH_SIZE = 1000
+# the format of release dates in the API, and of the old string column
+RELEASE_DATE_FORMAT = '%m/%d/%Y'
+
+
+def copy_in_batches(source, target, convert):
+    '''
+    fills the target column of movies with convert(id, source), reading and writing BATCH_SIZE movies at a time
+    '''
+    connection = op.get_bind()
+    movies = sa.table('movies', sa.column('id', sa.Integer), source, target)
+    update = movies.update().where(movies.c.id == sa.bindparam('movie_id')) \
+        .values({target.name: sa.bindparam('value')})
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([movies.c.id, source])
+            .where(movies.c.id > last_id).order_by(movies.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [{'movie_id': id, 'value': convert(id, value)} for id, value in rows])
+        last_id = rows[-1][0]
+
+
+def parse(id, value):
+    try:
+        return datetime.strptime(value.strip(), RELEASE_DATE_FORMAT).date()
+    except ValueError:
+        raise ValueError(f'movie {id} has a release_date which is not a MM/DD/YYYY date: {value!r}, '
+                         'fix it before upgrading')
+
+
+def upgrade():
+    op.add_column('movies', sa.Column('release_day', sa.Date(), nullable=True))
+    copy_in_batches(sa.column('release_date', sa.String), sa.column('release_day', sa.Date), parse)
+    op.drop_index('ix_movies_release_key', table_name='movies')
+    # batch mode recreates the table on sqlite, which can't drop or alter columns
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.drop_column('release_date')
+        batch_op.alter_column('release_day', new_column_name='release_date', nullable=False)
+    op.create_index('ix_movies_release_date', 'movies', ['release_date', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_movies_release_date', table_name='movies')
+    op.add_column('movies', sa.Column('release_text', sa.String(length=50), nullable=True))
+    copy_in_batches(sa.column('release_date', sa.Date), sa.column('release_text', sa.String),
+                    lambda id, value: value.strftime(RELEASE_DATE_FORMAT))
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.drop_column('release_date')
+        batch_op.alter_column('release_text', new_column_name='release_date', nullable=False)
+    op.create_index('ix_movies_release_key', 'movies', [
+        sa.text('(substr(release_date, 7, 4) || substr(release_date, 1, 2) || substr(release_date, 4, 2))'),
+        'id'
+    ])
@@ -0,0 +1,34 @@
+"""search trigram indexes
+
+Revision ID: e29b6d4f8a13
+Revises: c71f0e5d2b48
+Create Date: 2026-10-18 12:31:18.204695
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e29b6d4f8a13'
+down_revision = 'c71f0e5d2b48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm only exists on postgres, other databases are searched with an in-memory index
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_actors_name_trgm', 'actors', ['name'],
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_movies_title_trgm', 'movies', ['title'],
+                    postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_movies_title_trgm', table_name='movies')
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
@@ -1,11 +1,34 @@
 # tests for the API
+import gzip
+import importlib.util
 import json
 from app import create_app, db
 from app.database.models import Actor, Movie
+from app.auth.jwks import JWKSKeyStore, JWKSError
+from app.auth.token_cache import VerifiedTokenCache
+from app.auth.auth import AuthError, check_permissions, permission_set
+from app.serialization import JSONProvider, ORJSONProvider, orjson
+from app.cache import LRUCacheBackend, RedisCacheBackend, ResponseCache
+from app.database.search import SearchIndex, trigrams
+from app.database.pool import InstrumentedQueuePool, engine_options, pool_stats
+from app.database.models import bump_versions
+from app.database.queries import cast_condition, link_cast, select_movie, unlink_cast
+from app.database.replicas import get_replicas
+from app.instrumentation import init_instrumentation
+from app.metrics import MetricsRegistry, init_metrics, merge, render
+from app.profiler import Sampler, init_profiler
+from app.database.slow_queries import fingerprint, init_slow_queries
 from os import environ
+import os
+import subprocess
+import sys
+import tempfile
+import time
 # generating random queries for the data
-from sqlalchemy import func, desc
+from sqlalchemy import create_engine, exc, func, desc, event
+from sqlalchemy.dialects import postgresql
 import unittest
+from unittest import mock
 
 # defining variables
 if environ.get('ASSISTANT_TOKEN') is None:
@@ -26,6 +49,30 @@ producer_headers = {
     'Content-Type': 'application/json',
     'Authorization': 'bearer ' + environ.get('PRODUCER_TOKEN')
 }
+# the operational endpoints require the METRICS_TOKEN instead of a jwt
+stats_headers = {'Authorization': 'Bearer stats'}
+
+
+class QueryCounter:
+    '''
+    counts the sql statements executed on an engine inside a with block
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def after_cursor_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'after_cursor_execute',
+                     self.after_cursor_execute)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, 'after_cursor_execute',
+                     self.after_cursor_execute)
 
 
 class AgencyAPI(unittest.TestCase):
@@ -89,6 +136,267 @@ class AgencyAPI(unittest.TestCase):
         # actors length should be more than 0
         self.assertGreater(len(data['actors']), 0)
 
+    def seed_cast(self, count):
+        '''
+        adds count actors and movies, each actor playing in every new movie
+        '''
+        offset = Actor.query.count()
+        movies = [Movie(title=f'Seeded movie {offset + i}', release_date='01/01/2021')
+                  for i in range(count)]
+        for i in range(count):
+            db.session.add(Actor(name=f'Seeded actor {offset + i}',
+                                 age=30, gender='female', movies=movies))
+        db.session.commit()
+
+    def test_list_query_count_is_constant(self):
+        '''
+        tests that listing actors and movies doesn't issue a query per row
+        '''
+        counts = []
+        for _ in range(2):
+            self.seed_cast(5)
+            db.session.remove()
+            with QueryCounter(db.engine) as actors_counter:
+                self.client.get('/actors', headers=assistant_headers)
+            with QueryCounter(db.engine) as movies_counter:
+                self.client.get('/movies', headers=assistant_headers)
+            counts.append((actors_counter.count, movies_counter.count))
+        # doubling the rows should not change the number of queries
+        self.assertEqual(counts[0], counts[1])
+
+    def test_projected_reads_match_format(self):
+        '''
+        tests that the column projected responses are identical to the models' format()
+        '''
+        self.seed_cast(3)
+        actor = Actor.query.order_by(desc(Actor.id)).first()
+        movie = Movie.query.order_by(desc(Movie.id)).first()
+        actor_data = json.loads(self.client.get(
+            f'/actors/{actor.id}', headers=assistant_headers).data)
+        movie_data = json.loads(self.client.get(
+            f'/movies/{movie.id}', headers=assistant_headers).data)
+        expected_actor = actor.format()
+        expected_actor['movies'].sort(key=lambda item: item['id'])
+        expected_movie = movie.format()
+        expected_movie['actors'].sort(key=lambda item: item['id'])
+        self.assertEqual(actor_data['actors'], [expected_actor])
+        self.assertEqual(movie_data['movies'], [expected_movie])
+
+    def test_cast_route_round_trips(self):
+        '''
+        tests that linking and unlinking an actor runs a fixed number of statements, whatever the cast size
+        '''
+        self.seed_cast(5)
+        actor = Actor(name='Cast round trips', age=40, gender='male')
+        actor.insert()
+        actor_id = actor.id
+        movie_id = Movie.query.order_by(desc(Movie.id)).first().id
+        db.session.remove()
+        url = f'/movies/{movie_id}/actors'
+        with QueryCounter(db.engine) as counter:
+            response = self.client.patch(url, headers=director_headers, json={'actor_id': str(actor_id)})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({'id': actor_id, 'name': 'Cast round trips'}, data['movies'][0]['actors'])
+        self.assertEqual(len(data['movies'][0]['actors']), 6)
+        # the existence check, the insert, the version bump, and the detail
+        self.assertEqual(counter.count, 4)
+        with QueryCounter(db.engine) as counter:
+            response = self.client.delete(url, headers=director_headers, json={'actor_id': str(actor_id)})
+        data = json.loads(response.data)
+        self.assertEqual(len(data['movies'][0]['actors']), 5)
+        self.assertEqual(counter.count, 4)
+        # unknown actors are still rejected
+        response = self.client.patch(url, headers=director_headers, json={'actor_id': str(actor_id + 1)})
+        self.assertEqual(response.status_code, 404)
+        # a missing movie is reported before a bad body
+        response = self.client.patch(f'/movies/{movie_id + 1}/actors', headers=director_headers, json={})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.delete(f'/actors/{actor_id + 1}/movies', headers=director_headers, json={})
+        self.assertEqual(response.status_code, 404)
+
+    def test_detail_select_aggregates_cast(self):
+        '''
+        tests that on postgres the cast of a detail is aggregated into a json array by the database
+        '''
+        statement = str(select_movie(1).compile(dialect=postgresql.dialect()))
+        self.assertIn('json_agg(json_build_object', statement)
+        self.assertIn('ORDER BY actors.id', statement)
+        self.assertEqual(statement.count('FROM movies'), 1)
+
+    def test_paginate_actors(self):
+        '''
+        tests walking through all actors page by page
+        '''
+        self.seed_cast(13)
+        ids = []
+        response = self.client.get('/actors?limit=5', headers=assistant_headers)
+        data = json.loads(response.data)
+        ids += [actor['id'] for actor in data['actors']]
+        # the first page should be full, and point to the next page
+        self.assertEqual(len(data['actors']), 5)
+        while data['next_cursor']:
+            response = self.client.get(
+                f'/actors?limit=5&after={data["next_cursor"]}', headers=assistant_headers)
+            data = json.loads(response.data)
+            ids += [actor['id'] for actor in data['actors']]
+        # every actor should be listed exactly once, in order
+        self.assertEqual(ids, [actor.id for actor in Actor.query.order_by(Actor.id)])
+
+    def walk_pages(self, url):
+        '''
+        returns the items of every page of a list endpoint
+        '''
+        key = url.split('?')[0].strip('/')
+        items, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get(f'{url}&limit=3&after={cursor}' if cursor else f'{url}&limit=3',
+                                       headers=assistant_headers)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            items += data[key]
+            cursor = data['next_cursor']
+        return items
+
+    def test_filter_and_sort_actors(self):
+        '''
+        tests walking through the pages of filtered and sorted actors
+        '''
+        for i in range(8):
+            Actor(name=f'Filtered actor {i}', age=20 + i % 4, gender='female' if i % 2 else 'male').insert()
+        actors = self.walk_pages('/actors?gender=female&age_min=21&age_max=40&sort=-age')
+        expected = Actor.query.filter(Actor.gender == 'female', Actor.age.between(21, 40)) \
+            .order_by(desc(Actor.age), desc(Actor.id)).all()
+        self.assertEqual([actor['id'] for actor in actors], [actor.id for actor in expected])
+        # ties are broken by id
+        actors = self.walk_pages('/actors?sort=age')
+        self.assertEqual([(actor['age'], actor['id']) for actor in actors],
+                         sorted((actor.age, actor.id) for actor in Actor.query))
+        for query in ('sort=gender', 'sort=-', 'age_min=old'):
+            self.assertEqual(self.client.get(f'/actors?{query}', headers=assistant_headers).status_code, 400)
+        # a cursor of another sort order
+        cursor = json.loads(self.client.get('/actors?limit=1', headers=assistant_headers).data)['next_cursor']
+        response = self.client.get(f'/actors?sort=age&after={cursor}', headers=assistant_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_and_sort_movies(self):
+        '''
+        tests filtering movies by title prefix and release date, sorted by release date
+        '''
+        for i, release_date in enumerate(['12/31/2020', '01/02/2021', '06/15/2019', '01/02/2021', '03/01/2022']):
+            Movie(title=f'Filtered_movie {i}', release_date=release_date).insert()
+        Movie(title='Filtered movie', release_date='01/01/2030').insert()
+        movies = self.walk_pages('/movies?title_prefix=Filtered_&release_after=01/01/2020&sort=release_date')
+        self.assertEqual([(movie['title'], movie['release_date']) for movie in movies], [
+            ('Filtered_movie 0', '12/31/2020'),
+            ('Filtered_movie 1', '01/02/2021'),
+            ('Filtered_movie 3', '01/02/2021'),
+            ('Filtered_movie 4', '03/01/2022')
+        ])
+        movies = self.walk_pages('/movies?sort=-title')
+        self.assertEqual([movie['title'] for movie in movies],
+                         sorted((movie.title for movie in Movie.query), reverse=True))
+        movies = self.walk_pages('/movies?release_after=01/01/2020&release_before=03/01/2022&sort=-release_date')
+        self.assertEqual([movie['release_date'] for movie in movies],
+                         ['01/02/2021', '01/02/2021', '01/01/2021', '12/31/2020'])
+        for query in ('release_after=2021-01-01', 'release_before=02/30/2021',
+                      'sort=release_date&after=WyIwMi8zMC8yMDIxIiwxXQ'):
+            self.assertEqual(self.client.get(f'/movies?{query}', headers=assistant_headers).status_code, 400)
+
+    def test_post_movie_with_envalid_release_date(self):
+        '''
+        tests that release dates must be MM/DD/YYYY dates
+        '''
+        for release_date in ('2021-01-01', '13/01/2021', 2021):
+            response = self.client.post('/movies', headers=producer_headers,
+                                        json={'title': 'Dated movie', 'release_date': release_date})
+            self.assertEqual(response.status_code, 400)
+        # dates are stored as dates, and read back in the same format
+        response = self.client.post('/movies', headers=producer_headers,
+                                    json={'title': 'Dated movie', 'release_date': '2/3/2021'})
+        movie_id = json.loads(response.data)['movies'][0]['id']
+        db.session.expire_all()
+        self.assertEqual(Movie.query.get(movie_id).release_date, '02/03/2021')
+
+    def test_search(self):
+        '''
+        tests searching actor names and movie titles
+        '''
+        Actor(name='Tom Cruise', age=59, gender='male').insert()
+        Actor(name='Penelope Cruz', age=47, gender='female').insert()
+        Movie(title='Cruising', release_date='02/08/1980').insert()
+        response = self.client.get('/search?q=cruise', headers=assistant_headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['results'][0]['name'], 'Tom Cruise')
+        self.assertEqual(data['results'][0]['score'], 1.0)
+        # substrings match too
+        response = self.client.get('/search?q=test&type=movies&limit=1', headers=assistant_headers)
+        data = json.loads(response.data)
+        titles = [result['title'] for result in data['results']]
+        while data['next_cursor']:
+            data = json.loads(self.client.get(f'/search?q=test&type=movies&limit=1&after={data["next_cursor"]}',
+                                              headers=assistant_headers).data)
+            titles += [result['title'] for result in data['results']]
+        self.assertEqual(sorted(titles), ['The Testing Test', 'The Testing Test - sequal'])
+        # new rows are found without restarting
+        Actor(name='Cruise Control', age=30, gender='male').insert()
+        data = json.loads(self.client.get('/search?q=cruise&type=actors', headers=assistant_headers).data)
+        self.assertEqual({result['name'] for result in data['results']}, {'Tom Cruise', 'Cruise Control'})
+        # results are capped
+        self.app.config['SEARCH_MAX_RESULTS'] = 1
+        data = json.loads(self.client.get('/search?q=cruise', headers=assistant_headers).data)
+        self.assertEqual((len(data['results']), data['next_cursor']), (1, None))
+        for query in ('q=', 'q=cruise&type=people', 'q=cruise&after=WyJ4Il0'):
+            self.assertEqual(self.client.get(f'/search?{query}', headers=assistant_headers).status_code, 400)
+
+    def test_page_size_is_capped(self):
+        '''
+        tests that the server enforces the maximum page size
+        '''
+        self.app.config['MAX_ITEMS_PER_PAGE'] = 3
+        self.seed_cast(5)
+        response = self.client.get('/movies?limit=1000', headers=assistant_headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['movies']), 3)
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_envalid_cursor(self):
+        '''
+        tests that malformed pagination parameters are rejected
+        '''
+        response = self.client.get('/actors?after=not-a-cursor', headers=assistant_headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/actors?limit=0', headers=assistant_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_actors(self):
+        '''
+        tests streaming all actors as a single json document
+        '''
+        self.app.config['EXPORT_BATCH_SIZE'] = 4
+        self.seed_cast(7)
+        response = self.client.get('/actors/export', headers=assistant_headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        # the export is not paginated
+        self.assertEqual(len(data['actors']), Actor.query.count())
+        self.assertEqual(len(data['actors'][-1]['movies']), 7)
+
+    def test_export_movies_ndjson(self):
+        '''
+        tests streaming all movies as newline delimited json
+        '''
+        self.seed_cast(3)
+        response = self.client.get('/movies/export?format=ndjson', headers=assistant_headers)
+        lines = response.data.decode().splitlines()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), Movie.query.count())
+        self.assertIn('title', json.loads(lines[0]))
+
     def test_missing_auth_actors(self):
         '''test getting all actors without authorisation'''
         # get response json, then load the data
@@ -200,6 +508,52 @@ class AgencyAPI(unittest.TestCase):
         # actors length should be more than 0
         self.assertGreater(len(data['actors']), 0)
 
+    def test_post_actors_bulk(self):
+        '''
+        tests creating many actors at once, with per item results
+        '''
+        self.app.config['BULK_INSERT_CHUNK'] = 2
+        response = self.client.post('/actors/bulk',
+                                    headers=director_headers,
+                                    json={'actors': [
+                                        {'name': 'Bulk 1', 'age': '20', 'gender': 'male'},
+                                        {'name': 'Actor 1', 'age': '42', 'gender': 'male'},
+                                        {'name': 'Bulk 2', 'age': 'old', 'gender': 'male'},
+                                        {'name': 'Bulk 3', 'age': '30', 'gender': 'female'},
+                                        {'name': 'Bulk 1', 'age': '21', 'gender': 'male'},
+                                        {'name': 'Bulk 4', 'age': '40', 'gender': 'female'}
+                                    ]})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['created'], 3)
+        codes = [result.get('code', 200) for result in data['results']]
+        # existing names and repeated names conflict, invalid ages are rejected
+        self.assertEqual(codes, [200, 409, 400, 200, 409, 200])
+        created = data['results'][3]['actors'][0]
+        self.assertEqual(Actor.query.get(created['id']).name, 'Bulk 3')
+        self.assertEqual(created['age'], 30)
+
+    def test_unauthorised_post_actors_bulk(self):
+        '''
+        tests bulk creating actors with a role below the minimum role
+        '''
+        response = self.client.post('/actors/bulk',
+                                    headers=assistant_headers,
+                                    json=[{'name': 'Bulk 1', 'age': '20', 'gender': 'male'}])
+        self.assertEqual(response.status_code, 403)
+
+    def test_envalid_post_actors_bulk(self):
+        '''
+        tests bulk creating actors with an empty or oversized body
+        '''
+        response = self.client.post('/actors/bulk', headers=director_headers, json=[])
+        self.assertEqual(response.status_code, 400)
+        self.app.config['BULK_MAX_ITEMS'] = 1
+        response = self.client.post('/actors/bulk', headers=director_headers,
+                                    json=[{'name': 'Bulk 1', 'age': '20', 'gender': 'male'}] * 2)
+        self.assertEqual(response.status_code, 413)
+
     def test_empty_patch_actor(self):
         '''
         tests patching an actor with empty json
@@ -489,6 +843,22 @@ class AgencyAPI(unittest.TestCase):
         # movies length should be more than 0
         self.assertGreater(len(data['movies']), 0)
 
+    def test_post_movies_bulk(self):
+        '''
+        tests creating many movies at once
+        '''
+        response = self.client.post('/movies/bulk',
+                                    headers=producer_headers,
+                                    json=[
+                                        {'title': 'Bulk movie', 'release_date': '01/01/2024'},
+                                        {'title': 'The Testing Test', 'release_date': '01/01/2021'}
+                                    ])
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['results'][0]['movies'][0]['title'], 'Bulk movie')
+        self.assertEqual(data['results'][1]['code'], 409)
+
     def test_empty_patch_movie(self):
         '''
         tests patching a movie with empty json
@@ -615,6 +985,258 @@ class AgencyAPI(unittest.TestCase):
         # movies length should be more than 0
         self.assertGreater(len(data['movies']), 0)
 
+    def test_post_cast(self):
+        '''
+        tests linking many actors and movies in one request
+        '''
+        actors = Actor.query.order_by(Actor.id).all()
+        movies = Movie.query.order_by(Movie.id).all()
+        cast = [{'actor_id': actor.id, 'movie_id': movie.id}
+                for actor in actors for movie in movies]
+        # an unknown movie, and a repeated pair
+        cast.append({'actor_id': actors[0].id, 'movie_id': movies[-1].id + 1})
+        cast.append(cast[0])
+        response = self.client.post('/cast', headers=director_headers, json={'cast': cast})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['linked'], len(actors) * len(movies))
+        self.assertEqual([result.get('code') for result in data['results'][-2:]], [404, 409])
+        self.assertEqual(len(Actor.query.get(actors[0].id).movies), len(movies))
+        # linking the same pairs again is a no-op
+        response = self.client.post('/cast', headers=director_headers, json=cast[:2])
+        self.assertEqual(json.loads(response.data)['linked'], 0)
+
+    def test_delete_cast(self):
+        '''
+        tests unlinking many actors and movies in one request
+        '''
+        self.seed_cast(2)
+        actor = Actor.query.order_by(desc(Actor.id)).first()
+        cast = [{'actor_id': str(actor.id), 'movie_id': str(movie.id)} for movie in actor.movies]
+        response = self.client.delete('/cast', headers=director_headers, json=cast)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['unlinked'], 2)
+        db.session.expire_all()
+        self.assertEqual(Actor.query.get(actor.id).movies, [])
+
+    def test_cast_fallbacks(self):
+        '''
+        tests linking and unlinking on databases without an ignoring insert or row values
+        '''
+        self.seed_cast(2)
+        actor = Actor.query.order_by(desc(Actor.id)).first()
+        movie_ids = [movie.id for movie in actor.movies]
+        new = Movie(title='Fallback movie', release_date='01/01/2021')
+        new.insert()
+        pairs = [(actor.id, movie_ids[0]), (actor.id, new.id)]
+        self.assertIn(' IN ', str(cast_condition(pairs)))
+        with mock.patch('app.database.queries.insert_ignore', return_value=None):
+            # the pair which is already linked is skipped
+            self.assertEqual(link_cast(pairs), 1)
+            self.assertEqual(link_cast(pairs), 0)
+        with mock.patch('app.database.queries.supports_row_values', return_value=False):
+            self.assertNotIn(' IN ', str(cast_condition(pairs)))
+            self.assertEqual(unlink_cast(pairs), 2)
+        db.session.commit()
+        self.assertEqual([movie.id for movie in Actor.query.get(actor.id).movies], movie_ids[1:])
+
+    def test_cached_responses_are_invalidated(self):
+        '''
+        tests that cached reads are served until a write changes their rows
+        '''
+        self.app.config['RESPONSE_CACHE'] = 'lru'
+        actor = Actor.query.order_by(Actor.id).first()
+        movie = Movie.query.order_by(Movie.id).first()
+        response = self.client.patch(f'/actors/{actor.id}/movies', headers=director_headers,
+                                     json={'movie_id': str(movie.id)})
+        self.assertEqual(response.status_code, 200)
+        for url in ('/actors', f'/actors/{actor.id}', f'/movies/{movie.id}'):
+            self.assertEqual(self.client.get(url, headers=assistant_headers).headers['X-Cache'], 'MISS')
+            self.assertEqual(self.client.get(url, headers=assistant_headers).headers['X-Cache'], 'HIT')
+        # renaming the actor drops every response containing it, including the movie's
+        self.client.patch(f'/actors/{actor.id}', headers=director_headers, json={'name': 'Renamed actor'})
+        for url in ('/actors', f'/actors/{actor.id}', f'/movies/{movie.id}'):
+            response = self.client.get(url, headers=assistant_headers)
+            self.assertEqual(response.headers['X-Cache'], 'MISS')
+            self.assertIn(b'Renamed actor', response.data)
+        # new actors drop the list responses only
+        self.client.post('/actors', headers=producer_headers,
+                         json={'name': 'Cached actor', 'age': '30', 'gender': 'female'})
+        self.assertEqual(self.client.get('/actors', headers=assistant_headers).headers['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(f'/actors/{actor.id}', headers=assistant_headers).headers['X-Cache'],
+                         'HIT')
+        # cached responses still require a token
+        self.assertEqual(self.client.get(f'/actors/{actor.id}').status_code, 401)
+        self.app.config['METRICS_TOKEN'] = 'stats'
+        stats = json.loads(self.client.get('/cache', headers=stats_headers).data)['cache']
+        self.assertEqual((stats['hits'], stats['misses']), (4, 7))
+        self.assertEqual(stats['invalidations'], 3)
+        # deleting an actor drops the list pages, even those which don't contain it
+        self.assertEqual(self.client.get('/actors?limit=1', headers=assistant_headers).headers['X-Cache'], 'MISS')
+        cached = Actor.query.filter(Actor.name == 'Cached actor').first()
+        self.client.delete(f'/actors/{cached.id}', headers=director_headers)
+        self.assertEqual(self.client.get('/actors?limit=1', headers=assistant_headers).headers['X-Cache'], 'MISS')
+
+    def test_conditional_get(self):
+        '''
+        tests that unchanged lists and details are answered with 304, without loading them
+        '''
+        actor = Actor.query.order_by(Actor.id).first()
+        movie = Movie.query.order_by(Movie.id).first()
+        etags = {}
+        for url in ('/actors', '/movies', f'/actors/{actor.id}', f'/movies/{movie.id}'):
+            response = self.client.get(url, headers=assistant_headers)
+            etags[url] = response.headers['ETag']
+            with QueryCounter(db.engine) as counter:
+                response = self.client.get(url, headers=dict(assistant_headers, **{'If-None-Match': etags[url]}))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            # only the table versions are read
+            self.assertEqual(counter.count, 1)
+        self.assertEqual(len(set(etags.values())), 4)
+        # linking an actor changes the representation of both
+        self.client.post('/cast', headers=director_headers, json=[{'actor_id': actor.id, 'movie_id': movie.id}])
+        for url, etag in etags.items():
+            response = self.client.get(url, headers=dict(assistant_headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+        # linking it again changes nothing
+        etag = self.client.get('/actors', headers=assistant_headers).headers['ETag']
+        self.client.post('/cast', headers=director_headers, json=[{'actor_id': actor.id, 'movie_id': movie.id}])
+        self.assertEqual(self.client.get('/actors', headers=assistant_headers).headers['ETag'], etag)
+
+    def test_compressed_responses(self):
+        '''
+        tests that large responses are compressed when the client accepts gzip
+        '''
+        self.app.config['COMPRESSION_MIN_SIZE'] = 200
+        self.app.config['RESPONSE_CACHE'] = 'lru'
+        self.seed_cast(5)
+        plain = self.client.get('/actors', headers=assistant_headers)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+        headers = dict(assistant_headers, **{'Accept-Encoding': 'gzip'})
+        # the first request compresses the cached body, the second reuses it
+        for _ in range(2):
+            response = self.client.get('/actors', headers=headers)
+            self.assertEqual(response.headers['X-Cache'], 'HIT')
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.data), plain.data)
+            self.assertEqual(response.headers['ETag'], plain.headers['ETag'][:-1] + '-gzip"')
+        # the compressed body was stored with the cached response
+        (entry, expires_at), = self.app.extensions['response_cache'].backend._entries.values()
+        generation, tags, (body, mimetype, variants) = entry
+        self.assertEqual(gzip.decompress(variants['gzip']), body)
+        response = self.client.get('/actors', headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+        self.assertEqual(response.status_code, 304)
+        # small responses are sent as they are
+        actor = Actor.query.order_by(Actor.id).first()
+        response = self.client.get(f'/actors/{actor.id}', headers=headers)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_server_timing(self):
+        '''
+        tests the per-request timings, and the warning of requests over their query budget
+        '''
+        self.app.config.update(INSTRUMENTATION=True, QUERY_BUDGET=1)
+        init_instrumentation(self.app)
+        with self.assertLogs('app.instrumentation', 'WARNING') as logs:
+            response = self.client.get('/actors', headers=assistant_headers)
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers['Server-Timing']
+        for name in ('db', 'auth', 'serialize', 'total'):
+            self.assertIn(f'{name};dur=', timing)
+        # the table versions, and the actors with their movies
+        self.assertIn('desc="2 queries"', timing)
+        message = logs.records[0].getMessage()
+        record = json.loads(message[message.index('{'):])
+        self.assertEqual((record['endpoint'], record['queries'], record['query_budget']), ('main.get_actors', 2, 1))
+
+    def test_metrics(self):
+        '''
+        tests the prometheus metrics of the requests, including the rejected ones
+        '''
+        self.app.config.update(METRICS=True, METRICS_TOKEN='scraper')
+        init_metrics(self.app)
+        self.client.get('/actors', headers=assistant_headers)
+        self.client.get('/actors', headers={'Authorization': 'token'})
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer scrap\u00e9'}).status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scraper'})
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn('http_requests_total{endpoint="main.get_actors",method="GET",status="200"} 1', text)
+        self.assertIn('http_requests_total{endpoint="main.get_actors",method="GET",status="400"} 1', text)
+        self.assertIn('auth_errors_total{code="envalid_auth_header",status="400"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="main.get_actors"} 2', text)
+        self.assertIn('# TYPE jwks_refreshes_total counter', text)
+        # without a token, the metrics are served to nobody
+        self.app.config['METRICS_TOKEN'] = None
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+    def test_profiler(self):
+        '''
+        tests profiling the requests carrying the profile token
+        '''
+        directory = tempfile.TemporaryDirectory()
+        self.app.config.update(PROFILE_DIR=directory.name, PROFILE_TOKEN='admin', PROFILE_FLUSH_INTERVAL=3600)
+        init_profiler(self.app)
+        response = self.client.get('/actors', headers=assistant_headers)
+        self.assertNotIn('X-Profiled', response.headers)
+        response = self.client.get('/actors', headers=dict(assistant_headers, **{'X-Profile': 'adm\u00efn'}))
+        self.assertNotIn('X-Profiled', response.headers)
+        response = self.client.get('/actors', headers=dict(assistant_headers, **{'X-Profile': 'admin'}))
+        self.assertEqual(response.headers['X-Profiled'], 'true')
+        sampler = self.app.extensions['profiler']['sampler']
+        self.assertEqual(sampler.active, {})
+        directory.cleanup()
+
+    def test_slow_queries(self):
+        '''
+        tests logging slow statements with their plan, and reporting the statements by fingerprint
+        '''
+        # every statement is slow
+        self.app.config.update(SLOW_QUERY_MS=1e-9, SLOW_QUERY_EXPLAIN=True)
+        init_slow_queries(self.app)
+        actor = Actor.query.order_by(Actor.id).first()
+        with self.assertLogs('app.database.slow_queries', 'WARNING') as logs:
+            self.client.get(f'/actors/{actor.id}', headers=assistant_headers)
+            self.client.get(f'/actors/{actor.id + 1}', headers=assistant_headers)
+        records = [json.loads(record.getMessage()[record.getMessage().index('{'):]) for record in logs.records]
+        self.assertEqual({record['endpoint'] for record in records}, {'main.get_actor_details'})
+        self.assertTrue(any(record.get('plan') for record in records))
+        self.assertTrue(all('parameters' in record for record in records))
+        self.assertEqual(self.client.get('/queries', headers=assistant_headers).status_code, 401)
+        self.app.config['METRICS_TOKEN'] = 'stats'
+        response = self.client.get('/queries', headers=stats_headers)
+        queries = json.loads(response.data)['queries']
+        # both requests ran the same statements, with different ids
+        details = [query for query in queries if query['endpoints'].get('main.get_actor_details')]
+        self.assertTrue(details)
+        self.assertTrue(all(query['count'] >= 2 for query in details))
+        self.assertTrue(all(query['p99_ms'] >= query['p50_ms'] for query in queries))
+
+    def test_pool_stats(self):
+        '''
+        tests reporting on the connection pool, which sqlite databases don't have
+        '''
+        # every role can read the actors, only the operators have the METRICS_TOKEN
+        self.assertEqual(self.client.get('/pool', headers=producer_headers).status_code, 401)
+        self.app.config['METRICS_TOKEN'] = 'stats'
+        self.assertEqual(self.client.get('/pool', headers=producer_headers).status_code, 401)
+        response = self.client.get('/pool', headers=stats_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pool', json.loads(response.data))
+
+    def test_unauthorised_post_cast(self):
+        '''
+        tests linking actors and movies with a role below the minimum role
+        '''
+        response = self.client.post('/cast', headers=assistant_headers,
+                                    json=[{'actor_id': 1, 'movie_id': 1}])
+        self.assertEqual(response.status_code, 403)
+
     def test_unauthorised_delete_movie(self):
         '''
         tests deleting a movie with a role below the minimum role
@@ -649,6 +1271,469 @@ class AgencyAPI(unittest.TestCase):
         self.assertIn('delete', data)
 
 
+class JWKSKeyStoreTests(unittest.TestCase):
+    '''
+    tests for the in-process JWKS cache
+    '''
+
+    def setUp(self):
+        # a key store whose fetch() counts calls instead of contacting Auth0
+        self.fetches = 0
+        self.fail = False
+        self.store = JWKSKeyStore('https://example.com/.well-known/jwks.json')
+
+        def fetch():
+            self.fetches += 1
+            if self.fail:
+                raise OSError('Auth0 is down')
+            return {'keys': [{'kid': 'key-1', 'kty': 'RSA'}]}, 120
+        self.store.fetch = fetch
+
+    def test_keys_are_cached(self):
+        '''tests that the key set is fetched once for many lookups'''
+        for _ in range(10):
+            self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.fetches, 1)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        '''tests that unknown key ids don't hammer Auth0'''
+        self.store.get_key('key-1')
+        # the first lookup of an unknown kid is within min_refresh_interval of the initial fetch
+        self.assertIsNone(self.store.get_key('rotated-key'))
+        self.assertEqual(self.fetches, 1)
+        # once the interval passes, an unknown kid triggers a single refresh
+        self.store._last_fetch -= self.store.min_refresh_interval
+        self.assertIsNone(self.store.get_key('rotated-key'))
+        self.assertIsNone(self.store.get_key('rotated-key'))
+        self.assertEqual(self.fetches, 2)
+
+    def test_stale_keys_served_when_auth0_is_down(self):
+        '''tests that expired keys are used while Auth0 is unreachable'''
+        self.store.get_key('key-1')
+        self.fail = True
+        # expire the keys, but stay inside the stale window
+        self.store._expires_at -= 121
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.store.stale_hits, 1)
+        # past the stale window the store gives up
+        self.store._expires_at -= self.store.stale_ttl
+        with self.assertRaises(JWKSError):
+            self.store.get_key('key-1')
+
+    def test_failed_fetches_back_off(self):
+        '''tests that Auth0 isn't polled after a failed fetch, by requests waiting or serving stale keys'''
+        self.fail = True
+        for _ in range(10):
+            with self.assertRaises(JWKSError):
+                self.store.get_key('key-1')
+        self.assertEqual(self.fetches, 1)
+        # once the interval passes, a single request tries again
+        self.store._last_failure -= self.store.min_refresh_interval
+        with self.assertRaises(JWKSError):
+            self.store.get_key('key-1')
+        self.assertEqual(self.fetches, 2)
+        # stale keys are served without starting a background refresh
+        self.store.load({'keys': [{'kid': 'key-1', 'kty': 'RSA'}]}, 120)
+        self.store._expires_at -= 121
+        for _ in range(10):
+            self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertFalse(self.store._refreshing)
+        self.assertEqual(self.fetches, 2)
+
+
+class VerifiedTokenCacheTests(unittest.TestCase):
+    '''
+    tests for the verified token cache
+    '''
+
+    def test_hit_and_miss(self):
+        '''tests that a cached token is returned and counted'''
+        cache = VerifiedTokenCache(maxsize=2)
+        payload = {'sub': 'user', 'exp': time.time() + 60}
+        self.assertIsNone(cache.get('token'))
+        cache.set('token', payload, payload['exp'])
+        self.assertIs(cache.get('token'), payload)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_expired_tokens_are_dropped(self):
+        '''tests that entries don't outlive the exp claim'''
+        cache = VerifiedTokenCache()
+        cache.set('expired', {}, time.time() - 1)
+        cache.set('no-exp', {}, None)
+        self.assertIsNone(cache.get('expired'))
+        self.assertIsNone(cache.get('no-exp'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        '''tests that the cache stays bounded'''
+        cache = VerifiedTokenCache(maxsize=2)
+        exp = time.time() + 60
+        cache.set('a', 'a', exp)
+        cache.set('b', 'b', exp)
+        # touch a, so b becomes the least recently used entry
+        cache.get('a')
+        cache.set('c', 'c', exp)
+        self.assertEqual(cache.get('a'), 'a')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'c')
+
+
+class PermissionTests(unittest.TestCase):
+    '''
+    tests for the precompiled permission checks
+    '''
+
+    def setUp(self):
+        self.granted = permission_set(
+            {'permissions': ['get:actor-details', 'patch:actors']})
+
+    def test_all_of(self):
+        '''tests that all_of requires every permission'''
+        self.assertTrue(check_permissions(
+            '', self.granted, all_of={'get:actor-details', 'patch:actors'}))
+        with self.assertRaises(AuthError) as context:
+            check_permissions(
+                '', self.granted, all_of={'get:actor-details', 'patch:movies'})
+        self.assertEqual(context.exception.status_code, 403)
+
+    def test_any_of(self):
+        '''tests that any_of requires at least one permission'''
+        self.assertTrue(check_permissions(
+            '', self.granted, any_of={'patch:actors', 'patch:movies'}))
+        with self.assertRaises(AuthError):
+            check_permissions(
+                '', self.granted, any_of={'post:movies', 'patch:movies'})
+
+    def test_missing_permissions_claim(self):
+        '''tests that a payload without permissions is rejected'''
+        with self.assertRaises(AuthError) as context:
+            check_permissions('get:actor-details', {})
+        self.assertEqual(context.exception.status_code, 400)
+
+
+class JSONProviderTests(unittest.TestCase):
+    '''
+    tests for the json providers
+    '''
+
+    def test_models_are_serialized(self):
+        '''tests that models are encoded through their format() method'''
+        movie = Movie(id=1, title='The Testing Test', release_date='01/01/2021')
+        body = json.loads(JSONProvider().dumps({'movies': [movie]}))
+        self.assertEqual(body['movies'][0]['title'], 'The Testing Test')
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_matches_json(self):
+        '''tests that both providers encode the same document'''
+        movie = Movie(id=1, title='Café', release_date='01/01/2021')
+        document = {'success': True, 'movies': [movie.format()]}
+        for indent in (None, 2):
+            self.assertEqual(json.loads(ORJSONProvider(indent).dumps(document)),
+                             json.loads(JSONProvider(indent).dumps(document)))
+        # compact output is never pretty-printed
+        self.assertNotIn(b'\n', ORJSONProvider(2).dumps(document, compact=True))
+
+
+class SearchIndexTests(unittest.TestCase):
+    '''
+    tests for the in-memory search index
+    '''
+
+    def test_trigrams(self):
+        '''tests that trigrams are computed per word, like pg_trgm'''
+        self.assertEqual(trigrams('Cat'), {'  c', ' ca', 'cat', 'at '})
+        self.assertEqual(trigrams('a-b'), {'  a', ' a ', '  b', ' b '})
+
+    def test_ranking(self):
+        '''tests that closer matches rank first, and that weak matches are dropped'''
+        index = SearchIndex([('actor', 1, 'Tom Cruise'), ('actor', 2, 'Tom Hanks'),
+                             ('movie', 3, 'Top Gun'), ('movie', 4, 'Cruisers')])
+        self.assertEqual([result[:2] for result in index.search('tom cruise')], [('actor', 1)])
+        self.assertEqual([result[:2] for result in index.search('cruise')], [('actor', 1), ('movie', 4)])
+        self.assertEqual([result[:2] for result in index.search('to', kinds=('movie',))], [('movie', 3)])
+
+
+class PoolTests(unittest.TestCase):
+    '''
+    tests for the connection pool configuration and instrumentation
+    '''
+
+    def test_engine_options(self):
+        '''tests that pools are sized from the workers, threads, and connection limit'''
+        app = create_app('production')
+        config = dict(app.config, SQLALCHEMY_DATABASE_URI='postgresql://localhost/capstone', SQLALCHEMY_ENGINE_OPTIONS={},
+                      WEB_CONCURRENCY=3, GUNICORN_THREADS=4, DB_MAX_CONNECTIONS=20)
+        options = engine_options(config)
+        self.assertEqual((options['pool_size'], options['max_overflow']), (4, 2))
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=30000'})
+        # explicit settings win, and sqlite keeps the defaults
+        options = engine_options(dict(config, DB_POOL_SIZE=8, DB_MAX_OVERFLOW=0))
+        self.assertEqual((options['pool_size'], options['max_overflow']), (8, 0))
+        self.assertEqual(engine_options(dict(config, SQLALCHEMY_DATABASE_URI='sqlite://')), {})
+        # gevent workers share their connections between many more requests than threads
+        options = engine_options(dict(config, GUNICORN_WORKER_CLASS='gevent', WEB_CONCURRENCY=2))
+        self.assertEqual((options['pool_size'], options['max_overflow']), (10, 0))
+
+    def test_checkout_stats(self):
+        '''tests that checkouts and checkout timeouts are counted'''
+        engine = create_engine(environ['TEST_DATABASE_URI'], poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        connection = engine.connect()
+        self.assertEqual(pool_stats(engine)['saturation'], 1.0)
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+        connection.close()
+        engine.connect().close()
+        stats = pool_stats(engine)
+        self.assertEqual((stats['checkouts'], stats['timeouts'], stats['checked_out']), (3, 1, 0))
+        self.assertGreaterEqual(stats['wait_seconds_max'], 0.05)
+        engine.dispose()
+        self.assertEqual(pool_stats(engine)['checkouts'], 3)
+
+
+class ReplicaTests(unittest.TestCase):
+    '''
+    tests for routing read-only requests to replicas, with sqlite files standing in for them
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app('testing')
+        self.app.config['DATABASE_REPLICA_URLS'] = [
+            f'sqlite:///{self.directory.name}/replica{i}.db' for i in range(2)]
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.app.config['METRICS_TOKEN'] = 'stats'
+        self.client = self.app.test_client()
+        db.drop_all()
+        db.create_all()
+        Actor(name='Primary', age=40, gender='male').insert()
+        # each replica holds a different actor, to tell which one served a request
+        for i, engine in enumerate(get_replicas().engines):
+            db.metadata.create_all(engine)
+            engine.execute(Actor.__table__.insert(), name=f'Replica {i}', age=30, gender='female')
+
+    def tearDown(self):
+        db.session.remove()
+        for engine in get_replicas().engines:
+            engine.dispose()
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def actor_names(self):
+        response = self.client.get('/actors', headers=assistant_headers)
+        self.assertEqual(response.status_code, 200)
+        return [actor['name'] for actor in json.loads(response.data)['actors']]
+
+    def test_round_robin(self):
+        '''tests that GET requests are spread over the replicas, and other requests use the primary'''
+        self.assertEqual([self.actor_names() for _ in range(3)], [['Replica 0'], ['Replica 1'], ['Replica 0']])
+        response = self.client.post('/actors', headers=director_headers,
+                                    json={'name': 'New', 'age': '20', 'gender': 'male'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([actor.name for actor in Actor.query.order_by(Actor.id)], ['Primary', 'New'])
+        self.assertEqual(self.actor_names(), ['Replica 1'])
+
+    def test_read_after_write(self):
+        '''tests that a read-only request stays on the primary once it writes'''
+        names = db.select([Actor.__table__.c.name])
+        with self.app.test_request_context('/actors'):
+            self.assertEqual(db.session.execute(names).scalar(), 'Replica 0')
+            bump_versions('actors')
+            self.assertEqual(db.session.execute(names).scalar(), 'Primary')
+            db.session.rollback()
+
+    def test_unhealthy_replica(self):
+        '''tests that replicas failing their health check are skipped'''
+        self.app.extensions.pop('replicas')
+        self.app.config['DATABASE_REPLICA_URLS'] = [
+            f'sqlite:///{self.directory.name}/missing/replica.db', f'sqlite:///{self.directory.name}/replica1.db']
+        self.assertEqual([self.actor_names() for _ in range(2)], [['Replica 1'], ['Replica 1']])
+        replicas = json.loads(self.client.get('/pool', headers=stats_headers).data)['replicas']
+        self.assertEqual([replica['healthy'] for replica in replicas], [False, True])
+
+
+class MetricsTests(unittest.TestCase):
+    '''
+    tests for merging and rendering the metrics of several workers
+    '''
+
+    def test_merge_workers(self):
+        '''tests that the counters, pool gauges, and histograms of workers are summed, with cumulative buckets'''
+        snapshots = []
+        for duration in (0.003, 0.2):
+            registry = MetricsRegistry()
+            registry.inc('http_requests_total', (('endpoint', 'main.get_actors'),))
+            registry.observe('http_request_duration_seconds', (('endpoint', 'main.get_actors'),), duration)
+            gauges = [['jwks_keys', [], 1], ['db_pool_size', [['database', 'primary']], 5]]
+            # the workers' files hold the labels as json lists
+            snapshots.append(json.loads(json.dumps(dict(registry.snapshot(), gauges=gauges))))
+        text = render(*merge(snapshots))
+        self.assertIn('http_requests_total{endpoint="main.get_actors"} 2', text)
+        # every worker holds a copy of the same keys, and its own pool
+        self.assertIn('jwks_keys 1', text)
+        self.assertIn('db_pool_size{database="primary"} 10', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="main.get_actors",le="0.005"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="main.get_actors",le="0.25"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="main.get_actors",le="+Inf"} 2', text)
+        self.assertIn('http_request_duration_seconds_sum{endpoint="main.get_actors"} 0.203', text)
+
+
+class FingerprintTests(unittest.TestCase):
+    '''
+    tests for the statement fingerprints of the slow query log
+    '''
+
+    def test_fingerprint(self):
+        '''tests that literals and parameter lists are replaced'''
+        self.assertEqual(
+            fingerprint("SELECT * FROM actors\n WHERE name = 'it''s' AND id IN (%(id_1)s, %(id_2)s) LIMIT 10"),
+            'SELECT * FROM actors WHERE name = ? AND id IN (...) LIMIT ?')
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (?, ?, ?)'), fingerprint('SELECT * FROM t WHERE id IN (?, ?)'))
+
+
+class SamplerTests(unittest.TestCase):
+    '''
+    tests for the sampling profiler
+    '''
+
+    def test_collapsed_stacks(self):
+        '''tests that samples are counted per endpoint, and written as collapsed stacks'''
+        with tempfile.TemporaryDirectory() as directory:
+            sampler = Sampler(directory, flush_interval=3600)
+            sampler.begin('main.get_actors')
+            sampler.sample()
+            sampler.sample()
+            sampler.end()
+            sampler.sample()
+            sampler.flush()
+            path = f'{directory}/main.get_actors.{os.getpid()}.collapsed'
+            with open(path) as file:
+                stack, count = file.read().strip().rsplit(' ', 1)
+        self.assertEqual(count, '2')
+        # the profiled thread is the one sampling
+        self.assertIn('sample (app/profiler.py:', stack.rsplit(';', 1)[-1])
+        self.assertIn('test_collapsed_stacks (test_app.py:', stack)
+
+    @unittest.skipIf(importlib.util.find_spec('gevent') is None, 'gevent is not installed')
+    def test_sampler_under_gevent(self):
+        '''tests that the sampling thread never starts a gevent hub of its own, once gevent patched threading'''
+        script = '''
+import os, sys, time
+from gevent import monkey
+monkey.patch_all()
+from gevent._hub_local import get_hub_if_exists
+from app.profiler import Sampler
+
+hubs = []
+
+
+class ProbedSampler(Sampler):
+    def sample(self):
+        super().sample()
+        hubs.append(get_hub_if_exists() is not None)
+
+
+sampler = ProbedSampler(sys.argv[1], interval=0.001, flush_interval=0.05)
+sampler.begin('main.get_actors')
+clock = monkey.get_original('time', 'time')
+deadline = clock() + 0.2
+while clock() < deadline:
+    sum(range(1000))
+sampler.end()
+time.sleep(0.1)
+print(len(hubs), any(hubs), *os.listdir(sys.argv[1]))
+'''
+        with tempfile.TemporaryDirectory() as directory:
+            result = subprocess.run([sys.executable, '-c', script, directory], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        samples, hubs, *files = result.stdout.split()
+        self.assertGreater(int(samples), 0)
+        self.assertEqual(hubs, 'False')
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('main.get_actors.'))
+
+
+class FakeRedis:
+    '''
+    the subset of the redis-py client used by RedisCacheBackend, without expiry
+    '''
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def mset(self, mapping):
+        self.data.update(mapping)
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.data) if key.startswith(pattern.rstrip('*'))]
+
+
+class ResponseCacheTests(unittest.TestCase):
+    '''
+    tests for the response cache and its backends
+    '''
+
+    def check_invalidation(self, backend):
+        cache = ResponseCache(backend, ttl=60)
+        cache.set('a', cache.generation(), {'actor:1', 'movie:1'}, 'response a')
+        cache.set('b', cache.generation(), {'actor:2'}, 'response b')
+        self.assertEqual(cache.get('a'), 'response a')
+        cache.invalidate('movie:1')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'response b')
+        # a response computed before an invalidation is stale, even if it is stored after it
+        generation = cache.generation()
+        cache.invalidate('actor:2')
+        cache.set('b', generation, {'actor:2'}, 'stale b')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    def test_lru_backend(self):
+        '''tests invalidation and eviction of the in-process backend'''
+        self.check_invalidation(LRUCacheBackend())
+        backend = LRUCacheBackend(maxsize=2, max_tags=1)
+        cache = ResponseCache(backend)
+        for key in 'abc':
+            cache.set(key, cache.generation(), {f'actor:{key}'}, key)
+        self.assertEqual(len(backend), 2)
+        self.assertIsNone(cache.get('a'))
+        # evicting the version of actor:b must not make the entry of b look fresh
+        cache.invalidate('actor:b')
+        cache.invalidate('actor:c')
+        self.assertIsNone(cache.get('b'))
+
+    def test_redis_backend(self):
+        '''tests invalidation through a shared redis client'''
+        client = FakeRedis()
+        self.check_invalidation(RedisCacheBackend(client))
+        # a second worker sees the entries and the invalidations of the first
+        first, second = ResponseCache(RedisCacheBackend(client)), ResponseCache(RedisCacheBackend(client))
+        first.set('c', first.generation(), {'actor:3'}, 'response c')
+        self.assertEqual(second.get('c'), 'response c')
+        second.invalidate('actor:3')
+        self.assertIsNone(first.get('c'))
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()